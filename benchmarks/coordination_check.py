@@ -0,0 +1,271 @@
+"""
+Проверки координации экземпляров бота (utils.coordination).
+
+    python benchmarks/coordination_check.py                              # в памяти и на заглушке Redis
+    python benchmarks/coordination_check.py --url redis://127.0.0.1:6379/15   # ещё и на настоящем Redis
+
+Каждая проверка получает два координатора с общим состоянием — как два экземпляра бота.
+Для RESP запускается заглушка из benchmarks/resp_standin.py. Настоящий Redis по --url
+очищается командой FLUSHALL, поэтому указывайте отдельную базу.
+Код возврата 1, если хотя бы одна проверка не прошла.
+"""
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+import traceback
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Окружение задаётся до импорта модулей бота: config читает его при импорте
+_tmp_dir = tempfile.mkdtemp(prefix="runes_coordination_")
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("TRACE_FILE", os.path.join(_tmp_dir, "traces.jsonl"))
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+
+from utils.coordination import Coordinator, LocalBackend, RespBackend, LockTimeout  # noqa: E402
+from utils.singleflight import SingleFlight  # noqa: E402
+from benchmarks.resp_standin import RespStandIn  # noqa: E402
+
+# Короткая аренда, чтобы проверки смены ведущего шли быстро
+LEASE_TTL = 0.6
+
+CHECKS = {}
+
+
+def check(name: str):
+    """Регистрирует проверку: корутина получает два координатора с общим состоянием."""
+    def decorator(func):
+        CHECKS[name] = func
+        return func
+    return decorator
+
+
+@check("замок: в блоке не больше одного экземпляра")
+async def check_lock_exclusive(first, second):
+    inside = 0
+    most_inside = 0
+
+    async def worker(coordinator):
+        nonlocal inside, most_inside
+        async with coordinator.lock("shared", ttl=5):
+            inside += 1
+            most_inside = max(most_inside, inside)
+            await asyncio.sleep(0.005)
+            inside -= 1
+
+    await asyncio.gather(*(worker(first if number % 2 else second) for number in range(20)))
+    assert most_inside == 1, most_inside
+
+
+@check("замок: ожидание с таймаутом и истечение срока")
+async def check_lock_timeout(first, second):
+    async with first.lock("busy", ttl=5):
+        try:
+            async with second.lock("busy", ttl=5, timeout=0.1):
+                raise AssertionError("замок взят дважды")
+        except LockTimeout:
+            pass
+
+    # Экземпляр «упал» с замком: ключ остался, но истекает через ttl
+    assert await first.backend.set_if_absent(first._key("lock", "crashed"), "dead-worker", 0.2)
+    async with second.lock("crashed", ttl=5, timeout=2):
+        pass
+    # Чужой замок снять нельзя
+    assert await second.backend.set_if_absent(second._key("lock", "owned"), "owner", 5)
+    assert not await first.backend.release(first._key("lock", "owned"), "not-owner")
+
+
+@check("ведущий: один на всех, задачи только на нём")
+async def check_leader(first, second):
+    assert await first.campaign("jobs")
+    assert not await second.campaign("jobs")
+    assert first.is_leader("jobs") and not second.is_leader("jobs")
+
+    runs = []
+
+    async def job():
+        runs.append(1)
+        return "done"
+
+    assert await first.leader_only("jobs", job)() == "done"
+    assert await second.leader_only("jobs", job)() is None
+    assert len(runs) == 1
+
+    # Продление сохраняет роль дольше срока аренды
+    for _ in range(3):
+        await asyncio.sleep(LEASE_TTL / 3)
+        assert await first.campaign("jobs")
+        assert not await second.campaign("jobs")
+
+
+@check("ведущий: смена при остановке и при падении")
+async def check_failover(first, second):
+    assert await first.campaign("jobs")
+    await first.stop()
+    assert await second.campaign("jobs"), "остановленный ведущий отдаёт аренду сразу"
+
+    # Ведущий «упал» (не продлевает аренду): через срок аренды её забирает другой
+    await asyncio.sleep(LEASE_TTL + 0.1)
+    assert not second.is_leader("jobs"), "без продления роль считается потерянной"
+    third = Coordinator(second.backend, prefix=second.prefix, lease_ttl=LEASE_TTL)
+    assert await third.campaign("jobs")
+    assert not await second.campaign("jobs")
+
+
+@check("ведущий: фоновое продление")
+async def check_background_renewal(first, second):
+    first.leader_only("renewed", _noop)
+    second.leader_only("renewed", _noop)
+    await first.start()
+    await second.start()
+    await asyncio.sleep(LEASE_TTL * 2)
+    assert first.is_leader("renewed") != second.is_leader("renewed")
+
+
+async def _noop():
+    return None
+
+
+@check("общие счётчики")
+async def check_counters(first, second):
+    assert await first.incr("users") == 1
+    assert await second.incr("users", 2) == 3
+    assert await first.incr("users", -1) == 2
+    assert await second.get_counter("users") == 2
+
+    assert await first.incr("short", 5, ttl=0.2) == 5
+    await asyncio.sleep(0.3)
+    assert await second.get_counter("short") == 0
+
+
+@check("повторные запросы видны всем экземплярам")
+async def check_single_flight(first, second):
+    flights_first = SingleFlight(window=0.3, coordinator=first)
+    flights_second = SingleFlight(window=0.3, coordinator=second)
+    key = flights_first.make_key(7, 'fate', "Что меня ждёт?")
+
+    assert await flights_first.acquire(key)
+    assert not await flights_second.acquire(flights_second.make_key(7, 'fate', "  что меня   ждёт? "))
+    assert await flights_second.in_progress(key)
+    await flights_first.release(key)
+    assert not await flights_second.acquire(key), "окно после ответа"
+    assert not await flights_second.in_progress(key), "ответ уже отправлен"
+    await asyncio.sleep(0.4)
+    assert await flights_second.acquire(key)
+
+    # Ответ не доставлен (отмена, нехватка лимитов) — вопрос можно повторить сразу
+    await flights_second.release(key, delivered=False)
+    assert await flights_first.acquire(key)
+
+
+async def _run_checks(label: str, make_coordinators, reset) -> int:
+    failed = 0
+    for name, func in CHECKS.items():
+        await reset()
+        first, second = make_coordinators()
+        try:
+            await func(first, second)
+            print(f"ok    {label}: {name}")
+        except Exception:
+            failed += 1
+            print(f"FAIL  {label}: {name}")
+            traceback.print_exc()
+        finally:
+            await first.stop()
+            await second.stop()
+    return failed
+
+
+async def _check_reconnect() -> int:
+    """Клиент RESP переживает перезапуск сервера; замок без сервера не останавливает работу."""
+    server = RespStandIn()
+    await server.start()
+    coordinator = Coordinator(RespBackend(f"redis://127.0.0.1:{server.port}/0"), lease_ttl=LEASE_TTL)
+    try:
+        assert await coordinator.incr("restarts") == 1
+        await server.stop()
+        try:
+            await coordinator.incr("restarts")
+        except (OSError, EOFError):
+            pass
+        else:
+            raise AssertionError("сервер остановлен, но команда прошла")
+        async with coordinator.lock("offline", ttl=1):
+            pass
+        assert coordinator.errors == 1
+
+        port = server.port
+        server = RespStandIn()
+        await server.start(port=port)
+        assert await coordinator.incr("restarts") == 1
+        print("ok    resp: переподключение после перезапуска сервера")
+        return 0
+    except Exception:
+        print("FAIL  resp: переподключение после перезапуска сервера")
+        traceback.print_exc()
+        return 1
+    finally:
+        await coordinator.stop()
+        await server.stop()
+
+
+async def _main(url: str) -> int:
+    local = LocalBackend()
+
+    async def reset_local():
+        local._values.clear()
+
+    failed = await _run_checks(
+        "local",
+        lambda: (Coordinator(local, lease_ttl=LEASE_TTL), Coordinator(local, lease_ttl=LEASE_TTL)),
+        reset_local,
+    )
+
+    server = RespStandIn()
+    await server.start()
+    stand_in_url = f"redis://127.0.0.1:{server.port}/0"
+
+    async def reset_stand_in():
+        server.values.clear()
+
+    try:
+        failed += await _run_checks(
+            "resp",
+            lambda: (Coordinator(RespBackend(stand_in_url), lease_ttl=LEASE_TTL),
+                     Coordinator(RespBackend(stand_in_url), lease_ttl=LEASE_TTL)),
+            reset_stand_in,
+        )
+    finally:
+        await server.stop()
+    failed += await _check_reconnect()
+
+    if url:
+        async def reset_redis():
+            backend = RespBackend(url)
+            await backend.execute(("FLUSHALL",))
+            await backend.close()
+
+        failed += await _run_checks(
+            "redis",
+            lambda: (Coordinator(RespBackend(url), lease_ttl=LEASE_TTL),
+                     Coordinator(RespBackend(url), lease_ttl=LEASE_TTL)),
+            reset_redis,
+        )
+
+    print(f"\nНе прошло проверок: {failed}")
+    return 1 if failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Проверки координации экземпляров бота")
+    parser.add_argument('--url', default="", help="настоящий Redis для дополнительного прогона (будет очищен)")
+    args = parser.parse_args()
+    return asyncio.run(_main(args.url))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,415 @@
+"""
+Нагрузочный тест бота целиком: настоящее приложение из main против локальных
+заглушек Telegram Bot API, Yandex GPT и ЮКассы.
+
+    python benchmarks/load_test.py --users 10,50,200 --iterations 3
+    python benchmarks/load_test.py --users 100 --gpt-median-ms 2000 --gpt-sigma 0.6 --json result.json
+
+Каждый симулированный пользователь проходит сценарий
+/start → режим → вопрос → «Мои лимиты» → «Пополнить лимиты» → сумма → «Главное меню».
+Этап считается выполненным, когда бот прислал ожидаемое сообщение; время этапа —
+от отправки апдейта до этого сообщения. Для каждого числа пользователей выводятся
+пропускная способность, перцентили задержки по этапам и доля ошибок (таймаутов).
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parent.parent
+HOST = "127.0.0.1"
+BOT_TOKEN = "123456:LOADTEST"
+FAKE_GPT_TEXT = "Толкование для нагрузочного теста"
+
+
+def percentile(sorted_values: list, share: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(share * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class FakeServices:
+    """
+    Один HTTP-сервер с тремя заглушками:
+    /bot<token>/<method> — Bot API (getUpdates отдаёт апдейты симулированных пользователей),
+    /gpt — completion API с задержкой из логнормального распределения,
+    /yookassa/v3/payments — создание и проверка платежей.
+    """
+
+    def __init__(self, gpt_median_ms: float, gpt_sigma: float):
+        self.gpt_median = gpt_median_ms / 1000
+        self.gpt_sigma = gpt_sigma
+        self.port = None
+        self._runner = None
+        self._updates = []
+        self._updates_event = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._inboxes = defaultdict(asyncio.Queue)
+        self.bot_requests = defaultdict(int)
+        self.gpt_requests = 0
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=20 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle_bot)
+        app.router.add_post("/gpt", self.handle_gpt)
+        app.router.add_route("HEAD", "/", self.handle_head)
+        app.router.add_post("/yookassa/v3/payments", self.handle_create_payment)
+        app.router.add_get("/yookassa/v3/payments/{payment_id}", self.handle_get_payment)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, HOST, 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    @property
+    def url(self) -> str:
+        return f"http://{HOST}:{self.port}"
+
+    # Симулированные пользователи
+
+    def send_text(self, user_id: int, text: str) -> None:
+        """Ставит сообщение пользователя в очередь getUpdates."""
+        message = {
+            "message_id": self._next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self._next_message_id += 1
+        self._updates.append({"update_id": self._next_update_id, "message": message})
+        self._next_update_id += 1
+        self._updates_event.set()
+
+    def inbox(self, user_id: int) -> asyncio.Queue:
+        return self._inboxes[user_id]
+
+    # Bot API
+
+    async def handle_bot(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.bot_requests[method] += 1
+        # python-telegram-bot отправляет параметры формой (multipart, если есть файлы)
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+        if method == "getMe":
+            return self._ok({"id": 123456, "is_bot": True, "first_name": "Runes", "username": "runes_load_bot"})
+        if method in ("sendMessage", "sendPhoto"):
+            return self._ok(self._record_message(method, params))
+        return self._ok(True)
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get("limit") or 100)]
+
+    def _record_message(self, method: str, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 123456, "is_bot": True, "first_name": "Runes"},
+        }
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": f"photo-{message_id}", "file_unique_id": f"u{message_id}",
+                                 "width": 1, "height": 1}]
+        else:
+            message["text"] = params.get("text", "")
+        self._inboxes[chat_id].put_nowait((time.perf_counter(), method, params.get("text") or ""))
+        return message
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    # Yandex GPT
+
+    async def handle_gpt(self, request: web.Request) -> web.Response:
+        self.gpt_requests += 1
+        await request.read()
+        await asyncio.sleep(random.lognormvariate(0, self.gpt_sigma) * self.gpt_median)
+        return web.json_response({"result": {"alternatives": [{"message": {"text": FAKE_GPT_TEXT}}]}})
+
+    async def handle_head(self, request: web.Request) -> web.Response:
+        return web.Response()
+
+    # ЮКасса
+
+    async def handle_create_payment(self, request: web.Request) -> web.Response:
+        await request.read()
+        payment_id = str(uuid.uuid4())
+        return web.json_response({
+            "id": payment_id,
+            "status": "pending",
+            "confirmation": {"type": "redirect", "confirmation_url": f"https://pay.local/{payment_id}"},
+        })
+
+    async def handle_get_payment(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "id": request.match_info["payment_id"],
+            "status": "pending",
+            "amount": {"value": "100.00", "currency": "RUB"},
+            "metadata": {},
+        })
+
+
+def _text_is(expected: str):
+    return lambda method, text: text == expected
+
+
+def _text_has(fragment: str):
+    return lambda method, text: fragment in text
+
+
+MENU = _text_is("Выберите действие:")
+
+# Сценарий: (этап, сообщение пользователя, ожидаемые ответы бота по порядку)
+SCENARIO = [
+    ("start", "/start", [MENU]),
+    ("mode", "Три руны", [_text_has("Стоимость")]),
+    ("question", None, [_text_is(FAKE_GPT_TEXT), MENU]),
+    ("limits", "Мои лимиты", [_text_has("Ваши лимиты")]),
+    ("payment_menu", "Пополнить лимиты", [_text_has("Введите целое число")]),
+    ("payment_link", "100", [_text_has("Ссылка на оплату")]),
+    ("back_to_menu", "Главное меню", [MENU]),
+]
+
+QUESTIONS = ["Что меня ждёт в работе?", "Стоит ли переезжать?", "Как наладить отношения?", "Что мешает мне сейчас?"]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.latencies[stage].append(seconds)
+
+    def error(self, stage: str) -> None:
+        self.errors[stage] += 1
+
+
+async def _wait_for(inbox: asyncio.Queue, predicates: list, timeout: float) -> float:
+    """Ждёт сообщения бота, подходящие под predicates по порядку; возвращает время последнего."""
+    deadline = time.perf_counter() + timeout
+    received_at = None
+    for predicate in predicates:
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            received_at, method, text = await asyncio.wait_for(inbox.get(), timeout=remaining)
+            if predicate(method, text):
+                break
+    return received_at
+
+
+async def simulate_user(services: FakeServices, user_id: int, iterations: int, think_time: float,
+                        timeout: float, stats: Stats) -> None:
+    inbox = services.inbox(user_id)
+    for iteration in range(iterations):
+        for stage, text, predicates in SCENARIO:
+            await asyncio.sleep(random.uniform(0, think_time))
+            while not inbox.empty():
+                inbox.get_nowait()
+
+            sent_at = time.perf_counter()
+            # Номер круга делает вопрос уникальным: повтор того же вопроса бот отбросит как дубль
+            services.send_text(user_id, text or f"{random.choice(QUESTIONS)} ({iteration + 1})")
+            try:
+                received_at = await _wait_for(inbox, predicates, timeout)
+                stats.add(stage, received_at - sent_at)
+            except asyncio.TimeoutError:
+                stats.error(stage)
+                # Возвращаемся в исходное состояние и идём на следующий круг
+                services.send_text(user_id, "/menu")
+                await asyncio.sleep(0.5)
+                break
+
+
+def seed_users(db_path: str, user_ids: list) -> None:
+    """Заранее создаёт подписчиков с большим балансом, чтобы гадания не упирались в лимиты."""
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO subscribers (user_id, first_seen, limits, public_id) VALUES (?, ?, ?, ?)",
+            [(user_id, int(time.time()), 1_000_000, f"RUNES-LOAD{user_id}") for user_id in user_ids]
+        )
+
+
+async def run_round(services: FakeServices, users: int, first_user_id: int, args) -> dict:
+    user_ids = list(range(first_user_id, first_user_id + users))
+    seed_users(os.environ["SQLITE_DB"], user_ids)
+    stats = Stats()
+    gpt_before = services.gpt_requests
+    bot_before = sum(services.bot_requests.values())
+
+    started = time.perf_counter()
+
+    async def ramped(index: int, user_id: int):
+        await asyncio.sleep(args.ramp_up * index / users)
+        await simulate_user(services, user_id, args.iterations, args.think_time, args.timeout, stats)
+
+    await asyncio.gather(*(ramped(index, user_id) for index, user_id in enumerate(user_ids)))
+    elapsed = time.perf_counter() - started
+
+    stages = {}
+    for stage, _, _ in SCENARIO:
+        values = sorted(stats.latencies[stage])
+        done = len(values)
+        failed = stats.errors[stage]
+        stages[stage] = {
+            "ok": done,
+            "errors": failed,
+            "error_rate": failed / (done + failed) if done + failed else 0.0,
+            "p50_ms": percentile(values, 0.5) * 1000,
+            "p90_ms": percentile(values, 0.9) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": (values[-1] if values else 0) * 1000,
+        }
+
+    completed = sum(stage["ok"] for stage in stages.values())
+    return {
+        "users": users,
+        "elapsed_s": elapsed,
+        "stages_per_s": completed / elapsed,
+        "divinations_per_s": stages["question"]["ok"] / elapsed,
+        "bot_api_requests_per_s": (sum(services.bot_requests.values()) - bot_before) / elapsed,
+        "gpt_requests": services.gpt_requests - gpt_before,
+        "stages": stages,
+    }
+
+
+def print_round(result: dict) -> None:
+    print()
+    print(
+        f"Пользователей: {result['users']}, время: {result['elapsed_s']:.1f} с, "
+        f"этапов/с: {result['stages_per_s']:.1f}, гаданий/с: {result['divinations_per_s']:.2f}, "
+        f"запросов к Bot API/с: {result['bot_api_requests_per_s']:.1f}"
+    )
+    print(f"{'этап':<14} {'ok':>6} {'ошибки':>7} {'p50 мс':>9} {'p90 мс':>9} {'p99 мс':>9} {'max мс':>9}")
+    for stage, data in result["stages"].items():
+        print(
+            f"{stage:<14} {data['ok']:>6} {data['error_rate']:>7.1%} {data['p50_ms']:>9.1f} "
+            f"{data['p90_ms']:>9.1f} {data['p99_ms']:>9.1f} {data['max_ms']:>9.1f}"
+        )
+
+
+async def main_async(args) -> list:
+    services = FakeServices(args.gpt_median_ms, args.gpt_sigma)
+    await services.start()
+
+    # Окружение задаётся до импорта модулей бота: config читает его при импорте
+    db_dir = tempfile.mkdtemp(prefix="runes_load_")
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+        "ADMIN_ID": "1",
+        "SQLITE_DB": os.path.join(db_dir, "load.db"),
+        "BOT_MODE": "polling",
+        "POLLING_TIMEOUT": "10",
+        "BOT_API_BASE_URL": f"{services.url}/bot",
+        "YANDEX_GPT_URL": f"{services.url}/gpt",
+        "YANDEX_API_KEY": "load",
+        "YANDEX_FOLDER_ID": "load",
+        "YOOKASSA_API_URL": f"{services.url}/yookassa/v3",
+        "YOOKASSA_SHOP_ID": "load",
+        "YOOKASSA_SECRET_KEY": "load",
+        "TRACE_FILE": os.path.join(db_dir, "traces.jsonl"),
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Допуск гаданий не ограничивает нагрузку, если его не задали явно
+    os.environ.setdefault("USER_DIVINATIONS_PER_MINUTE", "0")
+    os.environ.setdefault("GPT_REQUESTS_PER_SECOND", "0")
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)
+
+    import main
+    from utils.storage import init_db
+    from utils.sessions import session_store
+    from utils.payment_poller import payment_poller
+    from utils.gpt import close_gpt_session
+    from utils.yookassa_service import close_yookassa_session
+
+    await init_db()
+    application = main.build_application()
+    main.setup_handlers(application)
+    session_store.attach(application)
+
+    await application.initialize()
+    await application.start()
+    await main.start_receiving_updates(application)
+    payment_poller.start(application.bot)
+
+    results = []
+    try:
+        first_user_id = 10_000
+        for users in args.users:
+            result = await run_round(services, users, first_user_id, args)
+            first_user_id += users
+            print_round(result)
+            results.append(result)
+    finally:
+        await payment_poller.stop()
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await close_gpt_session()
+        await close_yookassa_session()
+        await services.stop()
+    return results
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушками Bot API, GPT и ЮКассы")
+    parser.add_argument("--users", default="10,50",
+                        type=lambda value: [int(item) for item in value.split(",")],
+                        help="числа одновременных пользователей через запятую, по раунду на каждое")
+    parser.add_argument("--iterations", type=int, default=2, help="сколько раз каждый пользователь проходит сценарий")
+    parser.add_argument("--think-time", type=float, default=0.5, help="максимальная пауза пользователя между шагами, с")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать ответа на шаг, с")
+    parser.add_argument("--gpt-median-ms", type=float, default=1500, help="медиана задержки заглушки GPT, мс")
+    parser.add_argument("--gpt-sigma", type=float, default=0.5, help="разброс задержки GPT (sigma логнормального)")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(main_async(args))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    return 0 if all(stage["errors"] == 0 for result in results for stage in result["stages"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Локальная заглушка сервера Redis для проверки координации без настоящего Redis.
+
+    python benchmarks/resp_standin.py --port 6390
+    COORDINATION_URL=redis://127.0.0.1:6390/0 python main.py    # несколько экземпляров бота на одной машине
+
+Понимает протокол RESP и только те команды, которые отправляет utils.coordination:
+PING, AUTH, SELECT, SET (NX, XX, PX, EX), GET, DEL, INCRBY, PEXPIRE, PTTL, FLUSHALL и EVAL
+двух скриптов координации (они выполняются здесь кодом на Python).
+"""
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from utils.coordination import RENEW_SCRIPT, RELEASE_SCRIPT  # noqa: E402
+
+
+class RespStandIn:
+    """Сервер RESP в памяти процесса: ключи со сроком жизни, одна база на всех."""
+
+    def __init__(self):
+        # ключ -> (значение, момент истечения по time.monotonic() или None)
+        self.values: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.commands = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self.port = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """Останавливает сервер и рвёт открытые соединения, как при падении Redis."""
+        for writer in list(self._clients):
+            writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    # Значения
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry[0]
+
+    def _pexpire(self, key: bytes, milliseconds: int) -> int:
+        value = self._get(key)
+        if value is None:
+            return 0
+        self.values[key] = (value, time.monotonic() + milliseconds / 1000)
+        return 1
+
+    # Протокол
+
+    @staticmethod
+    def _reply(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, Exception):
+            return b"-ERR %s\r\n" % str(value).encode()
+        if isinstance(value, str):
+            return b"+%s\r\n" % value.encode()
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[list]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                self.commands += 1
+                try:
+                    reply = self.execute(command)
+                except Exception as e:
+                    reply = e
+                writer.write(self._reply(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def execute(self, command: list):
+        name, args = command[0].upper(), command[1:]
+        if name == b"PING":
+            return "PONG"
+        if name in (b"AUTH", b"SELECT"):
+            return "OK"
+        if name == b"FLUSHALL":
+            self.values.clear()
+            return "OK"
+        if name == b"GET":
+            return self._get(args[0])
+        if name == b"SET":
+            return self._set(args)
+        if name == b"DEL":
+            deleted = 0
+            for key in args:
+                if self._get(key) is not None:
+                    del self.values[key]
+                    deleted += 1
+            return deleted
+        if name == b"INCRBY":
+            value = int(self._get(args[0]) or 0) + int(args[1])
+            expires_at = self.values.get(args[0], (None, None))[1]
+            self.values[args[0]] = (str(value).encode(), expires_at)
+            return value
+        if name == b"PEXPIRE":
+            return self._pexpire(args[0], int(args[1]))
+        if name == b"PTTL":
+            if self._get(args[0]) is None:
+                return -2
+            expires_at = self.values[args[0]][1]
+            return -1 if expires_at is None else int((expires_at - time.monotonic()) * 1000)
+        if name == b"EVAL":
+            return self._eval(args[0].decode(), args[2:2 + int(args[1])], args[2 + int(args[1]):])
+        raise ValueError(f"unknown command '{name.decode()}'")
+
+    def _set(self, args: list):
+        key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+        exists = self._get(key) is not None
+        if (b"NX" in options and exists) or (b"XX" in options and not exists):
+            return None
+        expires_at = None
+        for unit, scale in ((b"PX", 1000), (b"EX", 1)):
+            if unit in options:
+                expires_at = time.monotonic() + int(args[2 + options.index(unit) + 1]) / scale
+        self.values[key] = (value, expires_at)
+        return "OK"
+
+    def _eval(self, script: str, keys: list, argv: list):
+        if script == RENEW_SCRIPT:
+            return self._pexpire(keys[0], int(argv[1])) if self._get(keys[0]) == argv[0] else 0
+        if script == RELEASE_SCRIPT:
+            if self._get(keys[0]) != argv[0]:
+                return 0
+            del self.values[keys[0]]
+            return 1
+        raise ValueError("script is not supported by the stand-in")
+
+
+async def _serve_forever(host: str, port: int) -> None:
+    server = RespStandIn()
+    await server.start(host, port)
+    print(f"Заглушка Redis слушает {host}:{server.port}")
+    await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальная заглушка сервера Redis для координации")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
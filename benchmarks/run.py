@@ -0,0 +1,406 @@
+"""
+Микробенчмарки горячих функций бота.
+
+    python benchmarks/run.py                              # прогнать всё и вывести таблицу
+    python benchmarks/run.py --save benchmarks/baseline.json
+    python benchmarks/run.py --compare benchmarks/baseline.json --threshold 0.2
+    python benchmarks/run.py --filter db.
+
+База данных — временный файл SQLite с реалистичным числом строк, HTTP-запросы к GPT
+и Bot API заменены заглушками. При --compare код возврата 1, если хотя бы один
+бенчмарк медленнее базового больше чем на threshold.
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import sqlite3
+import asyncio
+import secrets
+import platform
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Окружение задаётся до импорта модулей бота: config читает его при импорте
+_db_dir = tempfile.mkdtemp(prefix="runes_bench_")
+os.environ["SQLITE_DB"] = os.path.join(_db_dir, "bench.db")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("TRACE_FILE", os.path.join(_db_dir, "traces.jsonl"))
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+
+from utils import database  # noqa: E402
+from utils import gpt  # noqa: E402
+from utils.runes import get_random_runes, get_random_one_rune  # noqa: E402
+from utils.history import encode_reading  # noqa: E402
+from handlers import admin  # noqa: E402
+from utils.admission import AdmissionControl  # noqa: E402
+
+# Реалистичный объём данных
+SUBSCRIBERS = 10_000
+DIVINATIONS = 100_000
+PENDING_PAYMENTS = 1_000
+BROADCAST_SUBSCRIBERS = 2_000
+
+BENCHMARKS = {}
+
+
+def bench(name: str, number: int):
+    """Регистрирует бенчмарк: корутина-фабрика, одна итерация — одна операция."""
+    def decorator(func):
+        BENCHMARKS[name] = (func, number)
+        return func
+    return decorator
+
+
+# Данные
+
+def seed_database() -> list:
+    """Заполняет базу и возвращает public_id всех подписчиков."""
+    with sqlite3.connect(os.environ["SQLITE_DB"]) as conn:
+        public_ids = [f"RUNES-{secrets.token_hex(3).upper()}{user_id}" for user_id in range(SUBSCRIBERS)]
+        conn.executemany(
+            "INSERT INTO subscribers (user_id, first_seen, limits, public_id) VALUES (?, ?, ?, ?)",
+            [(1000 + i, 1704067200, 50, public_id) for i, public_id in enumerate(public_ids)]
+        )
+        type_ids = range(1, len(database.DIVINATION_TYPES) + 1)
+        conn.executemany(
+            "INSERT INTO divinations (user_id, created_at, type_id) VALUES (?, ?, ?)",
+            [(1000 + random.randrange(SUBSCRIBERS), 1704067200 + i * 60, random.choice(type_ids))
+             for i in range(DIVINATIONS)]
+        )
+        spread, question, answer = encode_reading("Что меня ждёт?", None, "Толкование расклада. " * 50)
+        conn.execute(
+            "INSERT INTO divination_history (id, user_id, spread, question, answer) "
+            "SELECT id, user_id, ?, ?, ? FROM divinations",
+            (spread, question, answer)
+        )
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO pending_payments (payment_id, user_id, public_id, amount, chat_id, created_at, next_check_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(f"pay-{i}", 1000 + i, public_ids[i], 100, 1000 + i, now, now + random.uniform(-60, 600))
+             for i in range(PENDING_PAYMENTS)]
+        )
+    return public_ids
+
+
+class _Counter:
+    def __init__(self):
+        self.value = 0
+
+    def next(self) -> int:
+        self.value += 1
+        return self.value
+
+
+_ids = _Counter()
+PUBLIC_IDS: list = []
+
+
+def _user_id() -> int:
+    return 1000 + random.randrange(SUBSCRIBERS)
+
+
+# Руны
+
+@bench("runes.get_random_one_rune", 2000)
+async def bench_one_rune():
+    await get_random_one_rune()
+
+
+@bench("runes.get_random_runes(3)", 2000)
+async def bench_three_runes():
+    await get_random_runes(3)
+
+
+@bench("runes.get_random_runes(12)", 2000)
+async def bench_twelve_runes():
+    await get_random_runes(12)
+
+
+# Допуск гаданий: корзины всех пользователей в памяти, общая корзина почти всегда пуста
+
+_admission = AdmissionControl(user_per_minute=6, user_burst=3, gpt_per_second=10, gpt_burst=20)
+
+
+@bench("admission.check", 20000)
+async def bench_admission_check():
+    _admission.check(_user_id())
+
+
+# GPT: собирается промпт и тело запроса, HTTP-запрос заменён заглушкой
+
+class _FakeResponse:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self):
+        return {"result": {"alternatives": [{"message": {"text": "ответ"}}]}}
+
+
+class _FakeSession:
+    closed = False
+
+    def post(self, url, headers=None, json=None):
+        return _FakeResponse()
+
+
+@bench("gpt.ask_gpt(one_rune)", 5000)
+async def bench_ask_gpt_one():
+    await gpt.ask_gpt("Что меня ждёт?", {"name": "Феху"}, "one_rune")
+
+
+@bench("gpt.ask_gpt(field)", 5000)
+async def bench_ask_gpt_field():
+    await gpt.ask_gpt("Что меня ждёт?", [{"name": f"Руна {i}"} for i in range(12)], "field")
+
+
+# База данных
+
+@bench("db.save_subscriber(existing)", 300)
+async def bench_save_subscriber():
+    await database.save_subscriber(_user_id())
+
+
+@bench("db.get_subscribers", 20)
+async def bench_get_subscribers():
+    await database.get_subscribers()
+
+
+@bench("db.save_divination", 300)
+async def bench_save_divination():
+    await database.save_divination(_user_id(), "three_runes")
+
+
+@bench("db.top_up_limits", 300)
+async def bench_top_up_limits():
+    await database.top_up_limits(random.choice(PUBLIC_IDS), 1)
+
+
+@bench("db.get_user_limits", 300)
+async def bench_get_user_limits():
+    await database.get_user_limits(random.choice(PUBLIC_IDS))
+
+
+@bench("db.get_user_info_by_user_id", 300)
+async def bench_get_user_info():
+    await database.get_user_info_by_user_id(_user_id())
+
+
+@bench("db.deduct_limits", 300)
+async def bench_deduct_limits():
+    await database.deduct_limits(_user_id(), 1)
+
+
+@bench("db.add_limits", 300)
+async def bench_add_limits():
+    await database.add_limits(_user_id(), 1)
+
+
+@bench("db.save_user_states(100)", 50)
+async def bench_save_user_states():
+    rows = [(_user_id(), 1, 1, b"\x01\x02\x03", None, 0, None) for _ in range(100)]
+    await database.save_user_states(rows, [])
+
+
+@bench("db.load_user_state", 300)
+async def bench_load_user_state():
+    await database.load_user_state(_user_id())
+
+
+@bench("db.add_pending_payment", 300)
+async def bench_add_pending_payment():
+    now = time.time()
+    await database.add_pending_payment(f"bench-{_ids.next()}", _user_id(), "RUNES-X", 100, None, now, now + 600)
+
+
+@bench("db.get_due_payments(50)", 300)
+async def bench_get_due_payments():
+    await database.get_due_payments(time.time(), 50)
+
+
+@bench("db.get_next_payment_check_at", 300)
+async def bench_get_next_payment_check_at():
+    await database.get_next_payment_check_at()
+
+
+@bench("db.update_pending_payments(50)", 100)
+async def bench_update_pending_payments():
+    now = time.time()
+    rows = [(now + 600, 1, f"pay-{random.randrange(PENDING_PAYMENTS)}") for _ in range(50)]
+    await database.update_pending_payments(rows, [])
+
+
+@bench("db.get_pending_payment", 300)
+async def bench_get_pending_payment():
+    await database.get_pending_payment(f"pay-{random.randrange(PENDING_PAYMENTS)}")
+
+
+@bench("db.credit_payment", 300)
+async def bench_credit_payment():
+    await database.credit_payment(f"credit-{_ids.next()}", _user_id(), 10, time.time())
+
+
+@bench("db.get_daily_stats(30)", 300)
+async def bench_get_daily_stats():
+    await database.get_daily_stats(30)
+
+
+@bench("db.get_history_page", 300)
+async def bench_get_history_page():
+    await database.get_history_page(_user_id(), 5)
+
+
+@bench("db.get_history_entry", 300)
+async def bench_get_history_entry():
+    await database.get_history_entry(_user_id(), random.randrange(1, DIVINATIONS))
+
+
+@bench("db.bulk_top_up_limits(1000)", 10)
+async def bench_bulk_top_up():
+    entries = [(public_id, 1) for public_id in random.sample(PUBLIC_IDS, 1000)]
+    await database.bulk_top_up_limits(entries, 500)
+
+
+# Рассылка администратора через заглушку бота (без паузы между сообщениями)
+
+class _FakeBot:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+async def _no_sleep(delay, *args):
+    return None
+
+
+@bench(f"admin.broadcast({BROADCAST_SUBSCRIBERS} subscribers)", 3)
+async def bench_broadcast():
+    bot = _FakeBot()
+    message = types.SimpleNamespace(
+        text="Новость", caption=None, photo=None, video=None,
+        reply_text=lambda *args, **kwargs: _no_sleep(0),
+    )
+    update = types.SimpleNamespace(effective_user=types.SimpleNamespace(id=admin.ADMIN_ID), message=message)
+    context = types.SimpleNamespace(bot=bot, user_data={"admin_state": admin.WAITING_FOR_BROADCAST})
+    await admin.handle_forwarded_message(update, context)
+
+
+# Запуск
+
+async def run_one(func, number: int, repeat: int) -> dict:
+    """Повторяет бенчмарк repeat раз по number операций; время — на одну операцию."""
+    await func()  # прогрев
+    per_op = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            await func()
+        per_op.append((time.perf_counter() - started) / number * 1e6)
+    return {
+        "median_us": round(statistics.median(per_op), 3),
+        "min_us": round(min(per_op), 3),
+        "ops": number,
+        "repeat": repeat,
+    }
+
+
+async def run_all(selected: list, repeat: int) -> dict:
+    global PUBLIC_IDS
+    await database.init_db()
+    PUBLIC_IDS = seed_database()
+
+    gpt._session = _FakeSession()
+    broadcast_subscribers = [1000 + i for i in range(BROADCAST_SUBSCRIBERS)]
+
+    async def get_broadcast_subscribers():
+        return broadcast_subscribers
+
+    admin.get_subscribers = get_broadcast_subscribers
+    admin.asyncio = types.SimpleNamespace(sleep=_no_sleep)
+
+    results = {}
+    for name in selected:
+        func, number = BENCHMARKS[name]
+        results[name] = await run_one(func, number, repeat)
+        print(f"{name:<45} {results[name]['median_us']:>12.1f} мкс/оп", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Возвращает бенчмарки, ставшие медленнее базовых больше чем на threshold."""
+    regressions = []
+    print()
+    print(f"{'бенчмарк':<45} {'база':>12} {'сейчас':>12} {'изм.':>8}")
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:<45} {'—':>12} {result['median_us']:>12.1f} {'новый':>8}")
+            continue
+        change = result["median_us"] / base["median_us"] - 1
+        mark = ""
+        if change > threshold:
+            regressions.append(name)
+            mark = "  РЕГРЕССИЯ"
+        print(f"{name:<45} {base['median_us']:>12.1f} {result['median_us']:>12.1f} {change:>+8.1%}{mark}")
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки бота")
+    parser.add_argument("--filter", default="", help="запускать только бенчмарки, в имени которых есть строка")
+    parser.add_argument("--repeat", type=int, default=5, help="сколько раз повторить каждый бенчмарк")
+    parser.add_argument("--save", help="сохранить результаты как базовые в JSON-файл")
+    parser.add_argument("--compare", help="сравнить с базовыми результатами из JSON-файла")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    selected = [name for name in BENCHMARKS if args.filter in name]
+    results = asyncio.run(run_all(selected, args.repeat))
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "subscribers": SUBSCRIBERS,
+            "divinations": DIVINATIONS,
+        },
+        "results": results,
+    }
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"\nБазовые результаты сохранены в {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nРегрессии ({len(regressions)}): {', '.join(regressions)}")
+            return 1
+        print("\nРегрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""
+Общие проверки хранилища: обе реализации (utils.database и utils.postgres) должны вести себя одинаково.
+
+    python benchmarks/storage_conformance.py                      # SQLite во временном файле
+    python benchmarks/storage_conformance.py --backend postgres   # PostgreSQL из POSTGRES_DSN
+    python benchmarks/storage_conformance.py --backend postgres --dsn postgresql://postgres@localhost/postgres
+
+Для PostgreSQL создаётся временная схема conformance_<случайный суффикс>, после прогона она удаляется.
+Проверки идут по порядку на одной базе, каждая со своими пользователями и платежами.
+Код возврата 1, если хотя бы одна проверка не прошла.
+"""
+import os
+import sys
+import time
+import secrets
+import asyncio
+import argparse
+import tempfile
+import traceback
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Окружение задаётся до импорта модулей бота: config читает его при импорте
+_db_dir = tempfile.mkdtemp(prefix="runes_storage_")
+os.environ["SQLITE_DB"] = os.path.join(_db_dir, "conformance.db")
+os.environ["ADMIN_ID"] = "1"
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+os.environ.setdefault("TRACE_FILE", os.path.join(_db_dir, "traces.jsonl"))
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+
+from utils.history import pack_text, unpack_text  # noqa: E402
+from config import POSTGRES_DSN  # noqa: E402
+
+CHECKS = {}
+
+
+def check(name: str):
+    """Регистрирует проверку: корутина получает хранилище и падает с AssertionError при расхождении."""
+    def decorator(func):
+        CHECKS[name] = func
+        return func
+    return decorator
+
+
+def _history(question: str, answer: str = "ответ", spread: bytes | None = None) -> tuple:
+    return (spread, pack_text(question), pack_text(answer))
+
+
+async def _limits(storage, user_id: int) -> int:
+    return (await storage.get_user_info_by_user_id(user_id))[2]
+
+
+@check("подписчики")
+async def check_subscribers(storage):
+    await storage.save_subscriber(1)
+    await storage.save_subscriber(101)
+    await storage.save_subscriber(101)
+
+    ok, public_id, limits = await storage.get_user_info_by_user_id(101)
+    assert ok and public_id.startswith("RUNES-") and limits == 50, (ok, public_id, limits)
+    assert await storage.get_user_info_by_user_id(999_999) == (False, "", 0)
+
+    subscribers = await storage.get_subscribers()
+    assert subscribers.count(101) == 1 and 1 not in subscribers, subscribers
+
+
+@check("лимиты по public_id")
+async def check_public_id(storage):
+    await storage.save_subscriber(102)
+    _, public_id, _ = await storage.get_user_info_by_user_id(102)
+
+    assert await storage.get_user_limits(f" {public_id.lower()} ") == (True, 50, 102)
+    assert await storage.top_up_limits(public_id.lower(), 7) == (True, 102)
+    assert await storage.get_user_limits(public_id) == (True, 57, 102)
+    assert await storage.top_up_limits("RUNES-NONE00", 1) == (False, None)
+    assert await storage.get_user_limits("RUNES-NONE00") == (False, 0, None)
+
+
+@check("списание, возврат и ежедневный сброс лимитов")
+async def check_limits(storage):
+    await storage.save_subscriber(103)
+    await storage.save_subscriber(104)
+
+    assert await storage.deduct_limits(103, 30) is True
+    assert await storage.deduct_limits(103, 21) is False
+    assert await _limits(storage, 103) == 20
+    assert await storage.deduct_limits(999_999, 1) is False
+
+    assert await storage.add_limits(103, 5) is True
+    assert await storage.add_limits(104, 10) is True
+    assert await storage.add_limits(999_999, 1) is False
+    assert await _limits(storage, 103) == 25
+
+    assert await storage.reset_daily_limits(50) is True
+    assert await _limits(storage, 103) == 50
+    assert await _limits(storage, 104) == 60
+
+
+@check("параллельные списания не уводят лимиты в минус")
+async def check_concurrent_deduct(storage):
+    await storage.save_subscriber(116)
+    results = await asyncio.gather(*(storage.deduct_limits(116, 7) for _ in range(20)))
+    assert results.count(True) == 50 // 7, results
+    assert await _limits(storage, 116) == 50 % 7
+
+
+@check("массовое пополнение")
+async def check_bulk_top_up(storage):
+    await storage.save_subscriber(105)
+    await storage.save_subscriber(106)
+    _, first, _ = await storage.get_user_info_by_user_id(105)
+    _, second, _ = await storage.get_user_info_by_user_id(106)
+
+    ok, credited, not_found = await storage.bulk_top_up_limits([(first, 3), ("RUNES-NONE01", 4), (second, 5)], 2)
+    assert ok, (credited, not_found)
+    assert sorted(tuple(row) for row in credited) == [(105, first, 3), (106, second, 5)], credited
+    assert list(not_found) == ["RUNES-NONE01"], not_found
+    assert await _limits(storage, 105) == 53
+    assert await _limits(storage, 106) == 55
+
+
+@check("история гаданий")
+async def check_history(storage):
+    started = int(time.time())
+    types = ('one_rune', 'three_runes', 'four_runes', 'fate', 'field')
+    for number in range(12):
+        await storage.save_divination(107, types[number % len(types)], _history(f"вопрос {number}"))
+    # Гадание без истории в список не попадает
+    await storage.save_divination(107, 'fate')
+
+    rows, has_newer, has_older = await storage.get_history_page(107, 5)
+    assert [unpack_text(row[3]) for row in rows] == [f"вопрос {number}" for number in range(11, 6, -1)]
+    assert (has_newer, has_older) == (False, True)
+    assert all(isinstance(row[1], int) and started - 5 <= row[1] <= time.time() + 5 for row in rows), rows
+    assert rows[0][2] == types[11 % len(types)]
+    first_page = rows
+
+    rows, has_newer, has_older = await storage.get_history_page(107, 5, before_id=first_page[-1][0])
+    assert [unpack_text(row[3]) for row in rows] == [f"вопрос {number}" for number in range(6, 1, -1)]
+    assert (has_newer, has_older) == (True, True)
+    second_page = rows
+
+    rows, has_newer, has_older = await storage.get_history_page(107, 5, before_id=second_page[-1][0])
+    assert [unpack_text(row[3]) for row in rows] == ["вопрос 1", "вопрос 0"]
+    assert (has_newer, has_older) == (True, False)
+
+    page = await storage.get_history_page(107, 5, after_id=rows[0][0])
+    assert [tuple(row) for row in page[0]] == [tuple(row) for row in second_page]
+    # Новее второй страницы ровно limit гаданий — это первая страница
+    page = await storage.get_history_page(107, 5, after_id=second_page[0][0])
+    assert [tuple(row) for row in page[0]] == [tuple(row) for row in first_page]
+    page = await storage.get_history_page(107, 5, after_id=first_page[2][0])
+    assert [tuple(row) for row in page[0]] == [tuple(row) for row in first_page]
+
+    await storage.save_divination(107, 'three_runes', _history("с рунами", "длинный ответ " * 50, b"\x01\x02\x03"))
+    rows, _, _ = await storage.get_history_page(107, 1)
+    entry = await storage.get_history_entry(107, rows[0][0])
+    assert entry[0] == rows[0][0] and entry[2] == 'three_runes' and entry[3] == b"\x01\x02\x03", entry
+    assert unpack_text(entry[4]) == "с рунами" and unpack_text(entry[5]) == "длинный ответ " * 50
+
+    # Чужие гадания не видны
+    assert await storage.get_history_entry(108, rows[0][0]) is None
+    assert await storage.get_history_page(108, 5) == ([], False, False)
+
+
+@check("новый вид гадания")
+async def check_new_divination_type(storage):
+    await storage.save_divination(109, 'new_kind', _history("новый вид"))
+    rows, _, _ = await storage.get_history_page(109, 5)
+    assert [row[2] for row in rows] == ['new_kind'], rows
+    assert (await storage.get_user_info_by_user_id(109))[0], "пользователь добавляется вместе с гаданием"
+    assert (await storage.get_daily_stats(1))['by_type'].get('new_kind') == 1
+
+
+@check("состояние диалогов")
+async def check_user_state(storage):
+    assert await storage.save_user_states(
+        [(110, 1, 2, b"\x00\x01", None, 3, '{"step": 1}'), (111, 0, 0, None, 5, 0, None)], []
+    )
+    assert await storage.load_user_state(110) == (1, 2, b"\x00\x01", None, 3, '{"step": 1}')
+    assert await storage.load_user_state(111) == (0, 0, None, 5, 0, None)
+
+    assert await storage.save_user_states([(110, 2, 0, None, None, 0, None)], [111])
+    assert await storage.load_user_state(110) == (2, 0, None, None, 0, None)
+    assert await storage.load_user_state(111) is None
+    assert await storage.load_user_state(999_999) is None
+
+
+@check("очередь проверки платежей")
+async def check_pending_payments(storage):
+    now = time.time()
+    for payment_id, due in (("due-1", now - 10), ("due-2", now - 5), ("later-1", now + 1000)):
+        assert await storage.add_pending_payment(payment_id, 112, "RUNES-000000", 100.0, 112, now - 60, due)
+    # Повторная постановка в очередь не создаёт дубликат
+    assert await storage.add_pending_payment("due-1", 112, "RUNES-000000", 100.0, 112, now - 60, now - 10)
+
+    due = await storage.get_due_payments(now, 10)
+    assert [payment['payment_id'] for payment in due] == ["due-1", "due-2"], due
+    assert due[0] == {
+        'payment_id': "due-1", 'user_id': 112, 'public_id': "RUNES-000000", 'amount': 100.0,
+        'chat_id': 112, 'created_at': now - 60, 'attempts': 0,
+    }, due[0]
+    assert [payment['payment_id'] for payment in await storage.get_due_payments(now, 1)] == ["due-1"]
+    assert await storage.get_next_payment_check_at() == now - 10
+
+    assert await storage.update_pending_payments([(now + 500, 1, "due-1")], ["due-2"])
+    assert await storage.get_due_payments(now, 10) == []
+    assert await storage.get_pending_payment("due-2") is None
+    assert await storage.get_pending_payment("due-1") == {
+        'payment_id': "due-1", 'user_id': 112, 'public_id': "RUNES-000000", 'amount': 100.0, 'chat_id': 112,
+    }
+    assert await storage.get_next_payment_check_at() == now + 500
+    assert await storage.update_pending_payments([], ["due-1", "later-1"])
+    assert await storage.get_next_payment_check_at() is None
+
+
+@check("зачисление платежа ровно один раз")
+async def check_credit_payment(storage):
+    await storage.save_subscriber(113)
+    now = time.time()
+    assert await storage.add_pending_payment("credit-1", 113, "RUNES-000000", 100.0, 113, now, now)
+
+    assert await storage.credit_payment("credit-1", 113, 100, now) == (True, True)
+    assert await _limits(storage, 113) == 150
+    assert await storage.get_pending_payment("credit-1") is None
+    assert await storage.credit_payment("credit-1", 113, 100, now) == (True, False)
+    assert await _limits(storage, 113) == 150
+
+    # Пользователя нет — платёж не записывается, после появления пользователя зачисляется
+    assert await storage.credit_payment("credit-2", 114, 30, now) == (False, False)
+    await storage.save_subscriber(114)
+    assert await storage.credit_payment("credit-2", 114, 30, now) == (True, True)
+    assert await _limits(storage, 114) == 80
+
+
+@check("дневная статистика")
+async def check_daily_stats(storage):
+    before = await storage.get_daily_stats(1)
+    before_today = before['days'][-1] if before['days'] else {}
+
+    await storage.save_subscriber(115)
+    await storage.save_divination(115, 'one_rune', _history("статистика"))
+    await storage.save_divination(115, 'fate')
+    assert await storage.credit_payment("stats-1", 115, 10, time.time()) == (True, True)
+
+    after = await storage.get_daily_stats(1)
+    today = after['days'][-1]
+    expected = {
+        'new_subscribers': 1, 'active_users': 1, 'divinations': 2,
+        'payments': 1, 'paying_users': 1, 'credits_purchased': 10,
+    }
+    for column, increment in expected.items():
+        assert today[column] - before_today.get(column, 0) == increment, (column, before_today, today)
+    for divination_type in ('one_rune', 'fate'):
+        assert after['by_type'][divination_type] - before['by_type'].get(divination_type, 0) == 1, after['by_type']
+    assert after['total_subscribers'] - before['total_subscribers'] == 1
+    assert await storage.get_total_subscribers() == after['total_subscribers']
+
+
+@check("выгрузка")
+async def check_export(storage):
+    subscribers = await storage.export_subscribers()
+    row = next(row for row in subscribers if row[0] == 101)
+    assert isinstance(row[1], int) and row[2] == 50 and row[3].startswith("RUNES-"), row
+    assert [row[0] for row in subscribers] == sorted(row[0] for row in subscribers)
+
+    divinations = await storage.export_divinations()
+    assert [row[0] for row in divinations] == sorted(row[0] for row in divinations)
+    assert ('new_kind', 109) in {(row[3], row[1]) for row in divinations}
+    assert all(isinstance(row[2], int) for row in divinations)
+
+
+@check("пересчёт статистики совпадает с обычным учётом")
+async def check_backfill(storage):
+    live = await storage.get_daily_stats(3650)
+    result = await storage.backfill_stats(4)
+    assert result is not None
+    assert result['divinations'] == len(await storage.export_divinations()), result
+    assert await storage.get_daily_stats(3650) == live
+
+
+async def _run(storage) -> int:
+    failed = 0
+    await storage.init_db()
+    try:
+        for name, func in CHECKS.items():
+            try:
+                await func(storage)
+                print(f"ok    {name}")
+            except Exception:
+                failed += 1
+                print(f"FAIL  {name}")
+                traceback.print_exc()
+    finally:
+        await storage.close_db()
+    print(f"\nПроверок: {len(CHECKS)}, не прошло: {failed}")
+    return 1 if failed else 0
+
+
+async def _run_postgres(dsn: str) -> int:
+    import asyncpg
+    from utils.postgres import PostgresStorage
+
+    schema = f"conformance_{secrets.token_hex(4)}"
+    admin = await asyncpg.connect(dsn)
+    try:
+        await admin.execute(f"CREATE SCHEMA {schema}")
+        return await _run(PostgresStorage(dsn, 1, 4, search_path=schema))
+    finally:
+        await admin.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await admin.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Общие проверки хранилища")
+    parser.add_argument('--backend', choices=('sqlite', 'postgres'), default='sqlite')
+    parser.add_argument('--dsn', default=POSTGRES_DSN, help="база PostgreSQL для --backend postgres")
+    args = parser.parse_args()
+
+    if args.backend == 'postgres':
+        return asyncio.run(_run_postgres(args.dsn))
+
+    from utils import database
+    return asyncio.run(_run(database))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
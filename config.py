@@ -11,13 +11,150 @@ ADMIN_ID = int(os.getenv("ADMIN_ID", 0))
 YANDEX_DISK_TOKEN = os.getenv("YANDEX_DISK_TOKEN")
 YANDEX_API_KEY = os.getenv("YANDEX_API_KEY")
 YANDEX_FOLDER_ID = os.getenv("YANDEX_FOLDER_ID")
+# Адрес completion API Yandex GPT (можно заменить на локальный, например для нагрузочных тестов)
+YANDEX_GPT_URL = os.getenv("YANDEX_GPT_URL", "https://llm.api.cloud.yandex.net/foundationModels/v1/completion")
 
 # База данных
 SQLITE_DB = os.getenv("SQLITE_DB", "data/runes_bot.db")
+# Где хранятся данные: "sqlite" (файл SQLITE_DB) или "postgres" (POSTGRES_DSN)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+POSTGRES_DSN = os.getenv("POSTGRES_DSN", "postgresql://localhost/runes_bot")
+# Размер пула соединений asyncpg
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", 1))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", 10))
 
 # Лимиты
 DEFAULT_LIMITS = int(os.getenv("DEFAULT_LIMITS", 50))
 
 # ЮКасса
 YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
-YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
\ No newline at end of file
+YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL", "https://api.yookassa.ru/v3")
+# HTTP-уведомления ЮКассы (порт 0 — не принимать уведомления, только опрос)
+YOOKASSA_WEBHOOK_LISTEN = os.getenv("YOOKASSA_WEBHOOK_LISTEN", "0.0.0.0")
+YOOKASSA_WEBHOOK_PORT = int(os.getenv("YOOKASSA_WEBHOOK_PORT", 0))
+YOOKASSA_WEBHOOK_PATH = os.getenv("YOOKASSA_WEBHOOK_PATH", "/yookassa")
+
+# Повторные запросы
+# Сколько секунд после ответа одинаковый вопрос считается дублем
+DUPLICATE_WINDOW = float(os.getenv("DUPLICATE_WINDOW", 10))
+
+# Состояние диалогов
+# Как часто (в секундах) изменённые состояния пользователей сбрасываются в базу
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", 10))
+# Через сколько секунд бездействия состояние пользователя выгружается из памяти
+SESSION_TTL = float(os.getenv("SESSION_TTL", 6 * 60 * 60))
+# Максимум пользователей, чьё состояние одновременно хранится в памяти
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 20000))
+
+# Получение апдейтов: "polling" или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# Секрет, которым Telegram подписывает запросы webhook (обязателен в режиме webhook)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+
+# Polling
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", 30))
+POLLING_INTERVAL = float(os.getenv("POLLING_INTERVAL", 0))
+
+# HTTP-клиент Bot API (адрес можно заменить на локальный, например для тестов)
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL")
+BOT_API_BASE_FILE_URL = os.getenv("BOT_API_BASE_FILE_URL")
+BOT_POOL_SIZE = int(os.getenv("BOT_POOL_SIZE", 64))
+BOT_CONNECT_TIMEOUT = float(os.getenv("BOT_CONNECT_TIMEOUT", 5))
+BOT_READ_TIMEOUT = float(os.getenv("BOT_READ_TIMEOUT", 10))
+BOT_WRITE_TIMEOUT = float(os.getenv("BOT_WRITE_TIMEOUT", 20))
+BOT_POOL_TIMEOUT = float(os.getenv("BOT_POOL_TIMEOUT", 3))
+
+# Параллельная обработка апдейтов
+# Сколько апдейтов обрабатывается одновременно (апдейты одного пользователя — всегда по очереди)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 64))
+# Сколько апдейтов одного пользователя может ждать в очереди; лишние отбрасываются
+USER_QUEUE_LIMIT = int(os.getenv("USER_QUEUE_LIMIT", 5))
+
+# Отменённые гадания
+# Доля стоимости, которая возвращается, если гадание отменено до отправки ответа
+CANCEL_REFUND_SHARE = float(os.getenv("CANCEL_REFUND_SHARE", 1.0))
+
+# Проверка статуса платежей
+# Сколько секунд после создания платежа проверять его статус
+PAYMENT_CHECK_TIMEOUT = int(os.getenv("PAYMENT_CHECK_TIMEOUT", 30 * 60))
+# Сколько платежей проверять за один проход
+PAYMENT_CHECK_BATCH = int(os.getenv("PAYMENT_CHECK_BATCH", 50))
+
+# HTTP-клиент ЮКассы
+YOOKASSA_TIMEOUT = float(os.getenv("YOOKASSA_TIMEOUT", 10))
+YOOKASSA_RETRIES = int(os.getenv("YOOKASSA_RETRIES", 3))
+YOOKASSA_POOL_SIZE = int(os.getenv("YOOKASSA_POOL_SIZE", 20))
+
+# Массовое пополнение лимитов из файла
+# Сколько строк файла применяется одной транзакцией
+BULK_TOP_UP_CHUNK = int(os.getenv("BULK_TOP_UP_CHUNK", 1000))
+# Сколько уведомлений о пополнении отправлять в секунду
+BULK_NOTIFY_RATE = float(os.getenv("BULK_NOTIFY_RATE", 20))
+
+# Сводка ошибок для администратора
+# Как часто (в секундах) отправлять сводку повторяющихся ошибок
+ERROR_DIGEST_INTERVAL = float(os.getenv("ERROR_DIGEST_INTERVAL", 5 * 60))
+# Через сколько секунд без повторов ошибка снова считается новой
+ERROR_DEDUP_WINDOW = float(os.getenv("ERROR_DEDUP_WINDOW", 60 * 60))
+# Сколько сообщений о новых ошибках можно отправить сразу за минуту
+ERROR_URGENT_PER_MINUTE = int(os.getenv("ERROR_URGENT_PER_MINUTE", 5))
+
+# Логирование
+# Формат записей: "json" (одна запись — одна строка JSON) или "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Доля сохраняемых частых INFO-записей (пишутся на каждый апдейт, помечены sampled)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+
+# Метрики (формат Prometheus)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+# Порт HTTP-эндпоинта метрик; 0 — не запускать
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+# Трассировка апдейтов
+# Доля апдейтов, трассы которых записываются всегда
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+# Трассы медленнее стольких миллисекунд записываются всегда; 0 — не выделять медленные
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 5000))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", 10 * 1024 * 1024))
+
+# Статистика для администратора
+# За сколько последних дней показывать статистику
+STATS_DAYS = int(os.getenv("STATS_DAYS", 7))
+# Сколько строк истории пересчитывается одной транзакцией при заполнении статистики
+STATS_BACKFILL_CHUNK = int(os.getenv("STATS_BACKFILL_CHUNK", 5000))
+
+# История гаданий
+# Сколько гаданий показывать на одной странице «Мои гадания»
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 5))
+
+# Несколько экземпляров бота
+# Общее состояние (замки, ведущий для фоновых задач, счётчики): пусто — в памяти процесса (один экземпляр),
+# redis://[:пароль@]хост:порт/база — сервер Redis или совместимый по протоколу RESP
+COORDINATION_URL = os.getenv("COORDINATION_URL", "")
+# Префикс ключей, чтобы несколько ботов могли делить один сервер
+COORDINATION_PREFIX = os.getenv("COORDINATION_PREFIX", "runes:")
+# На сколько секунд экземпляр становится ведущим; продлевается каждую треть срока
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", 30))
+# Сколько секунд держится замок пользователя, если экземпляр упал посреди обработки апдейта
+USER_LOCK_TTL = float(os.getenv("USER_LOCK_TTL", 60))
+
+# Допуск гаданий (защита квоты Yandex GPT); проверяется в памяти каждого экземпляра, 0 — без ограничения
+# Сколько гаданий в минуту доступно одному пользователю и сколько подряд без ожидания
+USER_DIVINATIONS_PER_MINUTE = float(os.getenv("USER_DIVINATIONS_PER_MINUTE", 6))
+USER_DIVINATIONS_BURST = int(os.getenv("USER_DIVINATIONS_BURST", 3))
+# Сколько запросов к GPT в секунду допускает один экземпляр (по квоте, делённой на число экземпляров)
+GPT_REQUESTS_PER_SECOND = float(os.getenv("GPT_REQUESTS_PER_SECOND", 10))
+GPT_REQUESTS_BURST = int(os.getenv("GPT_REQUESTS_BURST", 20))
+# На сколько секунд вперёд можно занимать очередь при перегрузке; дальше — отказ без очереди
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 60))
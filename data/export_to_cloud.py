@@ -1,11 +1,13 @@
-import sqlite3
 import csv
+import asyncio
 import logging
+from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
 from yadisk import YaDisk
 
 from utils.logging import setup_logging
+from utils.storage import init_db, close_db, export_subscribers, export_divinations
 from config import SQLITE_DB, YANDEX_DISK_TOKEN
 
 load_dotenv()
@@ -15,8 +17,20 @@ logger = logging.getLogger(__name__)
 setup_logging()
 
 
-def export_to_csv():
-    """Загружает данные из SQLite в .csv файл"""
+def _local_time(timestamp: int) -> str:
+    """Секунды UTC -> строка местного времени."""
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _write_csv(path: Path, header: list, rows) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+async def export_to_csv():
+    """Выгружает данные из хранилища в .csv файлы (файлы пишутся в отдельном потоке)"""
     try:
         # Указываем полный путь для CSV файлов
         db_path = Path(SQLITE_DB)
@@ -26,22 +40,24 @@ def export_to_csv():
         subscribers_path = csv_dir / "subscribers.csv"
         divinations_path = csv_dir / "divinations.csv"
 
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-       
-            # Экспорт subscribers
-            cursor.execute("SELECT * FROM subscribers")
-            with open(subscribers_path, "w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                writer.writerow([i[0] for i in cursor.description])
-                writer.writerows(cursor.fetchall())
-        
-            # Экспорт divinations
-            cursor.execute("SELECT * FROM divinations")
-            with open(divinations_path, "w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                writer.writerow([i[0] for i in cursor.description])
-                writer.writerows(cursor.fetchall())
+        subscribers = await export_subscribers()
+        divinations = await export_divinations()
+        if subscribers is None or divinations is None:
+            raise RuntimeError("не удалось прочитать данные из хранилища")
+
+        # Экспорт subscribers (время — в местном формате, как до перехода на секунды UTC)
+        await asyncio.to_thread(
+            _write_csv, subscribers_path, ["user_id", "first_seen", "limits", "public_id"],
+            [(user_id, _local_time(first_seen), limits, public_id)
+             for user_id, first_seen, limits, public_id in subscribers]
+        )
+
+        # Экспорт divinations (коды видов гаданий заменяются названиями)
+        await asyncio.to_thread(
+            _write_csv, divinations_path, ["id", "user_id", "date", "divination_type"],
+            [(divination_id, user_id, _local_time(created_at), divination_type)
+             for divination_id, user_id, created_at, divination_type in divinations]
+        )
 
         return str(subscribers_path), str(divinations_path)
     except Exception as e:
@@ -65,9 +81,17 @@ def upload_to_yandex(subscribers_path, divinations_path):
         raise
 
 
+async def _export() -> tuple:
+    await init_db()
+    try:
+        return await export_to_csv()
+    finally:
+        await close_db()
+
+
 if __name__ == '__main__':
     try:
-        subs_path, div_path = export_to_csv()
+        subs_path, div_path = asyncio.run(_export())
         upload_to_yandex(subs_path, div_path)
     except Exception as e:
         logger.exception(f"Critical error при выгрузке на облако: {e}")
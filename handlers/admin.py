@@ -1,11 +1,15 @@
 import asyncio
 import logging
-from telegram import Update, Message, PhotoSize, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
+from telegram import Update, Message, PhotoSize
+from telegram.ext import ContextTypes, CommandHandler, filters
 
-from utils.database import get_subscribers, top_up_limits, get_user_limits
+from utils.storage import get_subscribers, get_total_subscribers, top_up_limits, get_user_limits, get_daily_stats
+from utils.bulk_top_up import apply_top_up_file, format_report, notify_credited
+from utils.stats import format_stats
 from utils.logging import setup_logging, send_error_to_admin
-from config import ADMIN_ID
+from utils.assets import assets
+from utils.metrics import BROADCAST_PROGRESS
+from config import ADMIN_ID, STATS_DAYS
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
@@ -15,15 +19,15 @@ setup_logging()
 WAITING_FOR_BROADCAST = 1
 WAITING_FOR_TOP_UP = 2
 WAITING_FOR_LIMITS_CHECK = 3
+WAITING_FOR_BULK_TOP_UP = 4
+
+# Подпись к файлу, по которой пополненным пользователям отправляются уведомления
+NOTIFY_CAPTION = "уведомить"
 
 
 def get_admin_keyboard():
     """Возвращает клавиатуру администратора."""
-    keyboard = [
-        [KeyboardButton("Рассылка"), KeyboardButton("Подписчики")],
-        [KeyboardButton("Пополнить лимиты"), KeyboardButton("Узнать лимиты пользователя")],
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return assets.current.admin_keyboard
 
 
 async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -47,29 +51,47 @@ async def handle_admin_buttons(update: Update, context: ContextTypes.DEFAULT_TYP
     if text == "Рассылка":
         await update.message.reply_text(
             "Отправьте сообщение для рассылки",
-            reply_markup=ReplyKeyboardMarkup([[KeyboardButton("Главное меню")]], resize_keyboard=True)
+            reply_markup=assets.current.back_keyboard
         )
         context.user_data["admin_state"] = WAITING_FOR_BROADCAST
     
     elif text == "Подписчики":
-        subscribers = await get_subscribers()
-        total_count = len(subscribers)
-        await context.bot.send_message(chat_id=ADMIN_ID, text=f"На бот подписано {total_count} подписчиков")
+        total_count = await get_total_subscribers()
+        if total_count is None:
+            await context.bot.send_message(chat_id=ADMIN_ID, text="Не удалось получить число подписчиков")
+        else:
+            await context.bot.send_message(chat_id=ADMIN_ID, text=f"На бот подписано {total_count} подписчиков")
 
     elif text == "Пополнить лимиты":
         await update.message.reply_text(
             "Введите данные в формате 'RUNES-ABC123 500'",
-            reply_markup=ReplyKeyboardMarkup([[KeyboardButton("Главное меню")]], resize_keyboard=True)
+            reply_markup=assets.current.back_keyboard
         )
         context.user_data["admin_state"] = WAITING_FOR_TOP_UP
 
     elif text == "Узнать лимиты пользователя":
         await update.message.reply_text(
             "Введите public_id пользователя в формате 'RUNES-ABC123'",
-            reply_markup=ReplyKeyboardMarkup([[KeyboardButton("Главное меню")]], resize_keyboard=True)
+            reply_markup=assets.current.back_keyboard
         )
         context.user_data["admin_state"] = WAITING_FOR_LIMITS_CHECK
 
+    elif text == "Массовое пополнение":
+        await update.message.reply_text(
+            "Отправьте файл CSV или XLSX: в каждой строке public_id и количество лимитов, "
+            "например 'RUNES-ABC123;500'.\n"
+            f"Чтобы уведомить пользователей о пополнении, добавьте к файлу подпись «{NOTIFY_CAPTION}».",
+            reply_markup=assets.current.back_keyboard
+        )
+        context.user_data["admin_state"] = WAITING_FOR_BULK_TOP_UP
+
+    elif text == "Статистика":
+        stats = await get_daily_stats(STATS_DAYS)
+        if stats is None:
+            await update.message.reply_text("Не удалось получить статистику")
+        else:
+            await update.message.reply_text(format_stats(stats, STATS_DAYS))
+
     elif text == "Главное меню":
         await admin_menu(update, context)
         context.user_data.pop("admin_state", None)
@@ -96,8 +118,11 @@ async def handle_forwarded_message(update: Update, context: ContextTypes.DEFAULT
 
             blocked_users = 0
             other_errors = 0
+            BROADCAST_PROGRESS.set(total_count, 'total')
+            for state in ('processed', 'blocked', 'failed'):
+                BROADCAST_PROGRESS.set(0, state)
 
-            for user_id in subscribers:
+            for processed, user_id in enumerate(subscribers, start=1):
                 try:
                     await _send_message_to_subscriber(context.bot, user_id, message)
                     await asyncio.sleep(0.3)
@@ -109,6 +134,9 @@ async def handle_forwarded_message(update: Update, context: ContextTypes.DEFAULT
                         other_errors += 1
                         error_message = f"Ошибка при отправке пользователю {user_id}: {e}"
                         logger.error(error_message)
+                BROADCAST_PROGRESS.set(processed, 'processed')
+                BROADCAST_PROGRESS.set(blocked_users, 'blocked')
+                BROADCAST_PROGRESS.set(other_errors, 'failed')
 
             result_message = (
                 f"Рассылка завершена!\n\n"
@@ -189,6 +217,45 @@ async def handle_forwarded_message(update: Update, context: ContextTypes.DEFAULT
         await send_error_to_admin(context.bot, error_message)
 
 
+async def handle_bulk_top_up(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Пополняет лимиты по загруженному файлу и отправляет отчёт администратору."""
+    try:
+        if update.effective_user.id != ADMIN_ID:
+            return
+
+        document = update.message.document
+        file_name = (document.file_name or "") if document else ""
+        if not file_name.lower().endswith((".csv", ".xlsx")):
+            await update.message.reply_text("Отправьте файл в формате CSV или XLSX")
+            return
+
+        await update.message.reply_text(f"Файл {file_name} получен, пополняю лимиты...")
+        file = await document.get_file()
+        data = bytes(await file.download_as_bytearray())
+
+        try:
+            report = await apply_top_up_file(data, file_name)
+        except ImportError:
+            await update.message.reply_text("Для чтения XLSX нужен пакет openpyxl. Отправьте файл в формате CSV")
+            return
+
+        context.user_data.pop("admin_state", None)
+        await update.message.reply_text(format_report(report), reply_markup=get_admin_keyboard())
+
+        caption = (update.message.caption or "").strip().lower()
+        if caption == NOTIFY_CAPTION and report.credited:
+            await update.message.reply_text(f"Отправляю уведомления {len(report.credited)} пользователям")
+            context.application.create_task(
+                notify_credited(context.bot, report.credited, ADMIN_ID),
+                update=update
+            )
+
+    except Exception as e:
+        error_message = f"Ошибка в handle_bulk_top_up: {e}"
+        logger.error(error_message)
+        await send_error_to_admin(context.bot, error_message)
+
+
 async def _send_message_to_subscriber(bot, user_id: int, message: Message) -> None:
     """Отправляет сообщение подписчику с обработкой различных типов контента."""
     try:
@@ -230,14 +297,9 @@ async def _send_video(bot, user_id: int, message: Message) -> None:
 
 
 def setup_admin_handlers(application):
-    """Настройка обработчиков для администратора"""
+    """
+    Настройка обработчиков для администратора.
+    Кнопки и сообщения администратора распределяет handlers.router.
+    """
     application.add_handler(CommandHandler("admin", admin_menu, filters=filters.User(ADMIN_ID)))
-    application.add_handler(
-        MessageHandler(
-            filters.Text(["Рассылка", "Подписчики", "Пополнить лимиты", "Узнать лимиты пользователя", "Главное меню"]) & 
-            filters.User(ADMIN_ID),
-            handle_admin_buttons
-        )
-    )
-    application.add_handler(MessageHandler(filters.ALL & filters.User(ADMIN_ID), handle_forwarded_message))
 
@@ -1,43 +1,28 @@
 import logging
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
 
 from utils.logging import setup_logging, send_error_to_admin
-from utils.database import save_subscriber
-from utils.prices import load_prices
+from utils.storage import save_subscriber, get_user_info_by_user_id
+from utils.assets import assets
+from utils.prepare import cancel_preparation
+from utils.tasks import divination_tasks
 
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
 setup_logging()
 
-BOT_DESCRIPTION = "Описание бота временно недоступно."
-
-# Чтение описания бота из файла
-try:
-    with open('text/bot_description.txt', 'r', encoding='utf-8') as file:
-        BOT_DESCRIPTION = file.read()
-except Exception as e:
-    error_message = f"Ошибка загрузки файла описания бота: {e}"
-    logger.error(error_message)
-
 
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отображает главное меню с кнопками выбора действия."""  
     try:
-        keyboard = [
-            [f"Одна руна", f"Три руны"],
-            [f"Четыре руны", f"Судьба"],
-            [f"Вспаханное поле"],
-            ["Пополнить лимиты"],
-            ["Как гадать", "Мои лимиты"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         context.user_data['mode'] = 'main_menu'
+        cancel_preparation(update.effective_user.id)
 
         await update.message.reply_text(
             "Выберите действие:",
-            reply_markup=reply_markup
+            reply_markup=assets.current.main_keyboard
         )
     except Exception as e:
         error_message = f"Ошибка в main_menu: {e}"
@@ -49,11 +34,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start. Инициализирует бота для пользователя."""
     try:
         context.user_data.clear()
+        divination_tasks.cancel(update.effective_user.id)
         chat_id = update.message.chat_id
 
         await context.bot.send_message(
             chat_id=chat_id,
-            text=BOT_DESCRIPTION,
+            text=assets.current.texts['bot_description'],
             parse_mode="Markdown",
         )
 
@@ -74,21 +60,64 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE)  -> N
     """Обработчик команды /menu. Возвращает пользователя в главное меню."""
     try:
         context.user_data.clear()
+        divination_tasks.cancel(update.effective_user.id)
         await main_menu(update, context)
     except Exception as e:
         error_message = f"Произошла ошибка в menu_command: {e}"
         logger.error(error_message)
         await send_error_to_admin(context.bot, error_message)
 
+async def back_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка «Главное меню»: сбрасывает состояние, отменяет незаконченное гадание и показывает меню."""
+    try:
+        context.user_data.clear()
+        divination_tasks.cancel(update.effective_user.id)
+        await main_menu(update, context)
+    except Exception as e:
+        error_message = f"Ошибка в back_to_main_menu: {e}"
+        logger.error(error_message)
+        await send_error_to_admin(context.bot, error_message)
+
+
+async def how_to_guess(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка «Как гадать»: отправляет инструкцию."""
+    try:
+        await update.message.reply_text(assets.current.texts['how_to_guess'])
+    except Exception as e:
+        error_message = f"Ошибка в how_to_guess: {e}"
+        logger.error(error_message)
+        await send_error_to_admin(context.bot, error_message)
+
+
+async def show_limits(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка «Мои лимиты»: показывает public_id и баланс пользователя."""
+    try:
+        success, public_id, limits = await get_user_info_by_user_id(update.effective_user.id)
+        if success:
+            await update.message.reply_text(
+                f"Ваш public_id: {public_id}\n"
+                f"Ваши лимиты: {limits}"
+            )
+        else:
+            await update.message.reply_text(
+                "Не удалось найти ваши данные. Попробуйте снова или напишите в поддержку."
+            )
+    except Exception as e:
+        error_message = f"Ошибка в show_limits: {e}"
+        logger.error(error_message)
+        await send_error_to_admin(context.bot, error_message)
+
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок бота."""
     try:
         logger.error(f"Ошибка: {context.error}")
+        await send_error_to_admin(context.bot, f"Необработанная ошибка: {context.error}")
 
         if update and hasattr(update, 'message'):
             await update.message.reply_text(
                 "Произошла ошибка. Возвращаю в главное меню.",
-                reply_markup=ReplyKeyboardMarkup([["Главное меню"]], resize_keyboard=True)
+                reply_markup=assets.current.back_keyboard
             )
     except Exception as e:
         logger.error(f"Ошибка внутри error_handler: {e}") 
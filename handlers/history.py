@@ -0,0 +1,122 @@
+import logging
+from datetime import datetime
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from utils.storage import get_history_page, get_history_entry
+from utils.history import unpack_text
+from utils.runes import decode_spread, load_rune_data, resolve_rune
+from utils.stats import DIVINATION_NAMES
+from utils.logging import setup_logging, send_error_to_admin
+from config import HISTORY_PAGE_SIZE
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# Префикс callback_data кнопок истории: history:<действие>:<id>
+CALLBACK_PREFIX = "history"
+HISTORY_PATTERN = rf"^{CALLBACK_PREFIX}:"
+
+# Сколько символов вопроса показывать на кнопке списка
+QUESTION_PREVIEW = 32
+# Ограничение Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+
+
+def _format_date(created_at: int, date_format: str = "%d.%m.%Y %H:%M") -> str:
+    """Время гадания (секунды UTC) в местном времени."""
+    return datetime.fromtimestamp(created_at).strftime(date_format)
+
+
+async def _render_page(user_id: int, before_id: int | None = None, after_id: int | None = None):
+    """Текст и кнопки страницы истории."""
+    page = await get_history_page(user_id, HISTORY_PAGE_SIZE, before_id=before_id, after_id=after_id)
+    if page is None:
+        return "Не удалось загрузить историю гаданий. Попробуйте позже.", None
+
+    rows, has_newer, has_older = page
+    if not rows:
+        return "У вас пока нет сохранённых гаданий.", None
+
+    buttons = []
+    for divination_id, created_at, divination_type, question in rows:
+        preview = unpack_text(question)
+        if len(preview) > QUESTION_PREVIEW:
+            preview = preview[:QUESTION_PREVIEW - 1] + "…"
+        name = DIVINATION_NAMES.get(divination_type, divination_type)
+        buttons.append([InlineKeyboardButton(
+            f"{_format_date(created_at, '%d.%m')} · {name} · {preview}",
+            callback_data=f"{CALLBACK_PREFIX}:open:{divination_id}"
+        )])
+
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton("← Новее", callback_data=f"{CALLBACK_PREFIX}:newer:{rows[0][0]}"))
+    if has_older:
+        navigation.append(InlineKeyboardButton("Старее →", callback_data=f"{CALLBACK_PREFIX}:page:{rows[-1][0]}"))
+    if navigation:
+        buttons.append(navigation)
+
+    return "Ваши гадания. Нажмите, чтобы открыть:", InlineKeyboardMarkup(buttons)
+
+
+async def _render_entry(user_id: int, divination_id: int):
+    """Текст одного гадания и кнопка возврата к списку."""
+    back = InlineKeyboardMarkup([[InlineKeyboardButton(
+        "← К списку", callback_data=f"{CALLBACK_PREFIX}:page:{divination_id + 1}"
+    )]])
+
+    entry = await get_history_entry(user_id, divination_id)
+    if entry is None:
+        return "Гадание не найдено.", back
+
+    _, created_at, divination_type, spread, question, answer = entry
+    lines = [f"{_format_date(created_at)} · {DIVINATION_NAMES.get(divination_type, divination_type)}"]
+
+    if spread:
+        rune_data = await load_rune_data()
+        names = [resolve_rune(rune, rune_data)[0] or rune['rune_key'] for rune in decode_spread(spread)]
+        lines.append(f"Руны: {', '.join(names)}")
+
+    lines += ["", f"Вопрос: {unpack_text(question)}", "", unpack_text(answer)]
+    text = "\n".join(lines)
+    if len(text) > MESSAGE_LIMIT:
+        text = text[:MESSAGE_LIMIT - 1] + "…"
+    return text, back
+
+
+async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка «Мои гадания»: первая страница истории гаданий пользователя."""
+    try:
+        text, markup = await _render_page(update.effective_user.id)
+        await update.message.reply_text(text, reply_markup=markup)
+    except Exception as e:
+        error_message = f"Ошибка в show_history: {e}"
+        logger.error(error_message)
+        await send_error_to_admin(context.bot, error_message)
+
+
+async def history_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопки под списком гаданий: листание страниц и просмотр одного гадания."""
+    query = update.callback_query
+    try:
+        _, action, value = query.data.split(":")
+        user_id = query.from_user.id
+
+        if action == "open":
+            text, markup = await _render_entry(user_id, int(value))
+        elif action == "newer":
+            text, markup = await _render_page(user_id, after_id=int(value))
+        else:
+            text, markup = await _render_page(user_id, before_id=int(value))
+
+        await query.answer()
+        await query.edit_message_text(text, reply_markup=markup)
+    except Exception as e:
+        # Повторное нажатие той же кнопки — сообщение не изменилось, это не ошибка
+        if "message is not modified" in str(e).lower():
+            return
+        error_message = f"Ошибка в history_callback: {e}"
+        logger.error(error_message)
+        await send_error_to_admin(context.bot, error_message)
@@ -0,0 +1,141 @@
+import time
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Tuple
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from handlers.base import back_to_main_menu, how_to_guess, show_limits
+from handlers.history import show_history
+from handlers.runes import (
+    one_rune_mode,
+    three_runes_mode,
+    four_runes_mode,
+    fate_mode,
+    field_mode,
+    handle_message,
+)
+from handlers.admin import (
+    handle_admin_buttons,
+    handle_forwarded_message,
+    handle_bulk_top_up,
+    WAITING_FOR_BROADCAST,
+    WAITING_FOR_TOP_UP,
+    WAITING_FOR_LIMITS_CHECK,
+    WAITING_FOR_BULK_TOP_UP,
+)
+from utils.payment import payment_message, handle_payment_input
+from utils.logging import setup_logging, send_error_to_admin
+from utils.metrics import HANDLER_UPDATES, HANDLER_LATENCY
+from utils.tracing import span
+from config import ADMIN_ID
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]
+
+# Кнопки пользователя: текст -> обработчик
+USER_BUTTONS: Dict[str, Handler] = {
+    "Одна руна": one_rune_mode,
+    "Три руны": three_runes_mode,
+    "Четыре руны": four_runes_mode,
+    "Судьба": fate_mode,
+    "Вспаханное поле": field_mode,
+    "Как гадать": how_to_guess,
+    "Мои лимиты": show_limits,
+    "Мои гадания": show_history,
+    "Пополнить лимиты": payment_message,
+    "Главное меню": back_to_main_menu,
+}
+
+# Режимы пользователя: context.user_data['mode'] -> обработчик текста
+USER_MODES: Dict[Hashable, Handler] = {
+    'one_rune': handle_message,
+    'three_rune': handle_message,
+    'four_rune': handle_message,
+    'fate': handle_message,
+    'field': handle_message,
+    'payment': handle_payment_input,
+}
+
+# Кнопки администратора (перекрывают одноимённые кнопки пользователя)
+ADMIN_BUTTONS: Dict[str, Handler] = {
+    "Рассылка": handle_admin_buttons,
+    "Подписчики": handle_admin_buttons,
+    "Пополнить лимиты": handle_admin_buttons,
+    "Узнать лимиты пользователя": handle_admin_buttons,
+    "Массовое пополнение": handle_admin_buttons,
+    "Статистика": handle_admin_buttons,
+    "Главное меню": handle_admin_buttons,
+}
+
+# Состояния администратора: context.user_data['admin_state'] -> обработчик сообщения
+ADMIN_STATES: Dict[Hashable, Handler] = {
+    WAITING_FOR_BROADCAST: handle_forwarded_message,
+    WAITING_FOR_TOP_UP: handle_forwarded_message,
+    WAITING_FOR_LIMITS_CHECK: handle_forwarded_message,
+    WAITING_FOR_BULK_TOP_UP: handle_bulk_top_up,
+}
+
+BUTTON = 'button'
+STATE = 'state'
+
+
+async def _ignore(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сообщение администратора вне какого-либо состояния — ничего не делаем."""
+
+
+class Router:
+    """
+    Маршрутизатор сообщений.
+    Таблицы собираются один раз в словарь с ключами (is_admin, BUTTON, текст)
+    и (is_admin, STATE, режим), поэтому выбор обработчика не зависит от их числа.
+    """
+
+    def __init__(self):
+        self._routes: Dict[Tuple, Handler] = {}
+        self._defaults: Dict[bool, Handler] = {False: handle_message, True: _ignore}
+
+        for is_admin, buttons in ((False, USER_BUTTONS), (True, {**USER_BUTTONS, **ADMIN_BUTTONS})):
+            for text, handler in buttons.items():
+                self._routes[(is_admin, BUTTON, text)] = handler
+
+        for is_admin, states in ((False, USER_MODES), (True, ADMIN_STATES)):
+            for state, handler in states.items():
+                self._routes[(is_admin, STATE, state)] = handler
+
+    def resolve(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> Handler:
+        """Возвращает обработчик для сообщения."""
+        is_admin = update.effective_user.id == ADMIN_ID
+
+        text = update.message.text
+        if text is not None:
+            handler = self._routes.get((is_admin, BUTTON, text))
+            if handler is not None:
+                return handler
+
+        state = context.user_data.get('admin_state' if is_admin else 'mode')
+        return self._routes.get((is_admin, STATE, state), self._defaults[is_admin])
+
+    async def route(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Единая точка входа для всех сообщений."""
+        try:
+            if not update.message or not update.effective_user:
+                return
+
+            handler = self.resolve(update, context)
+            started = time.perf_counter()
+            try:
+                with span(handler.__name__):
+                    await handler(update, context)
+            finally:
+                HANDLER_UPDATES.inc(handler.__name__)
+                HANDLER_LATENCY.observe(time.perf_counter() - started, handler.__name__)
+        except Exception as e:
+            error_message = f"Ошибка в route: {e}"
+            logger.error(error_message)
+            await send_error_to_admin(context.bot, error_message)
+
+
+router = Router()
@@ -1,34 +1,45 @@
-import os
+import time
+import asyncio
 import logging
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
 
 from utils.runes import (
-    get_random_one_rune,
+    get_random_runes,
     get_random_three_runes,
     get_random_four_runes,
     get_random_six_runes,
     get_random_twelve_runes,
-    load_rune_data
+    load_rune_data,
+    resolve_rune,
+    get_cached_file_id,
+    remember_file_id
 )
-from utils.database import save_divination, deduct_limits, get_user_info_by_user_id
+from utils.storage import save_divination, deduct_limits, get_user_info_by_user_id, add_limits
 from utils.gpt import ask_gpt
+from utils.history import encode_reading
 from handlers.base import main_menu
 from utils.logging import setup_logging, send_error_to_admin
-from utils.prices import load_prices
+from utils.assets import assets
+from utils.prepare import start_preparation, take_preparation
+from utils.singleflight import divination_flights
+from utils.admission import divination_admission
+from utils.tasks import divination_tasks
+from utils.metrics import DIVINATION_LATENCY
+from utils.tracing import span, traced, hold_for_task
+from config import CANCEL_REFUND_SHARE
 
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
 setup_logging()
 
-prices = load_prices()
-DESCRIPTION_OF_TYPE= {
-    'one_rune': f"✨ Одна руна — быстрый совет или короткий ответ на твой вопрос. Стоимость: {prices['one_rune']} лимитов.",
-    'three_runes': f"🔮 Три руны — помогут рассмотреть ситуацию глубже и увидеть скрытые стороны. Стоимость: {prices['three_runes']} лимитов.",
-    'four_runes': f"⚖️ Четыре руны — подскажут, какой выбор может привести к каким последствиям. Стоимость: {prices['four_runes']} лимитов.",
-    'fate': f"🌌 Судьба — раскроет направление пути: где ждут радости, а где могут подстерегать опасности. Стоимость: {prices['fate']} лимитов.",
-    'field': f"🌱 Вспаханное поле — прогноз на срок: от недели и дальше. Стоимость: {prices['field']} лимитов."
+# Ответы на недопущенное гадание по причине отказа (utils.admission)
+ADMISSION_REPLIES = {
+    'user': "Вы задаёте вопросы слишком часто, попробуйте через {}.",
+    'global': "Сейчас много желающих погадать. Ваша очередь подойдёт — попробуйте через {}.",
+    'queued': "Ваша очередь ещё не подошла, попробуйте через {}.",
+    'overload': "Сейчас слишком много желающих погадать, попробуйте через {}.",
 }
 
 SEND_IMAGES = {
@@ -42,21 +53,27 @@ SEND_IMAGES = {
 async def  _enter_rune_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str, prompt_type: str, rune_selector=None) -> None:
     """Универсальный метод для активации режима гадания."""
     try:
-        keyboard = [['Главное меню']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        # Новый расклад отменяет ещё не законченное гадание
+        divination_tasks.cancel(update.effective_user.id)
 
         context.user_data.update({
             'mode': mode,
             'prompt_type': prompt_type
         })
 
+        runes = None
         if rune_selector:
-            context.user_data['selected_runes'] = await rune_selector()
-        
-        readable_description = DESCRIPTION_OF_TYPE.get(prompt_type, prompt_type)
+            runes = await rune_selector()
+            context.user_data['selected_runes'] = runes
+
+        # Пока пользователь печатает вопрос, готовим всё остальное
+        start_preparation(update.effective_user.id, runes)
+
+        current_assets = assets.current
+        readable_description = current_assets.descriptions.get(prompt_type, prompt_type)
         await update.message.reply_text(
             readable_description,
-            reply_markup=reply_markup
+            reply_markup=current_assets.back_keyboard
         )
     except Exception as e:
         error_message = f"Ошибка в _enter_rune_mode ({mode}): {e}"
@@ -88,13 +105,10 @@ async def field_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     """Активирует режим гадания вспаханное поле"""
     await _enter_rune_mode(update, context, 'field', 'field', get_random_twelve_runes)
 
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обрабатывает пользовательские сообщения в зависимости от текущего режима."""
     try:
-        # Игнорируем нажатие кнопок в меню    
-        if update.message.text in ["Одна руна", "Три руны", "Четыре руны", "Судьба", "Вспаханное поле", "Как гадать",  "Главное меню"]:
-            return
-        
         current_mode = context.user_data.get('mode')
 
         # Если режим не установлен возвращаемся в главное меню
@@ -102,36 +116,157 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await main_menu(update, context)
             return
 
+        user_id = update.effective_user.id
         user_question = update.message.text
 
-        handlers = {
-            'one_rune': lambda: _handle_one_rune_mode(update, user_question),
-            'three_rune': lambda: _handle_multiple_runes_mode(update, context, user_question, 'three_runes'),
-            'four_rune': lambda: _handle_multiple_runes_mode(update, context, user_question, 'four_runes'),
-            'fate': lambda: _handle_multiple_runes_mode(update, context, user_question, 'fate'),
-            'field': lambda: _handle_multiple_runes_mode(update, context, user_question, 'field'),
-        }
+        # Повторно отправленный вопрос не выполняем второй раз (и не тратим на него квоту)
+        flight_key = divination_flights.make_key(user_id, current_mode, user_question)
+        if not await divination_flights.acquire(flight_key):
+            if await divination_flights.in_progress(flight_key):
+                await update.message.reply_text("Ваш вопрос уже обрабатывается, дождитесь ответа.")
+            else:
+                await update.message.reply_text("На этот вопрос ответ уже дан выше.")
+            return
 
-        if current_mode in handlers:
-            await handlers[current_mode]()
-        
-        await main_menu(update, context)
+        # Допуск проверяется в памяти до базы и GPT: лишние гадания не тратят квоту
+        admission = divination_admission.check(user_id)
+        if not admission.admitted:
+            await divination_flights.release(flight_key, delivered=False)
+            await update.message.reply_text(
+                ADMISSION_REPLIES[admission.reason].format(_seconds(admission.retry_seconds))
+            )
+            return
+
+        # Гадание идёт отдельной задачей: обработчик сразу освобождается,
+        # и следующее действие пользователя может его отменить
+        divination_tasks.cancel(user_id)
+        task = context.application.create_task(
+            _run_divination(update, context, current_mode, user_question, flight_key),
+            update=update
+        )
+        divination_tasks.track(user_id, task)
+        hold_for_task(task)
     except Exception as e:
         error_message = f"Ошибка в handle_message: {e}"
         logger.error(error_message)
         await send_error_to_admin(context.bot, error_message)   
 
 
-async def _handle_one_rune_mode(update: Update, question: str) -> None:
+def _seconds(count: int) -> str:
+    """«1 секунду», «3 секунды», «10 секунд»."""
+    if count % 10 == 1 and count % 100 != 11:
+        return f"{count} секунду"
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return f"{count} секунды"
+    return f"{count} секунд"
+
+
+async def _run_divination(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str, question: str, flight_key) -> None:
+    """Выполняет гадание; при отмене возвращает лимиты за недоставленный ответ."""
+    # Сколько списано и доставлен ли ответ — заполняют обработчики режимов
+    charge = {'amount': 0, 'delivered': False}
+
+    handlers = {
+        'one_rune': lambda: _handle_one_rune_mode(update, question, charge),
+        'three_rune': lambda: _handle_multiple_runes_mode(update, context, question, 'three_runes', charge),
+        'four_rune': lambda: _handle_multiple_runes_mode(update, context, question, 'four_runes', charge),
+        'fate': lambda: _handle_multiple_runes_mode(update, context, question, 'fate', charge),
+        'field': lambda: _handle_multiple_runes_mode(update, context, question, 'field', charge),
+    }
+
+    started = time.perf_counter()
+    result = 'not_delivered'
+    try:
+        with span('divination', mode=mode):
+            await handlers[mode]()
+        if charge['delivered']:
+            result = 'delivered'
+        await main_menu(update, context)
+    except asyncio.CancelledError:
+        result = 'cancelled'
+        await _refund_cancelled(update, charge)
+        raise
+    finally:
+        # Лимиты не списаны — значит, до GPT дело не дошло и жетоны допуска не потрачены
+        if not charge['amount']:
+            divination_admission.refund(update.effective_user.id)
+        await divination_flights.release(flight_key, delivered=charge['delivered'])
+        DIVINATION_LATENCY.observe(time.perf_counter() - started, mode, result)
+
+
+async def _deduct(user_id: int, price: int, charge: dict) -> bool:
+    """
+    Списывает лимиты и отмечает сумму в charge.
+    Отмена во время списания не прерывает его: дожидаемся результата,
+    чтобы _refund_cancelled вернул ровно то, что было списано.
+    """
+    deduction = asyncio.ensure_future(deduct_limits(user_id, price))
+    try:
+        deducted = await asyncio.shield(deduction)
+    except asyncio.CancelledError:
+        if await deduction:
+            charge['amount'] = price
+        raise
+    if deducted:
+        charge['amount'] = price
+    return deducted
+
+
+async def _refund_cancelled(update: Update, charge: dict) -> None:
+    """Возвращает лимиты за отменённое гадание, если ответ не был доставлен."""
+    if not charge['amount'] or charge['delivered']:
+        return
+
+    user_id = update.effective_user.id
+    refund = int(charge['amount'] * CANCEL_REFUND_SHARE)
+    logger.info(f"Гадание пользователя {user_id} отменено, возврат {refund} из {charge['amount']}")
+    if refund <= 0:
+        return
+
+    try:
+        if await add_limits(user_id, refund):
+            await update.message.reply_text(f"Предыдущее гадание отменено, возвращено лимитов: {refund}")
+    except Exception as e:
+        logger.error(f"Ошибка возврата лимитов пользователю {user_id}: {e}")
+
+
+async def _has_enough_limits(user_id: int, price: int, prepared: dict | None) -> bool:
+    """
+    Проверяет баланс. Заранее полученному балансу доверяем, только если его хватает:
+    при нехватке перечитываем — пользователь мог пополнить лимиты, пока печатал.
+    """
+    if prepared:
+        success, _, limits = prepared['user_info']
+        if success and limits >= price:
+            return True
+
+    success, _, limits = await get_user_info_by_user_id(user_id)
+    return success and limits >= price
+
+
+@traced('send_photo')
+async def _send_rune_photo(update: Update, image_path: str, file_id: str | None) -> None:
+    """Отправляет картинку руны по file_id, найденному вызывающим, или загружает файл."""
+    if file_id:
+        await update.message.reply_photo(file_id)
+        return
+
+    with open(image_path, 'rb') as photo:
+        message = await update.message.reply_photo(photo)
+    if message and message.photo:
+        remember_file_id(image_path, message.photo[-1].file_id)
+
+
+@traced()
+async def _handle_one_rune_mode(update: Update, question: str, charge: dict) -> None:
     """Обрабатывает запрос для режима одной руны."""
     try:
         user_id = update.message.from_user.id
-        prices = load_prices()
-        price = prices.get("one_rune", 10)
+        price = assets.current.prices.get("one_rune", 10)
         
         # Проверка лимитов
-        success, _, limits = await get_user_info_by_user_id(user_id)
-        if not success or limits < price:
+        prepared = await take_preparation(user_id)
+        if not await _has_enough_limits(user_id, price, prepared):
             await update.message.reply_text(
                 "У вас недостаточно лимитов. "
                 "Дождитесь пополнения или напишите админу @Apofiz2036"
@@ -139,38 +274,44 @@ async def _handle_one_rune_mode(update: Update, question: str) -> None:
             return
         
         # Списываем
-        if not await deduct_limits(user_id, price):
+        if not await _deduct(user_id, price, charge):
             await update.message.reply_text(
                 "Не удалось списать лимиты. Попробуйте позже."
             )
-            return  
+            return
 
-        rune_name, rune_image = await get_random_one_rune()
+        runes = await get_random_runes(1)
+        rune_name, rune_image = resolve_rune(runes[0], await load_rune_data()) if runes else (None, None)
+        if not rune_name or not rune_image:
+            await update.message.reply_text("Ошибка: данные рун не загружены правильно")
+            return
 
-        with open(rune_image, 'rb') as photo:
-            await update.message.reply_photo(photo)
+        await _send_rune_photo(update, rune_image, get_cached_file_id(rune_image))
         
         gpt_response = await ask_gpt(question, {'name': rune_name}, 'one_rune')
 
-        await save_divination(user_id, 'one_rune')
+        await save_divination(user_id, 'one_rune', encode_reading(question, runes, gpt_response))
 
-        await update.message.reply_text(gpt_response)
+        with span('send_answer'):
+            await update.message.reply_text(gpt_response)
+        charge['delivered'] = True
     except Exception as e:
         error_message = f"Ошибка в _handle_one_rune_mode: {e}"
         logger.error(error_message)
         await send_error_to_admin(update.get_bot(), error_message)
 
 
-async def _handle_multiple_runes_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, question: str, prompt_type: str) -> None:
+@traced()
+async def _handle_multiple_runes_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, question: str, prompt_type: str, charge: dict) -> None:
     """Обрабатывает запросы для режима с несколькими рунами (3, 4 и т.д.)."""
     try:
         user_id = update.message.from_user.id
-        prices = load_prices()
-        price = prices.get(prompt_type, 10)
+        price = assets.current.prices.get(prompt_type, 10)
 
-         # Проверка лимитов
-        success, _, limits = await get_user_info_by_user_id(user_id)
-        if not success or limits < price:
+        # Проверка лимитов
+        runes = context.user_data['selected_runes']
+        prepared = await take_preparation(user_id, runes)
+        if not await _has_enough_limits(user_id, price, prepared):
             await update.message.reply_text(
                 "У вас недостаточно лимитов. "
                 "Дождитесь пополнения или напишите админу @Apofiz2036"
@@ -178,54 +319,51 @@ async def _handle_multiple_runes_mode(update: Update, context: ContextTypes.DEFA
             return
 
         # Списываем
-        if not await deduct_limits(user_id, price):
+        if not await _deduct(user_id, price, charge):
             await update.message.reply_text(
                 "Не удалось списать лимиты. Попробуйте позже."
             )
             return
 
-        runes = context.user_data['selected_runes']
-        rune_data = await load_rune_data()
+        if prepared:
+            resolved = prepared['resolved']
+        else:
+            rune_data = await load_rune_data()
 
-        if not isinstance(rune_data, dict):
-            await update.message.reply_text("Ошибка: данные рун не загружены правильно")
-            return
+            if not isinstance(rune_data, dict):
+                await update.message.reply_text("Ошибка: данные рун не загружены правильно")
+                return
+
+            resolved = []
+            for rune in runes:
+                name, image_path = resolve_rune(rune, rune_data)
+                file_id = get_cached_file_id(image_path) if image_path else None
+                resolved.append((rune['rune_key'], name, image_path, file_id))
         
         runes_for_prompt = []
+        drawn = []
 
-        for rune in runes:
+        for rune, (rune_key, name_info, image_path, file_id) in zip(runes, resolved):
             try:
-                if rune['rune_key'] not in rune_data:
-                    await update.message.reply_text(f"Руна {rune['rune_key']} не найдена")
-                    continue
-
-                variant = rune['variant']
-                if variant is None:
-                    image_info = rune_data[rune['rune_key']].get('image')
-                    name_info = rune_data[rune['rune_key']].get('name')
-                else:
-                    image_info = rune_data[rune['rune_key']].get(variant, {}).get('image')
-                    name_info = rune_data[rune['rune_key']].get(variant, {}).get('name')
-                
-                if not image_info or not name_info:
-                    await update.message.reply_text(f"Данные для руны {rune['rune_key']} неполные")
+                if not name_info or not image_path:
+                    await update.message.reply_text(f"Данные для руны {rune_key} неполные")
                     continue
-                
-                image_path = os.path.join('images', image_info)
 
                 if SEND_IMAGES.get(prompt_type, True):
-                    with open(image_path, 'rb') as photo:
-                        await update.message.reply_photo(photo)
+                    await _send_rune_photo(update, image_path, file_id)
                 
                 runes_for_prompt.append({'name': name_info})
+                drawn.append(rune)
             except Exception as e:
                 await update.message.reply_text(f"Ошибка при обработке руны: {str(e)}")
                 continue
             
         if runes_for_prompt:
             gpt_response = await ask_gpt(question, runes_for_prompt, prompt_type)
-            await save_divination(user_id, prompt_type)
-            await update.message.reply_text(gpt_response)
+            await save_divination(user_id, prompt_type, encode_reading(question, drawn, gpt_response))
+            with span('send_answer'):
+                await update.message.reply_text(gpt_response)
+            charge['delivered'] = True
         else:
             await update.message.reply_text("Не удалось получить данные рун для интерпретации")
     
@@ -1,33 +1,61 @@
 import asyncio
 import logging
+import signal
 from dotenv import load_dotenv
 from pytz import timezone
 from telegram import Update
 from telegram.ext import (
     ApplicationBuilder, 
     CommandHandler,
+    CallbackQueryHandler,
     MessageHandler,
-    ContextTypes,
+    TypeHandler,
     filters,
 )
 
-from handlers.base import start, menu_command, error_handler, main_menu
-from handlers.runes import (
-    one_rune_mode, 
-    three_runes_mode, 
-    four_runes_mode, 
-    handle_message,
-    fate_mode,
-    field_mode
-)
+from handlers.base import start, menu_command, error_handler
 from handlers.admin import setup_admin_handlers
-from utils.database import init_db, get_user_info_by_user_id
+from handlers.router import router
+from handlers.history import history_callback, HISTORY_PATTERN
+from utils.storage import init_db, close_db
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from utils.scheduler import reset_daily_limits
 from data.export_to_cloud import export_to_csv, upload_to_yandex
-from utils.payment import payment_message, handle_payment_input
-from utils.logging import setup_logging, send_error_to_admin
-from config import TELEGRAM_BOT_TOKEN, ADMIN_ID
+from utils.logging import setup_logging, bind_log_context
+from utils.gpt import close_gpt_session
+from utils.persistence import SQLitePersistence
+from utils.sessions import session_store
+from utils.assets import assets
+from utils.concurrency import update_processor
+from utils.payment_poller import payment_poller
+from utils.yookassa_webhook import yookassa_webhook
+from utils.yookassa_service import close_yookassa_session
+from utils.metrics import metrics, metrics_server
+from utils.singleflight import divination_flights
+from utils.admission import divination_admission
+from utils.tasks import divination_tasks
+from utils.error_digest import error_digest
+from utils.coordination import coordination
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    ADMIN_ID,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    POLLING_TIMEOUT,
+    POLLING_INTERVAL,
+    BOT_API_BASE_URL,
+    BOT_API_BASE_FILE_URL,
+    BOT_POOL_SIZE,
+    BOT_CONNECT_TIMEOUT,
+    BOT_READ_TIMEOUT,
+    BOT_WRITE_TIMEOUT,
+    BOT_POOL_TIMEOUT,
+)
 
 load_dotenv()
 
@@ -35,86 +63,31 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 setup_logging()
 
-
-async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработка параметров меню выбранных пользователем"""
-    try:
-        if not update.message:
-            return
-
-        text = update.message.text
-
-        if text == "Одна руна":
-            await one_rune_mode(update, context)
-        elif text == "Три руны":
-            await three_runes_mode(update, context)
-        elif text == "Четыре руны":
-            await four_runes_mode(update, context)
-        elif text == "Судьба":
-            await fate_mode(update, context)
-        elif text == "Вспаханное поле":
-            await field_mode(update, context)
-        elif text == "Как гадать":
-            with open('text/how_to_guess.txt', 'r', encoding='utf-8') as file:
-                text = file.read()      
-            await update.message.reply_text(text)
-        elif text == "Мои лимиты":
-            success, public_id, limits = await get_user_info_by_user_id(update.effective_user.id)
-            if success:
-                await update.message.reply_text(
-                    f"Ваш public_id: {public_id}\n"
-                    f"Ваши лимиты: {limits}"
-                )
-            else:
-                await update.message.reply_text(
-                "Не удалось найти ваши данные. Попробуйте снова или напишите в поддержку."
-            )
-        elif text == "Пополнить лимиты":
-            await payment_message(update, context)
-        elif text == "Главное меню":
-            context.user_data.clear()
-            await main_menu(update, context)
-    except Exception as e:
-        error_message = f"Ошибка в handle_menu: {e}"
-        logger.error(error_message)
-        await send_error_to_admin(context.bot, error_message)
+# Роль ведущего, под которой выполняются задачи планировщика на всю базу
+SCHEDULER_LEADER = "scheduler"
 
 
 def setup_handlers(application) -> None:
     """Установка всех обработчиков для бота."""
     try:
+        # Поля апдейта (user_id, режим, update_id) для всех записей лога
+        application.add_handler(TypeHandler(Update, bind_log_context), group=-2)
+        # Учёт активности пользователей для выгрузки неактивных сессий
+        application.add_handler(TypeHandler(Update, session_store.touch), group=-1)
+
         # Обработчики команд
         application.add_handler(CommandHandler("start", start))
         application.add_handler(CommandHandler("menu", menu_command))
 
-        # Обработчики меню
-        menu_filters = filters.TEXT & (
-            filters.Regex("^Одна руна$") |
-            filters.Regex("^Три руны$") |
-            filters.Regex("^Четыре руны$") |
-            filters.Regex("^Судьба$") |
-            filters.Regex("^Вспаханное поле$") |
-            filters.Regex("^Как гадать$") |
-            filters.Regex("^Мои лимиты$") |
-            filters.Regex("^Пополнить лимиты$") |
-            filters.Regex("^Главное меню$")
-        )
-        application.add_handler(MessageHandler(menu_filters, handle_menu))
-
         #  Обработчики администратора
         setup_admin_handlers(application)
 
-        #  Обработчик сообщений об оплате
-        application.add_handler(
-            MessageHandler(
-                filters.TEXT & ~filters.User(int(ADMIN_ID)) & ~menu_filters,
-                handle_payment_input
-            )
-        )
+        #  Кнопки под списком «Мои гадания»
+        application.add_handler(CallbackQueryHandler(history_callback, pattern=HISTORY_PATTERN))
 
-        #  Обработчик сообщений обычных пользователей
+        #  Все остальные сообщения: кнопки и ввод в текущем режиме
         application.add_handler(
-            MessageHandler(filters.TEXT & ~filters.User(int(ADMIN_ID)), handle_message)
+            MessageHandler(filters.TEXT | filters.User(int(ADMIN_ID)), router.route)
         )
 
         #  Обработчик ошибок
@@ -124,31 +97,114 @@ def setup_handlers(application) -> None:
         logger.error(error_message)
 
 
-def export_and_upload():
-    """Экспорт и загрузка файлов в облако."""
+async def export_and_upload():
+    """Экспорт и загрузка файлов в облако (загрузка — в отдельном потоке)."""
     try:
-        subs_path, div_path = export_to_csv()
-        upload_to_yandex(subs_path, div_path)
+        subs_path, div_path = await export_to_csv()
+        await asyncio.to_thread(upload_to_yandex, subs_path, div_path)
     except Exception as e:
         error_message = f"Ошибка в export_and_upload: {e}"
         logger.error(error_message)
 
 
+def build_application():
+    """Создаёт приложение с настроенными пулами соединений к Bot API."""
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .persistence(SQLitePersistence())
+        # Разные пользователи обрабатываются параллельно, один пользователь — по очереди
+        .concurrent_updates(update_processor)
+        # Пул для исходящих запросов (sendMessage, sendPhoto и т.д.)
+        .connection_pool_size(BOT_POOL_SIZE)
+        .connect_timeout(BOT_CONNECT_TIMEOUT)
+        .read_timeout(BOT_READ_TIMEOUT)
+        .write_timeout(BOT_WRITE_TIMEOUT)
+        .pool_timeout(BOT_POOL_TIMEOUT)
+        # Отдельное соединение для long polling: ждёт дольше, чем длится сам опрос
+        .get_updates_connect_timeout(BOT_CONNECT_TIMEOUT)
+        .get_updates_read_timeout(POLLING_TIMEOUT + BOT_READ_TIMEOUT)
+        .get_updates_pool_timeout(BOT_POOL_TIMEOUT)
+    )
+
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(BOT_API_BASE_URL)
+    if BOT_API_BASE_FILE_URL:
+        builder = builder.base_file_url(BOT_API_BASE_FILE_URL)
+
+    return builder.build()
+
+
+async def start_receiving_updates(application) -> None:
+    """Запускает получение апдейтов через webhook или long polling (BOT_MODE)."""
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise ValueError("Для режима webhook нужно задать WEBHOOK_URL")
+        if not WEBHOOK_SECRET:
+            # Без секрета любой, кто узнал адрес, может присылать боту поддельные апдейты
+            raise ValueError("Для режима webhook нужно задать WEBHOOK_SECRET")
+
+        await application.updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info(f"Приём апдейтов через webhook на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+    else:
+        await application.updater.start_polling(
+            timeout=POLLING_TIMEOUT,
+            poll_interval=POLLING_INTERVAL,
+        )
+        logger.info("Приём апдейтов через long polling")
+
+
 async def run_bot() -> None:
     """Основная асинхронная функция для запуска бота"""
+    application = None
     try:
         await init_db()
-        application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+        # Цены, тексты и клавиатуры читаются с диска один раз, не в цикле событий
+        await asyncio.to_thread(assets.load)
+        application = build_application()
         setup_handlers(application)
+        session_store.attach(application)
+
+        # Внутренняя статистика компонентов в метриках
+        metrics.register_stats('updates', update_processor.stats)
+        metrics.register_stats('sessions', session_store.stats)
+        metrics.register_stats('duplicates', divination_flights.stats)
+        metrics.register_stats('admission', divination_admission.stats)
+        metrics.register_stats('divinations', lambda: {'running': len(divination_tasks)})
+        metrics.register_stats('errors', lambda: {'dropped_sends': error_digest.dropped_sends})
+        metrics.register_stats('coordination', coordination.stats)
 
         scheduler = AsyncIOScheduler(timezone=timezone("Europe/Moscow"))
-        scheduler.add_job(reset_daily_limits, 'cron', hour=0, minute=0)
-        scheduler.add_job(export_and_upload, 'cron', hour='*/3', minute=0)
+        # Задачи на всю базу выполняет только ведущий экземпляр
+        scheduler.add_job(coordination.leader_only(SCHEDULER_LEADER, reset_daily_limits), 'cron', hour=0, minute=0)
+        scheduler.add_job(coordination.leader_only(SCHEDULER_LEADER, export_and_upload), 'cron', hour='*/3', minute=0)
+        scheduler.add_job(session_store.evict_idle, 'interval', minutes=1)
+        scheduler.add_job(assets.reload_if_changed, 'interval', seconds=30)
+        await coordination.start()
         scheduler.start()
 
+        # Перезагрузка цен и текстов по сигналу SIGHUP
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGHUP, lambda: asyncio.create_task(assets.reload())
+            )
+        except (AttributeError, NotImplementedError):
+            logger.info("Перезагрузка ресурсов по сигналу недоступна на этой платформе")
+
         await application.initialize()
         await application.start()
-        await application.updater.start_polling()
+        await start_receiving_updates(application)
+        error_digest.start(application.bot)
+        await metrics_server.start()
+        payment_poller.start(application.bot)
+        await yookassa_webhook.start(application.bot)
 
         logger.info("Бот запущен и работает...")
 
@@ -160,9 +216,20 @@ async def run_bot() -> None:
         error_message = f"Ошибка в run_bot: {e}"
         logger.error(error_message)
     finally:
-        await application.updater.stop()
-        await application.stop()
-        await application.shutdown() 
+        await yookassa_webhook.stop()
+        await payment_poller.stop()
+        if application is not None:
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+        await metrics_server.stop()
+        await error_digest.stop()
+        await close_gpt_session()
+        await close_yookassa_session()
+        await coordination.stop()
+        await close_db()
 
 
 def main() -> None:
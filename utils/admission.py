@@ -0,0 +1,198 @@
+import math
+import time
+import logging
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+from utils.logging import setup_logging
+from config import (
+    USER_DIVINATIONS_PER_MINUTE,
+    USER_DIVINATIONS_BURST,
+    GPT_REQUESTS_PER_SECOND,
+    GPT_REQUESTS_BURST,
+    ADMISSION_MAX_WAIT,
+)
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# Как часто (в секундах) удалять полные корзины пользователей и забытые очереди
+PRUNE_INTERVAL = 60
+# Сколько секунд после назначенного времени держится место в очереди
+RESERVATION_GRACE = 60
+
+
+class TokenBucket:
+    """
+    Корзина жетонов: пополняется со скоростью rate в секунду, вмещает не больше burst.
+    Жетоны могут уходить в минус — так выдаются места в очереди на будущее время.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд появится целый жетон (0 — уже есть)."""
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+class Decision:
+    """Итог проверки: admitted или через сколько секунд попробовать снова и почему отказано."""
+
+    __slots__ = ('admitted', 'retry_after', 'reason')
+
+    def __init__(self, admitted: bool, retry_after: float = 0.0, reason: str = ''):
+        self.admitted = admitted
+        self.retry_after = retry_after
+        self.reason = reason
+
+    @property
+    def retry_seconds(self) -> int:
+        return max(1, math.ceil(self.retry_after))
+
+
+ADMITTED = Decision(True)
+
+
+class AdmissionControl:
+    """
+    Допуск гаданий до любой работы с базой и GPT: всё проверяется в памяти процесса.
+
+    У каждого пользователя своя корзина (user_per_minute гаданий в минуту, подряд — до user_burst),
+    общая корзина ограничивает запросы к GPT экземпляра (gpt_per_second, всплеск до gpt_burst).
+    Когда общая корзина пуста, пользователь получает место в очереди: жетон списывается сразу,
+    а в ответ называется время, когда жетон будет пополнен. Пока время не пришло, повторы
+    ничего не занимают, а пришедший вовремя допускается без новой очереди. Так при перегрузке
+    квота делится по порядку обращения, а не достаётся тому, кто чаще повторяет запрос.
+    Дальше max_wait секунд места не выдаются. Скорость 0 отключает соответствующую корзину.
+    Гадание, не дошедшее до GPT, возвращает жетоны через refund().
+    """
+
+    def __init__(self,
+                 user_per_minute: float = USER_DIVINATIONS_PER_MINUTE,
+                 user_burst: int = USER_DIVINATIONS_BURST,
+                 gpt_per_second: float = GPT_REQUESTS_PER_SECOND,
+                 gpt_burst: int = GPT_REQUESTS_BURST,
+                 max_wait: float = ADMISSION_MAX_WAIT,
+                 clock: Callable[[], float] = time.monotonic):
+        self.user_rate = user_per_minute / 60
+        self.user_burst = max(1, user_burst)
+        self.max_wait = max_wait
+        self.clock = clock
+        now = self.clock()
+        self._global = TokenBucket(gpt_per_second, max(1, gpt_burst), now) if gpt_per_second > 0 else None
+        self._users: Dict[int, TokenBucket] = {}
+        # user_id -> момент, с которого занятое место в очереди можно использовать
+        self._reserved: Dict[int, float] = {}
+        self._pruned = now
+        self.admitted = 0
+        self.refunded = 0
+        self.shed = Counter()
+
+    def _shed(self, user_id: int, retry_after: float, reason: str) -> Decision:
+        self.shed[reason] += 1
+        logger.info(
+            f"Гадание пользователя {user_id} не допущено ({reason}), повтор через {retry_after:.1f} с",
+            extra={'sampled': True}
+        )
+        return Decision(False, retry_after, reason)
+
+    def check(self, user_id: int) -> Decision:
+        """Решает, можно ли сейчас начать гадание пользователя, и сразу списывает жетоны."""
+        now = self.clock()
+        if now - self._pruned >= PRUNE_INTERVAL:
+            self._prune(now)
+
+        reserved_at = self._reserved.get(user_id)
+        if reserved_at is not None:
+            if now < reserved_at:
+                return self._shed(user_id, reserved_at - now, 'queued')
+            # Место дождалось своего времени: жетоны за него уже списаны
+            del self._reserved[user_id]
+            self.admitted += 1
+            return ADMITTED
+
+        bucket = None
+        if self.user_rate > 0:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst, now)
+            wait = bucket.wait_time(now)
+            if wait > 0:
+                return self._shed(user_id, wait, 'user')
+
+        if self._global is not None:
+            wait = self._global.wait_time(now)
+            if wait > 0:
+                if wait > self.max_wait:
+                    return self._shed(user_id, self.max_wait, 'overload')
+                self._global.tokens -= 1
+                if bucket is not None:
+                    bucket.tokens -= 1
+                self._reserved[user_id] = now + wait
+                return self._shed(user_id, wait, 'global')
+            self._global.tokens -= 1
+
+        if bucket is not None:
+            bucket.tokens -= 1
+        self.admitted += 1
+        return ADMITTED
+
+    def refund(self, user_id: int) -> None:
+        """
+        Возвращает жетоны допущенного гадания, которое не дошло до GPT
+        (не хватило лимитов, не удалось списать): квота не потрачена.
+        """
+        now = self.clock()
+        bucket = self._users.get(user_id)
+        if bucket is not None:
+            bucket.refill(now)
+            bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+        if self._global is not None:
+            self._global.refill(now)
+            self._global.tokens = min(self._global.burst, self._global.tokens + 1)
+        self.refunded += 1
+
+    def _prune(self, now: float) -> None:
+        """Полная корзина ничем не отличается от новой, а место в очереди не ждут вечно."""
+        self._pruned = now
+        for user_id in [user_id for user_id, bucket in self._users.items() if bucket.is_full(now)]:
+            del self._users[user_id]
+        for user_id in [user_id for user_id, at in self._reserved.items() if at + RESERVATION_GRACE < now]:
+            del self._reserved[user_id]
+
+    def stats(self) -> Dict:
+        """Допущено и отказано по причинам, сколько пользователей ждут своей очереди."""
+        global_tokens: Optional[float] = None
+        if self._global is not None:
+            self._global.refill(self.clock())
+            global_tokens = self._global.tokens
+        stats = {
+            'admitted_total': self.admitted,
+            'refunded_total': self.refunded,
+            'shed_total': sum(self.shed.values()),
+            'shed_by_reason': dict(self.shed),
+            'users_tracked': len(self._users),
+            'queued': len(self._reserved),
+        }
+        if global_tokens is not None:
+            stats['global_tokens'] = round(global_tokens, 2)
+        return stats
+
+
+divination_admission = AdmissionControl()
@@ -0,0 +1,160 @@
+import os
+import asyncio
+import logging
+from typing import Dict, NamedTuple
+
+from telegram import ReplyKeyboardMarkup, KeyboardButton
+
+from utils.prices import PRICES_FILE, load_prices
+from utils.logging import setup_logging
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+TEXT_DIR = "text"
+PROMPT_TYPES = ('one_rune', 'three_runes', 'four_runes', 'fate', 'field')
+
+DESCRIPTION_TEMPLATES = {
+    'one_rune': "✨ Одна руна — быстрый совет или короткий ответ на твой вопрос. Стоимость: {price} лимитов.",
+    'three_runes': "🔮 Три руны — помогут рассмотреть ситуацию глубже и увидеть скрытые стороны. Стоимость: {price} лимитов.",
+    'four_runes': "⚖️ Четыре руны — подскажут, какой выбор может привести к каким последствиям. Стоимость: {price} лимитов.",
+    'fate': "🌌 Судьба — раскроет направление пути: где ждут радости, а где могут подстерегать опасности. Стоимость: {price} лимитов.",
+    'field': "🌱 Вспаханное поле — прогноз на срок: от недели и дальше. Стоимость: {price} лимитов."
+}
+
+DEFAULT_TEXTS = {
+    'bot_description': "Описание бота временно недоступно.",
+    'how_to_guess': "Инструкция временно недоступна.",
+}
+
+
+class AssetSnapshot(NamedTuple):
+    """Неизменяемый набор загруженных ресурсов."""
+    prices: Dict[str, int]
+    descriptions: Dict[str, str]
+    texts: Dict[str, str]
+    prompts: Dict[str, str]
+    main_keyboard: ReplyKeyboardMarkup
+    back_keyboard: ReplyKeyboardMarkup
+    admin_keyboard: ReplyKeyboardMarkup
+
+
+def _read_text(name: str) -> str:
+    with open(os.path.join(TEXT_DIR, f"{name}.txt"), 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def _watched_files() -> list:
+    """Файлы, при изменении которых ресурсы перечитываются."""
+    files = [PRICES_FILE]
+    files += [os.path.join(TEXT_DIR, f"{name}.txt") for name in DEFAULT_TEXTS]
+    files += [os.path.join(TEXT_DIR, f"prompt_{prompt_type}.txt") for prompt_type in PROMPT_TYPES]
+    return files
+
+
+def _build_snapshot() -> AssetSnapshot:
+    """Читает все файлы и собирает новый набор ресурсов (блокирующая операция)."""
+    prices = load_prices()
+    descriptions = {
+        prompt_type: template.format(price=prices.get(prompt_type, 10))
+        for prompt_type, template in DESCRIPTION_TEMPLATES.items()
+    }
+
+    texts = {}
+    for name, default in DEFAULT_TEXTS.items():
+        try:
+            texts[name] = _read_text(name)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки файла {name}: {e}")
+            texts[name] = default
+
+    prompts = {}
+    for prompt_type in PROMPT_TYPES:
+        try:
+            prompts[prompt_type] = _read_text(f"prompt_{prompt_type}")
+        except Exception as e:
+            logger.error(f"Ошибка загрузки промпта {prompt_type}: {e}")
+
+    main_keyboard = ReplyKeyboardMarkup(
+        [
+            ["Одна руна", "Три руны"],
+            ["Четыре руны", "Судьба"],
+            ["Вспаханное поле"],
+            ["Пополнить лимиты"],
+            ["Как гадать", "Мои лимиты"],
+            ["Мои гадания"]
+        ],
+        resize_keyboard=True
+    )
+    back_keyboard = ReplyKeyboardMarkup([["Главное меню"]], resize_keyboard=True)
+    admin_keyboard = ReplyKeyboardMarkup(
+        [
+            [KeyboardButton("Рассылка"), KeyboardButton("Подписчики")],
+            [KeyboardButton("Пополнить лимиты"), KeyboardButton("Узнать лимиты пользователя")],
+            [KeyboardButton("Массовое пополнение"), KeyboardButton("Статистика")],
+        ],
+        resize_keyboard=True
+    )
+
+    return AssetSnapshot(
+        prices=prices,
+        descriptions=descriptions,
+        texts=texts,
+        prompts=prompts,
+        main_keyboard=main_keyboard,
+        back_keyboard=back_keyboard,
+        admin_keyboard=admin_keyboard,
+    )
+
+
+class AssetRegistry:
+    """
+    Хранит в памяти цены, тексты, промпты и клавиатуры.
+    Обработчики берут текущий набор через assets.current; перезагрузка подменяет его целиком.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._mtimes = {}
+
+    @property
+    def current(self) -> AssetSnapshot:
+        if self._snapshot is None:
+            self.load()
+        return self._snapshot
+
+    def _read_mtimes(self) -> Dict[str, float]:
+        mtimes = {}
+        for path in _watched_files():
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def load(self) -> None:
+        """Загружает ресурсы синхронно (при запуске)."""
+        mtimes = self._read_mtimes()
+        self._snapshot = _build_snapshot()
+        self._mtimes = mtimes
+
+    async def reload(self) -> None:
+        """Перечитывает ресурсы в отдельном потоке и атомарно подменяет набор."""
+        try:
+            mtimes = await asyncio.to_thread(self._read_mtimes)
+            snapshot = await asyncio.to_thread(_build_snapshot)
+            self._snapshot = snapshot
+            self._mtimes = mtimes
+            logger.info("Ресурсы бота перезагружены")
+        except Exception as e:
+            logger.error(f"Ошибка перезагрузки ресурсов: {e}")
+
+    async def reload_if_changed(self) -> None:
+        """Перезагружает ресурсы, если какой-то файл изменился (запускается по расписанию)."""
+        mtimes = await asyncio.to_thread(self._read_mtimes)
+        if mtimes != self._mtimes:
+            await self.reload()
+
+
+assets = AssetRegistry()
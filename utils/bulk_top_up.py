@@ -0,0 +1,175 @@
+import io
+import csv
+import asyncio
+import logging
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from utils.storage import bulk_top_up_limits
+from utils.logging import setup_logging
+from config import BULK_TOP_UP_CHUNK, BULK_NOTIFY_RATE
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# Сколько ошибочных строк показывать в отчёте
+MAX_REPORTED_ERRORS = 10
+
+
+class TopUpFile(NamedTuple):
+    """Результат разбора файла пополнения."""
+    entries: Dict[str, int]  # public_id -> сумма (повторы сложены)
+    rows: int
+    duplicates: int
+    errors: List[Tuple[int, str]]  # (номер строки, причина)
+
+
+class TopUpReport(NamedTuple):
+    """Итог массового пополнения."""
+    success: bool
+    parsed: TopUpFile
+    credited: List[Tuple[int, str, int]]  # (user_id, public_id, amount)
+    not_found: List[str]
+
+
+def _iter_csv_rows(data: bytes) -> Iterator[list]:
+    """Построчно читает CSV; разделитель (',', ';' или табуляция) определяется по первой строке."""
+    text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+    first_line = text.readline()
+    try:
+        dialect = csv.Sniffer().sniff(first_line, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    text.seek(0)
+    yield from csv.reader(text, dialect)
+
+
+def _iter_xlsx_rows(data: bytes) -> Iterator[list]:
+    """Построчно читает первый лист XLSX в режиме read_only."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ['' if value is None else value for value in row]
+    finally:
+        workbook.close()
+
+
+def _parse_amount(value) -> int:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    amount = int(str(value).strip())
+    if amount <= 0:
+        raise ValueError
+    return amount
+
+
+def parse_top_up_file(data: bytes, file_name: str) -> TopUpFile:
+    """
+    Разбирает файл со строками public_id;сумма.
+    Строки читаются по одной, без загрузки всей таблицы в память.
+    Первая строка пропускается, если это заголовок. Пустые строки игнорируются.
+    """
+    if file_name.lower().endswith('.xlsx'):
+        rows_iter = _iter_xlsx_rows(data)
+    else:
+        rows_iter = _iter_csv_rows(data)
+
+    entries: Dict[str, int] = {}
+    rows = 0
+    duplicates = 0
+    errors: List[Tuple[int, str]] = []
+
+    for line_number, row in enumerate(rows_iter, start=1):
+        cells = [str(cell).strip() for cell in row]
+        if not any(cells):
+            continue
+
+        if len(cells) < 2 or not cells[0]:
+            errors.append((line_number, "нужны два столбца: public_id и сумма"))
+            continue
+
+        try:
+            amount = _parse_amount(row[1])
+        except (TypeError, ValueError):
+            if line_number == 1:
+                # Заголовок
+                continue
+            errors.append((line_number, f"неверная сумма '{cells[1]}'"))
+            continue
+
+        rows += 1
+        public_id = cells[0].upper()
+        if public_id in entries:
+            duplicates += 1
+            entries[public_id] += amount
+        else:
+            entries[public_id] = amount
+
+    return TopUpFile(entries=entries, rows=rows, duplicates=duplicates, errors=errors)
+
+
+async def apply_top_up_file(data: bytes, file_name: str) -> TopUpReport:
+    """Разбирает файл в отдельном потоке и пополняет лимиты пачками."""
+    parsed = await asyncio.to_thread(parse_top_up_file, data, file_name)
+    success, credited, not_found = await bulk_top_up_limits(list(parsed.entries.items()), BULK_TOP_UP_CHUNK)
+    logger.info(
+        f"Массовое пополнение из {file_name}: строк {parsed.rows}, пополнено {len(credited)}, "
+        f"не найдено {len(not_found)}, ошибок {len(parsed.errors)}"
+    )
+    return TopUpReport(success=success, parsed=parsed, credited=credited, not_found=not_found)
+
+
+def format_report(report: TopUpReport) -> str:
+    """Текст отчёта для администратора."""
+    parsed = report.parsed
+    total = sum(amount for _, _, amount in report.credited)
+    lines = [
+        "Массовое пополнение завершено!" if report.success else "Массовое пополнение прервано из-за ошибки базы данных!",
+        "",
+        f"Строк с данными: {parsed.rows}",
+        f"Пополнено пользователей: {len(report.credited)}",
+        f"Начислено лимитов всего: {total}",
+    ]
+    if parsed.duplicates:
+        lines.append(f"Повторы public_id (суммы сложены): {parsed.duplicates}")
+    if report.not_found:
+        shown = ", ".join(report.not_found[:MAX_REPORTED_ERRORS])
+        more = "…" if len(report.not_found) > MAX_REPORTED_ERRORS else ""
+        lines.append(f"Не найдены ({len(report.not_found)}): {shown}{more}")
+    if parsed.errors:
+        lines.append(f"Ошибочных строк: {len(parsed.errors)}")
+        for line_number, reason in parsed.errors[:MAX_REPORTED_ERRORS]:
+            lines.append(f"  строка {line_number}: {reason}")
+        if len(parsed.errors) > MAX_REPORTED_ERRORS:
+            lines.append("  …")
+    return "\n".join(lines)
+
+
+async def notify_credited(bot, credited: List[Tuple[int, str, int]], admin_id: int,
+                          rate: float = BULK_NOTIFY_RATE) -> None:
+    """Уведомляет пополненных пользователей не чаще rate сообщений в секунду и сообщает итог администратору."""
+    interval = 1 / rate if rate > 0 else 0
+    sent = 0
+    failed = 0
+
+    for user_id, _, amount in credited:
+        try:
+            await bot.send_message(
+                chat_id=user_id,
+                text=f"Ваши лимиты пополнены на {amount}. Текущий баланс можно проверить в меню."
+            )
+            sent += 1
+        except Exception as e:
+            failed += 1
+            logger.debug(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+        await asyncio.sleep(interval)
+
+    try:
+        await bot.send_message(
+            chat_id=admin_id,
+            text=f"Уведомления о пополнении отправлены: {sent}, не доставлено: {failed}"
+        )
+    except Exception as e:
+        logger.error(f"Не удалось отправить итог уведомлений администратору: {e}")
@@ -0,0 +1,160 @@
+import time
+import asyncio
+import logging
+from contextlib import nullcontext
+from typing import Any, Awaitable, Dict, List
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from utils.logging import setup_logging
+from utils.tracing import start_trace
+from utils.metrics import UPDATES_DROPPED
+from utils.coordination import Coordinator, coordination
+from config import MAX_CONCURRENT_UPDATES, USER_QUEUE_LIMIT, USER_LOCK_TTL
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# Ответ на апдейт, отброшенный из-за переполненной очереди пользователя (один раз за серию)
+QUEUE_FULL_TEXT = "Подождите, предыдущие сообщения ещё обрабатываются."
+
+
+def _update_kind(update: Update) -> str:
+    """Тип апдейта для метрик: message, callback_query и т.д."""
+    if update.message is not None:
+        return 'message'
+    if update.callback_query is not None:
+        return 'callback_query'
+    return 'other'
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает апдейты разных пользователей параллельно,
+    а апдейты одного пользователя — строго по очереди и в порядке поступления
+    (при нескольких экземплярах бота — через общий замок пользователя в utils.coordination).
+    Общее число одновременно обрабатываемых апдейтов ограничено max_concurrent_updates.
+    Очередь пользователя и его замок проходятся до общего слота: ждущие апдейты слотов не занимают.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES, user_queue_limit: int = USER_QUEUE_LIMIT,
+                 coordinator: Coordinator = coordination):
+        super().__init__(max_concurrent_updates)
+        self.user_queue_limit = user_queue_limit
+        self.coordinator = coordinator
+        # user_id -> [замок, число апдейтов, ждущих или выполняющихся, предупреждён ли пользователь]
+        self._locks: Dict[int, List] = {}
+        self.dropped = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    # В PTB 20.6 process_update помечен @final и берёт общий слот до do_process_update.
+    # Переопределяем его, чтобы отбрасывать апдейты и ждать замок пользователя без слота.
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._locks.get(user.id)
+        if entry is None:
+            entry = self._locks[user.id] = [asyncio.Lock(), 0, False]
+
+        # При нескольких экземплярах бота очередь и замок пользователя общие:
+        # апдейты одного пользователя, пришедшие на разные экземпляры, тоже идут по очереди
+        shared = self.coordinator.shared
+        queue_name = f"queue:{user.id}"
+        counted = False
+
+        entry[1] += 1
+        started = time.monotonic()
+        try:
+            queued = entry[1]
+            if shared:
+                try:
+                    queued = await self.coordinator.incr(queue_name, 1, USER_LOCK_TTL)
+                    counted = True
+                except Exception as e:
+                    logger.error(f"Ошибка общей очереди пользователя {user.id}: {e}")
+
+            if queued > self.user_queue_limit:
+                coroutine.close()
+                await self._drop(update, user.id, queued, entry)
+                return
+
+            user_lock = self.coordinator.lock(f"user:{user.id}", USER_LOCK_TTL) if shared else nullcontext()
+            async with entry[0], user_lock:
+                await super().process_update(update, self._run(update, user.id, coroutine, started))
+        finally:
+            if counted:
+                try:
+                    await self.coordinator.incr(queue_name, -1, USER_LOCK_TTL)
+                except Exception as e:
+                    logger.error(f"Ошибка общей очереди пользователя {user.id}: {e}")
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(user.id, None)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def _run(self, update: Update, user_id: int, coroutine: Awaitable[Any], started: float) -> None:
+        """Обрабатывает апдейт, уже получивший замок пользователя и общий слот."""
+        waited = time.monotonic() - started
+        self._record_wait(waited)
+        with start_trace('update', user_id=user_id, update_id=update.update_id,
+                         lock_wait_ms=round(waited * 1000, 1)):
+            await coroutine
+        logger.info(
+            "Апдейт обработан",
+            extra={
+                'sampled': True,
+                'duration_ms': round((time.monotonic() - started - waited) * 1000, 1),
+                'lock_wait_ms': round(waited * 1000, 1),
+            }
+        )
+
+    async def _drop(self, update: Update, user_id: int, queued: int, entry: List) -> None:
+        """Учитывает отброшенный апдейт и один раз за серию предупреждает пользователя."""
+        self.dropped += 1
+        kind = _update_kind(update)
+        UPDATES_DROPPED.inc(kind)
+        logger.warning(
+            f"Отброшен апдейт {update.update_id} ({kind}) пользователя {user_id}: "
+            f"в очереди уже {queued - 1}, лимит {self.user_queue_limit}"
+        )
+        if entry[2] or update.effective_message is None:
+            return
+        entry[2] = True
+        try:
+            await update.effective_message.reply_text(QUEUE_FULL_TEXT)
+        except Exception as e:
+            logger.error(f"Не удалось предупредить пользователя {user_id} об очереди: {e}")
+
+    def _record_wait(self, waited: float) -> None:
+        self.wait_count += 1
+        self.wait_total += waited
+        if waited > self.wait_max:
+            self.wait_max = waited
+
+    def stats(self) -> Dict:
+        """Ожидание замков пользователей и число отброшенных апдейтов."""
+        return {
+            'users_in_progress': len(self._locks),
+            'lock_waits': self.wait_count,
+            'lock_wait_avg': self.wait_total / self.wait_count if self.wait_count else 0.0,
+            'lock_wait_max': self.wait_max,
+            'dropped_updates': self.dropped,
+        }
+
+
+update_processor = PerUserUpdateProcessor()
@@ -0,0 +1,439 @@
+"""
+Координация нескольких экземпляров бота за одним webhook: замки, выбор ведущего
+для фоновых задач и общие счётчики.
+
+- COORDINATION_URL не задан — состояние в памяти процесса, поведение как у одного экземпляра.
+- redis://[:пароль@]хост:порт/база — состояние на сервере Redis (или любом другом с протоколом RESP).
+
+Все ключи живут ограниченное время, поэтому замки и роль ведущего упавшего экземпляра
+освобождаются сами. Проверка на локальной заглушке сервера: benchmarks/coordination_check.py.
+"""
+import os
+import time
+import socket
+import asyncio
+import secrets
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from utils.logging import setup_logging
+from utils.error_digest import error_digest
+from config import COORDINATION_URL, COORDINATION_PREFIX, LEADER_LEASE_TTL
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# Скрипты сервера: продлить и снять ключ можно, только если он всё ещё наш
+RENEW_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+)
+RELEASE_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) else return 0 end"
+)
+
+# Паузы между попытками взять занятый замок, секунды
+LOCK_RETRY_MIN = 0.01
+LOCK_RETRY_MAX = 0.2
+
+
+class LockTimeout(Exception):
+    """Замок не удалось взять за отведённое время."""
+
+
+class LocalBackend:
+    """Ключи со сроком жизни в памяти процесса."""
+
+    shared = False
+
+    def __init__(self):
+        # ключ -> (значение, момент истечения по time.monotonic() или None)
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self._values.items() if expires_at is not None and expires_at <= now]:
+            del self._values[key]
+
+    async def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        if self._get(key) is not None:
+            return False
+        if len(self._values) > 10_000:
+            self._prune()
+        self._values[key] = (value, time.monotonic() + ttl)
+        return True
+
+    async def renew(self, key: str, value: str, ttl: float) -> bool:
+        if self._get(key) != value:
+            return False
+        self._values[key] = (value, time.monotonic() + ttl)
+        return True
+
+    async def release(self, key: str, value: str) -> bool:
+        if self._get(key) != value:
+            return False
+        del self._values[key]
+        return True
+
+    async def expire(self, key: str, ttl: float) -> None:
+        value = self._get(key)
+        if value is None:
+            return
+        if ttl <= 0:
+            del self._values[key]
+        else:
+            self._values[key] = (value, time.monotonic() + ttl)
+
+    async def incr(self, key: str, amount: int, ttl: Optional[float]) -> int:
+        value = int(self._get(key) or 0) + amount
+        self._values[key] = (str(value), time.monotonic() + ttl if ttl else None)
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._get(key)
+
+    async def close(self) -> None:
+        pass
+
+
+class RespError(Exception):
+    """Сервер ответил ошибкой."""
+
+
+class RespBackend:
+    """
+    Клиент протокола RESP (Redis). Одно соединение, команды идут по очереди;
+    после сетевой ошибки соединение открывается заново при следующей команде.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RespError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RespError(f"Непонятный ответ сервера: {line!r}")
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._roundtrip([("AUTH", self.password)])
+        if self.db:
+            await self._roundtrip([("SELECT", self.db)])
+
+    async def _roundtrip(self, commands: list) -> list:
+        self._writer.write(b"".join(self._encode(*command) for command in commands))
+        await self._writer.drain()
+        # Ответы читаются все, даже после ошибки, чтобы следующая команда не получила чужой ответ
+        replies = []
+        for _ in commands:
+            try:
+                replies.append(await self._read_reply())
+            except RespError as e:
+                replies.append(e)
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    async def execute(self, *commands: tuple) -> list:
+        """Отправляет команды одним пакетом и возвращает ответы по порядку."""
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await asyncio.wait_for(self._connect(), self.timeout)
+                return await asyncio.wait_for(self._roundtrip(commands), self.timeout)
+            except RespError:
+                raise
+            except (Exception, asyncio.CancelledError):
+                # Ответ мог остаться непрочитанным — соединение больше не годится
+                await self._close_connection()
+                raise
+
+    async def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        (reply,) = await self.execute(("SET", key, value, "NX", "PX", int(ttl * 1000)))
+        return reply == "OK"
+
+    async def renew(self, key: str, value: str, ttl: float) -> bool:
+        (reply,) = await self.execute(("EVAL", RENEW_SCRIPT, 1, key, value, int(ttl * 1000)))
+        return reply == 1
+
+    async def release(self, key: str, value: str) -> bool:
+        (reply,) = await self.execute(("EVAL", RELEASE_SCRIPT, 1, key, value))
+        return reply == 1
+
+    async def expire(self, key: str, ttl: float) -> None:
+        if ttl <= 0:
+            await self.execute(("DEL", key))
+        else:
+            await self.execute(("PEXPIRE", key, int(ttl * 1000)))
+
+    async def incr(self, key: str, amount: int, ttl: Optional[float]) -> int:
+        if not ttl:
+            (value,) = await self.execute(("INCRBY", key, amount))
+            return value
+        value, _ = await self.execute(("INCRBY", key, amount), ("PEXPIRE", key, int(ttl * 1000)))
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        (value,) = await self.execute(("GET", key))
+        return value
+
+    async def _close_connection(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = self._writer = None
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._close_connection()
+
+
+class Coordinator:
+    """
+    Общее состояние экземпляров бота поверх LocalBackend или RespBackend.
+
+    - lock(): замок с владельцем и сроком жизни;
+    - leader_only() и campaign(): роль ведущего по имени — задачу выполняет только
+      экземпляр, который держит аренду; аренда продлевается в фоне, при падении
+      ведущего её через LEADER_LEASE_TTL забирает другой экземпляр;
+    - incr(): общие счётчики.
+    """
+
+    def __init__(self, backend, prefix: str = COORDINATION_PREFIX, lease_ttl: float = LEADER_LEASE_TTL):
+        self.backend = backend
+        self.prefix = prefix
+        self.lease_ttl = lease_ttl
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+        # Имена, за роль ведущего в которых борется этот экземпляр
+        self._campaigns: Set[str] = set()
+        # Имя -> до какого момента (time.monotonic()) аренда точно наша
+        self._leases: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.lock_waits = 0
+        self.errors = 0
+
+    @property
+    def shared(self) -> bool:
+        """True, если состояние общее для нескольких экземпляров."""
+        return self.backend.shared
+
+    def _key(self, kind: str, name: str) -> str:
+        return f"{self.prefix}{kind}:{name}"
+
+    def _report(self, error_message: str) -> None:
+        self.errors += 1
+        logger.error(error_message)
+        error_digest.report(error_message)
+
+    # Роль ведущего
+
+    async def start(self) -> None:
+        """Сразу пробует стать ведущим и запускает продление аренды."""
+        await self._campaign_all()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает продление и отдаёт аренду, чтобы другой экземпляр стал ведущим сразу."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for name in list(self._leases):
+            try:
+                await self.backend.release(self._key("leader", name), self.worker_id)
+            except Exception as e:
+                logger.warning(f"Не удалось отдать аренду {name}: {e}")
+        self._leases.clear()
+        await self.backend.close()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            await self._campaign_all()
+
+    async def _campaign_all(self) -> None:
+        for name in list(self._campaigns):
+            await self._campaign(name)
+
+    async def _campaign(self, name: str) -> bool:
+        """Продлевает свою аренду или пробует взять свободную. Возвращает, ведущий ли экземпляр."""
+        key = self._key("leader", name)
+        # Срок считается от момента до запроса: аренда истекает у нас не позже, чем на сервере
+        started = time.monotonic()
+        try:
+            if name in self._leases:
+                acquired = await self.backend.renew(key, self.worker_id, self.lease_ttl)
+                if not acquired:
+                    logger.warning(f"Аренда ведущего {name} потеряна")
+            else:
+                acquired = await self.backend.set_if_absent(key, self.worker_id, self.lease_ttl)
+                if acquired:
+                    logger.info(f"Экземпляр {self.worker_id} стал ведущим: {name}")
+        except Exception as e:
+            self._report(f"Ошибка координации (аренда {name}): {e}")
+            acquired = False
+
+        if acquired:
+            self._leases[name] = started + self.lease_ttl
+        elif not self.is_leader(name):
+            self._leases.pop(name, None)
+        return acquired
+
+    async def campaign(self, name: str) -> bool:
+        """Включает борьбу за роль ведущего name и сразу делает попытку."""
+        self._campaigns.add(name)
+        return await self._campaign(name)
+
+    def is_leader(self, name: str) -> bool:
+        """Держит ли этот экземпляр аренду name прямо сейчас."""
+        return self._leases.get(name, 0) > time.monotonic()
+
+    def leader_only(self, name: str, func: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+        """Обёртка задачи планировщика: выполняется только на ведущем name."""
+        self._campaigns.add(name)
+
+        async def wrapper():
+            if not self.is_leader(name) and not await self._campaign(name):
+                logger.debug(f"{func.__name__} пропущена: ведущий {name} — другой экземпляр")
+                return None
+            return await func()
+
+        wrapper.__name__ = func.__name__
+        return wrapper
+
+    # Замки
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float, timeout: Optional[float] = None):
+        """
+        Замок name на время блока. Держится не дольше ttl секунд, даже если экземпляр упал.
+        timeout — сколько ждать занятый замок (None — пока не освободится); по истечении — LockTimeout.
+        Если сервер координации недоступен, блок выполняется без замка (ошибка уходит в лог).
+        """
+        key = self._key("lock", name)
+        token = f"{self.worker_id}:{secrets.token_hex(4)}"
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = LOCK_RETRY_MIN
+        acquired = False
+        try:
+            while not await self.backend.set_if_absent(key, token, ttl):
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise LockTimeout(name)
+                self.lock_waits += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LOCK_RETRY_MAX)
+            acquired = True
+        except LockTimeout:
+            raise
+        except Exception as e:
+            self._report(f"Ошибка координации (замок {name}): {e}")
+
+        try:
+            yield
+        finally:
+            if acquired:
+                try:
+                    await self.backend.release(key, token)
+                except Exception as e:
+                    logger.warning(f"Не удалось снять замок {name}, он истечёт сам: {e}")
+
+    # Ключи с временем жизни и счётчики
+
+    async def claim(self, name: str, ttl: float) -> bool:
+        """Занимает ключ name на ttl секунд. False, если он уже занят (кем угодно, в том числе нами)."""
+        return await self.backend.set_if_absent(self._key("claim", name), self.worker_id, ttl)
+
+    async def is_claimed(self, name: str) -> bool:
+        """Занят ли сейчас ключ name (кем угодно)."""
+        return await self.backend.get(self._key("claim", name)) is not None
+
+    async def expire(self, name: str, ttl: float) -> None:
+        """Меняет срок жизни ключа, занятого claim(); ttl <= 0 — освобождает сразу."""
+        await self.backend.expire(self._key("claim", name), ttl)
+
+    async def incr(self, name: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Прибавляет amount к общему счётчику и возвращает новое значение; ttl продлевается при каждом изменении."""
+        return await self.backend.incr(self._key("counter", name), amount, ttl)
+
+    async def get_counter(self, name: str) -> int:
+        """Текущее значение общего счётчика."""
+        return int(await self.backend.get(self._key("counter", name)) or 0)
+
+    def stats(self) -> Dict:
+        """Режим, роли ведущего и ожидания замков."""
+        return {
+            'shared': int(self.shared),
+            'leader': {name: int(self.is_leader(name)) for name in sorted(self._campaigns)},
+            'lock_waits': self.lock_waits,
+            'errors': self.errors,
+        }
+
+
+def create_backend(url: str):
+    """Хранилище состояния по COORDINATION_URL."""
+    if not url:
+        return LocalBackend()
+    if urlparse(url).scheme in ("redis", "resp"):
+        return RespBackend(url)
+    raise ValueError(f"Неизвестный COORDINATION_URL={url!r}, ожидается redis://хост:порт/база")
+
+
+coordination = Coordinator(create_backend(COORDINATION_URL))
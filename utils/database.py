@@ -3,21 +3,41 @@ from pathlib import Path
 import csv
 import secrets
 import os
+import time
 import logging
-from datetime import datetime
-from utils.logging import setup_logging, send_error_to_admin
+from datetime import datetime, timedelta
+from utils.logging import setup_logging
+from utils.error_digest import error_digest
+from utils.metrics import timed, DB_QUERY_SECONDS
 from config import SQLITE_DB, ADMIN_ID
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
 setup_logging()
 
+# Виды гаданий с постоянными кодами (divination_types.id = позиция + 1).
+# Новые виды добавляются в таблицу автоматически при первом гадании
+DIVINATION_TYPES = ('one_rune', 'three_runes', 'four_runes', 'fate', 'field')
 
+# Кэш divination_types: название -> код
+_divination_type_ids = {name: code for code, name in enumerate(DIVINATION_TYPES, start=1)}
+
+
+@timed(DB_QUERY_SECONDS)
 async def init_db():
     """
-    Создайт базу данных с двумя таблицами
-    - subscribers: хранит информацию о пользователях (user_id, first_seen, limits).
-    - divinations: хранит историю гаданий (user_id, date, divination_type)
+    Создайт базу данных с таблицами
+    - subscribers: хранит информацию о пользователях (user_id, first_seen, limits, public_id)
+    - divinations: хранит историю гаданий (user_id, created_at, type_id)
+    - divination_types: названия видов гаданий по их кодам
+    Время хранится целым числом секунд UTC (Unix time).
+    - user_state: хранит состояние диалога пользователя в сжатом виде
+    - pending_payments: платежи, статус которых ещё проверяется
+    - payments_ledger: зачисленные платежи (защита от повторного зачисления)
+    - divination_history: вопрос, расклад и ответ гадания в сжатом виде (id — как в divinations)
+    - stats_daily, stats_divinations_daily: дневная статистика, обновляется вместе с записью данных
+    - stats_daily_users: кто уже учтён в активных и платящих за день (для подсчёта уникальных)
+    - stats_totals: накопительные итоги (всего подписчиков), обновляются вместе с записью данных
     """
     try:
         # Создаём папку если её ещё нет
@@ -32,32 +52,147 @@ async def init_db():
         await cursor.execute("""
             CREATE TABLE IF NOT EXISTS subscribers (
                 user_id INTEGER PRIMARY KEY,
-                first_seen TEXT NOT NULL,
-                limits INTEGER DEFAULT 50
+                first_seen INTEGER NOT NULL,
+                limits INTEGER DEFAULT 50,
+                public_id TEXT UNIQUE
+            )
+        """)
+
+        # Создаём таблицу divination_types и заполняем известные виды
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS divination_types (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
             )
         """)
+        await cursor.executemany(
+            "INSERT OR IGNORE INTO divination_types (id, name) VALUES (?, ?)",
+            [(code, name) for code, name in enumerate(DIVINATION_TYPES, start=1)]
+        )
 
         # Создаём таблицу divinations
         await cursor.execute("""
             CREATE TABLE IF NOT EXISTS divinations (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
-                date TEXT NOT NULL,
-                divination_type TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES subscribers (user_id)
+                created_at INTEGER NOT NULL,
+                type_id INTEGER NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES subscribers (user_id),
+                FOREIGN KEY (type_id) REFERENCES divination_types (id)
+            )
+        """)
+
+        # Создаём таблицу user_state (состояние диалога пользователя)
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_state (
+                user_id INTEGER PRIMARY KEY,
+                mode INTEGER NOT NULL DEFAULT 0,
+                prompt_type INTEGER NOT NULL DEFAULT 0,
+                spread BLOB,
+                admin_state INTEGER,
+                flags INTEGER NOT NULL DEFAULT 0,
+                extra TEXT
+            )
+        """)
+
+        # Создаём таблицу pending_payments (платежи, ожидающие подтверждения)
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pending_payments (
+                payment_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                public_id TEXT NOT NULL,
+                amount REAL NOT NULL,
+                chat_id INTEGER,
+                created_at REAL NOT NULL,
+                next_check_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
             )
         """)
+        await cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_pending_payments_next_check ON pending_payments (next_check_at)"
+        )
+
+        # Создаём таблицу payments_ledger (зачисленные платежи, по одной строке на платёж)
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS payments_ledger (
+                payment_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                credited_at REAL NOT NULL
+            )
+        """)
+
+        # Создаём таблицу divination_history (история гаданий для пользователя)
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS divination_history (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                spread BLOB,
+                question BLOB NOT NULL,
+                answer BLOB NOT NULL
+            )
+        """)
+        await cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_divination_history_user ON divination_history (user_id, id)"
+        )
+
+        # Создаём таблицы дневной статистики
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_daily (
+                day TEXT PRIMARY KEY,
+                active_users INTEGER NOT NULL DEFAULT 0,
+                new_subscribers INTEGER NOT NULL DEFAULT 0,
+                divinations INTEGER NOT NULL DEFAULT 0,
+                payments INTEGER NOT NULL DEFAULT 0,
+                paying_users INTEGER NOT NULL DEFAULT 0,
+                credits_purchased INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_divinations_daily (
+                day TEXT NOT NULL,
+                divination_type TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, divination_type)
+            ) WITHOUT ROWID
+        """)
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_daily_users (
+                day TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (day, kind, user_id)
+            ) WITHOUT ROWID
+        """)
+        await cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_totals (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        # Базы, созданные до stats_totals: число подписчиков считается один раз
+        await cursor.execute("SELECT 1 FROM stats_totals WHERE name = 'subscribers'")
+        if await cursor.fetchone() is None:
+            await cursor.execute(
+                "INSERT INTO stats_totals (name, value) SELECT 'subscribers', COUNT(*) FROM subscribers"
+            )
 
         # Сохраняем таблицу
         await conn.commit()
         await conn.close()
 
         await migrate_db() 
+        await migrate_compact_columns()
     except Exception as e:
         error_message = "Ошибка при создании базы данных"
         logger.error(error_message)
 
 
+async def close_db():
+    """Соединения открываются на каждый вызов, закрывать нечего (нужна для общего интерфейса хранилища)."""
+
+
+@timed(DB_QUERY_SECONDS)
 async def migrate_db(): 
     """Добавляет столбец public_id в таблицу subscribers, если его нет."""
     try:
@@ -114,11 +249,85 @@ async def migrate_db():
     except Exception as e:
         error_message = f"Ошибка в migrate_db: {e}"
         logger.error(error_message)
-        send_error_to_admin(error_message)
+        error_digest.report(error_message)
     finally:
         await conn.close()
         
 
+@timed(DB_QUERY_SECONDS)
+async def migrate_compact_columns():
+    """
+    Переводит старые базы на компактные столбцы:
+    - subscribers.first_seen и divinations.date (текст местного времени) -> целые секунды UTC;
+    - divinations.divination_type (строка) -> divinations.type_id из divination_types.
+    Каждая таблица пересобирается одной транзакцией; id гаданий сохраняются.
+    """
+    conn = None
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute("PRAGMA table_info(subscribers)")
+        column_types = {column[1]: column[2].upper() for column in await cursor.fetchall()}
+        if column_types.get("first_seen") == "TEXT":
+            await cursor.execute("BEGIN IMMEDIATE")
+            await cursor.execute("""
+                CREATE TABLE subscribers_new (
+                    user_id INTEGER PRIMARY KEY,
+                    first_seen INTEGER NOT NULL,
+                    limits INTEGER DEFAULT 50,
+                    public_id TEXT UNIQUE
+                )
+            """)
+            # Модификатор 'utc' переводит местное время строки в UTC
+            await cursor.execute("""
+                INSERT INTO subscribers_new (user_id, first_seen, limits, public_id)
+                SELECT user_id, CAST(strftime('%s', first_seen, 'utc') AS INTEGER), limits, public_id
+                FROM subscribers
+            """)
+            await cursor.execute("DROP TABLE subscribers")
+            await cursor.execute("ALTER TABLE subscribers_new RENAME TO subscribers")
+            await conn.commit()
+            logger.info("subscribers.first_seen переведён в секунды UTC")
+
+        await cursor.execute("PRAGMA table_info(divinations)")
+        columns = [column[1] for column in await cursor.fetchall()]
+        if "date" in columns:
+            await cursor.execute("BEGIN IMMEDIATE")
+            await cursor.execute("""
+                INSERT OR IGNORE INTO divination_types (name)
+                SELECT DISTINCT divination_type FROM divinations
+            """)
+            await cursor.execute("""
+                CREATE TABLE divinations_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    created_at INTEGER NOT NULL,
+                    type_id INTEGER NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES subscribers (user_id),
+                    FOREIGN KEY (type_id) REFERENCES divination_types (id)
+                )
+            """)
+            await cursor.execute("""
+                INSERT INTO divinations_new (id, user_id, created_at, type_id)
+                SELECT d.id, d.user_id, CAST(strftime('%s', d.date, 'utc') AS INTEGER), t.id
+                FROM divinations d JOIN divination_types t ON t.name = d.divination_type
+                ORDER BY d.id
+            """)
+            await cursor.execute("DROP TABLE divinations")
+            await cursor.execute("ALTER TABLE divinations_new RENAME TO divinations")
+            await conn.commit()
+            logger.info("divinations переведены на created_at и type_id")
+    except Exception as e:
+        error_message = f"Ошибка в migrate_compact_columns: {e}"
+        logger.error(error_message)
+        error_digest.report(error_message)
+    finally:
+        if conn is not None:
+            await conn.close()
+
+
+@timed(DB_QUERY_SECONDS)
 async def save_subscriber(user_id: int):
     """Сохраняет подписчика в SQLite (или пропускает, если он уже есть)."""
     try:
@@ -131,20 +340,23 @@ async def save_subscriber(user_id: int):
 
         if not exist:
             # Добавляем нового пользователя
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            first_seen = int(time.time())
             public_id = f"RUNES-{secrets.token_hex(3).upper()}"
             await cursor.execute(
                 "INSERT INTO subscribers (user_id, first_seen, public_id) VALUES (?, ?, ?)",
-                (user_id, timestamp, public_id)
+                (user_id, first_seen, public_id)
             )
+            await _bump_daily_stats(cursor, local_day(first_seen), new_subscribers=1)
+            await _bump_total(cursor, 'subscribers', 1)
             await conn.commit()
         await conn.close()
     except Exception as e:
         error_message = f"Ошибка в save_subscriber: {e}"
         logger.error(error_message)
-        send_error_to_admin(error_message)
+        error_digest.report(error_message)
 
 
+@timed(DB_QUERY_SECONDS)
 async def get_subscribers():
     """Получает уникальные ID из SQLite, за исключением админа"""
     try:
@@ -168,8 +380,39 @@ async def get_subscribers():
         return []
 
 
-async def save_divination(user_id: int, divination_type: str):
-    """Сохраняет информацию о гадании в базу данных."""
+@timed(DB_QUERY_SECONDS)
+async def get_total_subscribers() -> int | None:
+    """Всего подписчиков — накопительный итог из stats_totals, без подсчёта строк subscribers."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+        await cursor.execute("SELECT value FROM stats_totals WHERE name = 'subscribers'")
+        (total,) = await cursor.fetchone()
+        await conn.close()
+        return total
+    except Exception as e:
+        logger.error(f"Ошибка в get_total_subscribers: {e}")
+        return None
+
+
+async def _divination_type_id(cursor, divination_type: str) -> int:
+    """Код вида гадания; неизвестный вид добавляется в divination_types."""
+    type_id = _divination_type_ids.get(divination_type)
+    if type_id is None:
+        await cursor.execute("INSERT OR IGNORE INTO divination_types (name) VALUES (?)", (divination_type,))
+        await cursor.execute("SELECT id FROM divination_types WHERE name = ?", (divination_type,))
+        (type_id,) = await cursor.fetchone()
+        _divination_type_ids[divination_type] = type_id
+    return type_id
+
+
+@timed(DB_QUERY_SECONDS)
+async def save_divination(user_id: int, divination_type: str, history: tuple | None = None):
+    """
+    Сохраняет информацию о гадании в базу данных.
+    history: (spread, question, answer) в виде, подготовленном utils.history, —
+    записывается в divination_history с тем же id.
+    """
     try:
         conn = await aiosqlite.connect(SQLITE_DB)
         cursor = await conn.cursor()
@@ -180,21 +423,28 @@ async def save_divination(user_id: int, divination_type: str):
             await save_subscriber(user_id)
         
         # Добавляем запись о гадании
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        created_at = int(time.time())
         await cursor.execute(
-            "INSERT INTO divinations (user_id, date, divination_type) VALUES (?, ?, ?)",
-            (user_id, timestamp, divination_type)
+            "INSERT INTO divinations (user_id, created_at, type_id) VALUES (?, ?, ?)",
+            (user_id, created_at, await _divination_type_id(cursor, divination_type))
         )
+        if history is not None:
+            await cursor.execute(
+                "INSERT INTO divination_history (id, user_id, spread, question, answer) VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid, user_id, *history)
+            )
+        await _record_divination_stats(cursor, local_day(created_at), user_id, divination_type)
 
         await conn.commit()
     except Exception as e:
         error_message = f"Ошибка при сохранении гадания: {e}"
         logger.error(error_message)
-        send_error_to_admin(error_message)
+        error_digest.report(error_message)
     finally:
         await conn.close()
 
 
+@timed(DB_QUERY_SECONDS)
 async def top_up_limits(public_id: str, amount: int) -> tuple[bool, int]:
     """
     Пополняет лимиты пользователя по public_id.
@@ -236,6 +486,7 @@ async def top_up_limits(public_id: str, amount: int) -> tuple[bool, int]:
         await conn.close()
 
 
+@timed(DB_QUERY_SECONDS)
 async def get_user_limits(public_id: str) -> tuple[bool, int, int]:
     """
     Возвращает (success, limits, user_id) для пользователя по public_id.
@@ -264,6 +515,7 @@ async def get_user_limits(public_id: str) -> tuple[bool, int, int]:
         return (False, 0, None)
 
 
+@timed(DB_QUERY_SECONDS)
 async def get_user_info_by_user_id(user_id: int) -> tuple[bool, str, int]:
     """
     Возвращает (success, public_id, limits) для пользователя по его Telegram ID.
@@ -291,6 +543,7 @@ async def get_user_info_by_user_id(user_id: int) -> tuple[bool, str, int]:
         return (False, "", 0)
 
 
+@timed(DB_QUERY_SECONDS)
 async def deduct_limits(user_id: int, amount: int) -> bool:
     """
     Списывает amount лимитов у пользователя.
@@ -300,26 +553,688 @@ async def deduct_limits(user_id: int, amount: int) -> bool:
         conn = await aiosqlite.connect(SQLITE_DB)
         cursor = await conn.cursor()
 
-        # Проверяем текущее количество
-        await cursor.execute("SELECT limits FROM subscribers WHERE user_id = ?", (user_id,))
+        # Проверка и списание одним запросом: параллельные списания не уводят лимиты в минус
+        await cursor.execute(
+            "UPDATE subscribers SET limits = limits - ? WHERE user_id = ? AND limits >= ?",
+            (amount, user_id, amount)
+        )
+        deducted = cursor.rowcount > 0
+        await conn.commit()
+        await conn.close()
+        return deducted
+    except Exception as e:
+        logger.error(f"Ошибка в deduct_limits: {e}")
+        return False
+
+
+@timed(DB_QUERY_SECONDS)
+async def reset_daily_limits(limit: int) -> bool:
+    """Поднимает лимиты всех пользователей до limit, если у них меньше."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute("UPDATE subscribers SET limits = ? WHERE limits < ?", (limit, limit))
+        await conn.commit()
+        await conn.close()
+        return True
+    except Exception as e:
+        error_message = f"Ошибка в reset_daily_limits: {e}"
+        logger.error(error_message)
+        error_digest.report(error_message)
+        return False
+
+
+@timed(DB_QUERY_SECONDS)
+async def load_user_state(user_id: int) -> tuple | None:
+    """
+    Возвращает сохранённое состояние пользователя
+    (mode, prompt_type, spread, admin_state, flags, extra) или None.
+    """
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute(
+            "SELECT mode, prompt_type, spread, admin_state, flags, extra FROM user_state WHERE user_id = ?",
+            (user_id,)
+        )
         row = await cursor.fetchone()
-        if not row:
-            await conn.close()
-            return False
-        
-        current_limits = row[0]
-        if current_limits < amount:
-            await conn.close()
-            return False
-        
-        # Списываем
+        await conn.close()
+        return row
+    except Exception as e:
+        logger.error(f"Ошибка в load_user_state: {e}")
+        return None
+
+
+@timed(DB_QUERY_SECONDS)
+async def save_user_states(rows: list[tuple], deleted_ids: list[int]) -> bool:
+    """
+    Записывает пачку состояний одной транзакцией.
+    rows: (user_id, mode, prompt_type, spread, admin_state, flags, extra)
+    deleted_ids: пользователи, чьё состояние нужно удалить
+    """
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        if rows:
+            await cursor.executemany(
+                """
+                INSERT OR REPLACE INTO user_state
+                    (user_id, mode, prompt_type, spread, admin_state, flags, extra)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+        if deleted_ids:
+            await cursor.executemany(
+                "DELETE FROM user_state WHERE user_id = ?",
+                [(user_id,) for user_id in deleted_ids]
+            )
+
+        await conn.commit()
+        await conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка в save_user_states: {e}")
+        return False
+
+
+@timed(DB_QUERY_SECONDS)
+async def add_limits(user_id: int, amount: int) -> bool:
+    """Начисляет amount лимитов пользователю по Telegram ID (например, возврат за отменённое гадание)."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
         await cursor.execute(
-            "UPDATE subscribers SET limits = limits - ? WHERE user_id = ?",
+            "UPDATE subscribers SET limits = limits + ? WHERE user_id = ?",
             (amount, user_id)
         )
+        updated = cursor.rowcount > 0
+        await conn.commit()
+        await conn.close()
+        return updated
+    except Exception as e:
+        logger.error(f"Ошибка в add_limits: {e}")
+        return False
+
+
+@timed(DB_QUERY_SECONDS)
+async def add_pending_payment(payment_id: str, user_id: int, public_id: str, amount: float,
+                              chat_id: int, created_at: float, next_check_at: float) -> bool:
+    """Ставит платёж в очередь проверки статуса."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute(
+            """
+            INSERT OR IGNORE INTO pending_payments
+                (payment_id, user_id, public_id, amount, chat_id, created_at, next_check_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (payment_id, user_id, public_id, amount, chat_id, created_at, next_check_at)
+        )
         await conn.commit()
         await conn.close()
         return True
     except Exception as e:
-        logger.error(f"Ошибка в deduct_limits: {e}")
-        return False
\ No newline at end of file
+        logger.error(f"Ошибка в add_pending_payment: {e}")
+        return False
+
+
+@timed(DB_QUERY_SECONDS)
+async def get_due_payments(now: float, limit: int) -> list[dict]:
+    """Возвращает платежи, которые пора проверить (не больше limit)."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        conn.row_factory = aiosqlite.Row
+        cursor = await conn.cursor()
+
+        await cursor.execute(
+            """
+            SELECT payment_id, user_id, public_id, amount, chat_id, created_at, attempts
+            FROM pending_payments
+            WHERE next_check_at <= ?
+            ORDER BY next_check_at
+            LIMIT ?
+            """,
+            (now, limit)
+        )
+        rows = [dict(row) for row in await cursor.fetchall()]
+        await conn.close()
+        return rows
+    except Exception as e:
+        logger.error(f"Ошибка в get_due_payments: {e}")
+        return []
+
+
+@timed(DB_QUERY_SECONDS)
+async def get_next_payment_check_at() -> float | None:
+    """Время ближайшей запланированной проверки или None, если очередь пуста."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute("SELECT MIN(next_check_at) FROM pending_payments")
+        (next_check_at,) = await cursor.fetchone()
+        await conn.close()
+        return next_check_at
+    except Exception as e:
+        logger.error(f"Ошибка в get_next_payment_check_at: {e}")
+        return None
+
+
+@timed(DB_QUERY_SECONDS)
+async def update_pending_payments(rescheduled: list[tuple], finished_ids: list[str]) -> bool:
+    """
+    Сохраняет результаты пачки проверок одной транзакцией.
+    rescheduled: (next_check_at, attempts, payment_id) для платежей, которые ещё ждут
+    finished_ids: платежи, проверка которых закончена
+    """
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        if rescheduled:
+            await cursor.executemany(
+                "UPDATE pending_payments SET next_check_at = ?, attempts = ? WHERE payment_id = ?",
+                rescheduled
+            )
+        if finished_ids:
+            await cursor.executemany(
+                "DELETE FROM pending_payments WHERE payment_id = ?",
+                [(payment_id,) for payment_id in finished_ids]
+            )
+
+        await conn.commit()
+        await conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка в update_pending_payments: {e}")
+        return False
+
+
+@timed(DB_QUERY_SECONDS)
+async def get_pending_payment(payment_id: str) -> dict | None:
+    """Возвращает ожидающий платёж по его ID или None."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        conn.row_factory = aiosqlite.Row
+        cursor = await conn.cursor()
+
+        await cursor.execute(
+            "SELECT payment_id, user_id, public_id, amount, chat_id FROM pending_payments WHERE payment_id = ?",
+            (payment_id,)
+        )
+        row = await cursor.fetchone()
+        await conn.close()
+        return dict(row) if row else None
+    except Exception as e:
+        logger.error(f"Ошибка в get_pending_payment: {e}")
+        return None
+
+
+@timed(DB_QUERY_SECONDS)
+async def credit_payment(payment_id: str, user_id: int, amount: int, credited_at: float) -> tuple[bool, bool]:
+    """
+    Зачисляет платёж ровно один раз.
+    В одной транзакции записывает платёж в payments_ledger, начисляет лимиты
+    и убирает платёж из очереди проверки. Повторный вызов с тем же payment_id ничего не меняет.
+    Возвращает (success, credited):
+    - success: False при ошибке
+    - credited: True, если лимиты начислены этим вызовом, False — если платёж уже был зачислен
+    """
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute("BEGIN IMMEDIATE")
+        await cursor.execute(
+            "INSERT OR IGNORE INTO payments_ledger (payment_id, user_id, amount, credited_at) VALUES (?, ?, ?, ?)",
+            (payment_id, user_id, amount, credited_at)
+        )
+        if cursor.rowcount == 0:
+            await conn.rollback()
+            await cursor.execute("DELETE FROM pending_payments WHERE payment_id = ?", (payment_id,))
+            await conn.commit()
+            await conn.close()
+            return (True, False)
+
+        await cursor.execute(
+            "UPDATE subscribers SET limits = limits + ? WHERE user_id = ?",
+            (amount, user_id)
+        )
+        if cursor.rowcount == 0:
+            await conn.rollback()
+            await conn.close()
+            logger.error(f"credit_payment: пользователь {user_id} не найден (платёж {payment_id})")
+            return (False, False)
+
+        await _record_payment_stats(cursor, local_day(credited_at), user_id, amount)
+        await cursor.execute("DELETE FROM pending_payments WHERE payment_id = ?", (payment_id,))
+        await conn.commit()
+        await conn.close()
+        return (True, True)
+    except Exception as e:
+        logger.error(f"Ошибка в credit_payment: {e}")
+        return (False, False)
+
+
+@timed(DB_QUERY_SECONDS)
+async def bulk_top_up_limits(entries: list[tuple], chunk_size: int) -> tuple[bool, list[tuple], list[str]]:
+    """
+    Пополняет лимиты многих пользователей по public_id.
+    entries: (public_id, amount), public_id уже приведены к верхнему регистру и не повторяются.
+    Каждая пачка из chunk_size строк применяется одной транзакцией через временную таблицу,
+    поэтому поиск идёт по индексу public_id, а не по LOWER() для каждой строки.
+    Возвращает (success, credited, not_found), где:
+    - credited: (user_id, public_id, amount) для пополненных пользователей
+    - not_found: public_id, которых нет в базе
+    При ошибке success = False, а credited содержит уже применённые пачки.
+    """
+    credited = []
+    not_found = []
+    conn = None
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS bulk_top_up (public_id TEXT PRIMARY KEY, amount INTEGER NOT NULL)"
+        )
+
+        for start in range(0, len(entries), chunk_size):
+            chunk = entries[start:start + chunk_size]
+
+            await cursor.execute("BEGIN IMMEDIATE")
+            await cursor.execute("DELETE FROM bulk_top_up")
+            await cursor.executemany("INSERT INTO bulk_top_up (public_id, amount) VALUES (?, ?)", chunk)
+            await cursor.execute("""
+                UPDATE subscribers
+                SET limits = limits + (SELECT amount FROM bulk_top_up WHERE bulk_top_up.public_id = subscribers.public_id)
+                WHERE public_id IN (SELECT public_id FROM bulk_top_up)
+            """)
+            await cursor.execute("""
+                SELECT s.user_id, s.public_id, b.amount
+                FROM bulk_top_up b JOIN subscribers s ON s.public_id = b.public_id
+            """)
+            chunk_credited = await cursor.fetchall()
+            await cursor.execute("""
+                SELECT public_id FROM bulk_top_up
+                WHERE public_id NOT IN (SELECT public_id FROM subscribers WHERE public_id IS NOT NULL)
+            """)
+            chunk_not_found = [row[0] for row in await cursor.fetchall()]
+            await conn.commit()
+
+            credited.extend(chunk_credited)
+            not_found.extend(chunk_not_found)
+
+        return (True, credited, not_found)
+    except Exception as e:
+        logger.error(f"Ошибка в bulk_top_up_limits: {e}")
+        return (False, credited, not_found)
+    finally:
+        if conn is not None:
+            await conn.close()
+
+
+
+@timed(DB_QUERY_SECONDS)
+async def get_history_page(user_id: int, limit: int, before_id: int | None = None,
+                           after_id: int | None = None) -> tuple[list[tuple], bool, bool] | None:
+    """
+    Страница истории гаданий пользователя, от новых к старым (keyset-пагинация по индексу (user_id, id)).
+    before_id — следующая страница (гадания старше), after_id — предыдущая (новее); без них — первая.
+    Возвращает (rows, has_newer, has_older), где rows: (id, created_at, divination_type, question).
+    Ответы не читаются: страница стоит O(limit) независимо от длины истории.
+    """
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        select = """
+            SELECT h.id, d.created_at, t.name, h.question
+            FROM divination_history h
+            JOIN divinations d ON d.id = h.id
+            JOIN divination_types t ON t.id = d.type_id
+        """
+        rows = None
+        if after_id is not None:
+            await cursor.execute(
+                select + "WHERE h.user_id = ? AND h.id > ? ORDER BY h.id LIMIT ?",
+                (user_id, after_id, limit)
+            )
+            rows = (await cursor.fetchall())[::-1]
+            if len(rows) < limit:
+                # Дошли до самых новых: показываем первую страницу целиком
+                rows = None
+                before_id = None
+
+        if rows is None:
+            await cursor.execute(
+                select + "WHERE h.user_id = ? AND h.id < ? ORDER BY h.id DESC LIMIT ?",
+                (user_id, before_id if before_id is not None else 2 ** 63 - 1, limit)
+            )
+            rows = await cursor.fetchall()
+
+        # Есть ли гадания новее и старше показанных — одна проверка по индексу в каждую сторону
+        has_newer = has_older = False
+        if rows:
+            await cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM divination_history WHERE user_id = ? AND id > ?), "
+                "EXISTS (SELECT 1 FROM divination_history WHERE user_id = ? AND id < ?)",
+                (user_id, rows[0][0], user_id, rows[-1][0])
+            )
+            has_newer, has_older = (bool(value) for value in await cursor.fetchone())
+
+        await conn.close()
+        return (rows, has_newer, has_older)
+    except Exception as e:
+        logger.error(f"Ошибка в get_history_page: {e}")
+        return None
+
+
+@timed(DB_QUERY_SECONDS)
+async def get_history_entry(user_id: int, divination_id: int) -> tuple | None:
+    """Одно гадание пользователя: (id, created_at, divination_type, spread, question, answer) или None."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute(
+            """
+            SELECT h.id, d.created_at, t.name, h.spread, h.question, h.answer
+            FROM divination_history h
+            JOIN divinations d ON d.id = h.id
+            JOIN divination_types t ON t.id = d.type_id
+            WHERE h.id = ? AND h.user_id = ?
+            """,
+            (divination_id, user_id)
+        )
+        row = await cursor.fetchone()
+        await conn.close()
+        return row
+    except Exception as e:
+        logger.error(f"Ошибка в get_history_entry: {e}")
+        return None
+
+
+@timed(DB_QUERY_SECONDS)
+async def export_subscribers() -> list[tuple] | None:
+    """Все подписчики для выгрузки: (user_id, first_seen, limits, public_id)."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute("SELECT user_id, first_seen, limits, public_id FROM subscribers ORDER BY user_id")
+        rows = await cursor.fetchall()
+        await conn.close()
+        return rows
+    except Exception as e:
+        logger.error(f"Ошибка в export_subscribers: {e}")
+        return None
+
+
+@timed(DB_QUERY_SECONDS)
+async def export_divinations() -> list[tuple] | None:
+    """Все гадания для выгрузки: (id, user_id, created_at, divination_type)."""
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+
+        await cursor.execute("""
+            SELECT d.id, d.user_id, d.created_at, t.name
+            FROM divinations d JOIN divination_types t ON t.id = d.type_id
+            ORDER BY d.id
+        """)
+        rows = await cursor.fetchall()
+        await conn.close()
+        return rows
+    except Exception as e:
+        logger.error(f"Ошибка в export_divinations: {e}")
+        return None
+
+
+# Дневная статистика.
+# Счётчики в stats_daily и stats_divinations_daily (и итоги в stats_totals) обновляются
+# в тех же транзакциях, что и сами гадания, подписчики и платежи, поэтому статистика
+# читается за O(дней).
+
+# Для какого дня уже удалены устаревшие строки stats_daily_users
+_daily_users_pruned_for = None
+
+
+def local_day(timestamp: float) -> str:
+    """День (по местному времени) для времени в секундах."""
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+
+
+async def _bump_daily_stats(cursor, day: str, **increments) -> None:
+    """Прибавляет increments к счётчикам stats_daily за день."""
+    columns = ", ".join(increments)
+    placeholders = ", ".join("?" for _ in increments)
+    updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in increments)
+    await cursor.execute(
+        f"INSERT INTO stats_daily (day, {columns}) VALUES (?, {placeholders}) "
+        f"ON CONFLICT(day) DO UPDATE SET {updates}",
+        (day, *increments.values())
+    )
+
+
+async def _bump_total(cursor, name: str, amount: int) -> None:
+    """Прибавляет amount к итогу name в stats_totals (строка создаётся в init_db)."""
+    await cursor.execute("UPDATE stats_totals SET value = value + ? WHERE name = ?", (amount, name))
+
+
+async def _mark_daily_user(cursor, day: str, kind: str, user_id: int) -> bool:
+    """Отмечает пользователя за день. True, если в этот день он отмечен впервые."""
+    await cursor.execute(
+        "INSERT OR IGNORE INTO stats_daily_users (day, kind, user_id) VALUES (?, ?, ?)",
+        (day, kind, user_id)
+    )
+    return cursor.rowcount == 1
+
+
+async def _prune_daily_users(cursor, day: str) -> None:
+    """
+    Удаляет отметки пользователей старше вчерашнего дня: новые события за те дни
+    уже не приходят, а уникальные за день уже посчитаны в stats_daily.
+    """
+    yesterday = (datetime.strptime(day, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+    await cursor.execute("DELETE FROM stats_daily_users WHERE day < ?", (yesterday,))
+
+
+async def _record_divination_stats(cursor, day: str, user_id: int, divination_type: str) -> None:
+    global _daily_users_pruned_for
+    if _daily_users_pruned_for != day:
+        await _prune_daily_users(cursor, day)
+        _daily_users_pruned_for = day
+
+    first_today = await _mark_daily_user(cursor, day, 'active', user_id)
+    await _bump_daily_stats(cursor, day, divinations=1, active_users=int(first_today))
+    await cursor.execute(
+        """
+        INSERT INTO stats_divinations_daily (day, divination_type, count) VALUES (?, ?, 1)
+        ON CONFLICT(day, divination_type) DO UPDATE SET count = count + 1
+        """,
+        (day, divination_type)
+    )
+
+
+async def _record_payment_stats(cursor, day: str, user_id: int, amount: int) -> None:
+    first_today = await _mark_daily_user(cursor, day, 'paying', user_id)
+    await _bump_daily_stats(cursor, day, payments=1, credits_purchased=amount, paying_users=int(first_today))
+
+
+@timed(DB_QUERY_SECONDS)
+async def get_daily_stats(days: int) -> dict | None:
+    """
+    Статистика за последние days дней (включая сегодня). Читает только таблицы статистики.
+    Возвращает словарь:
+    - days: строки stats_daily по возрастанию дня (дни без событий пропущены)
+    - by_type: divination_type -> количество гаданий за период
+    - total_subscribers: всего подписчиков
+    """
+    try:
+        since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+        conn = await aiosqlite.connect(SQLITE_DB)
+        conn.row_factory = aiosqlite.Row
+        cursor = await conn.cursor()
+
+        await cursor.execute("SELECT * FROM stats_daily WHERE day >= ? ORDER BY day", (since,))
+        daily = [dict(row) for row in await cursor.fetchall()]
+
+        await cursor.execute(
+            """
+            SELECT divination_type, SUM(count) FROM stats_divinations_daily
+            WHERE day >= ?
+            GROUP BY divination_type
+            ORDER BY SUM(count) DESC
+            """,
+            (since,)
+        )
+        by_type = {row[0]: row[1] for row in await cursor.fetchall()}
+
+        # Не сумма stats_daily: статистика собирается с момента её появления, а подписчики были и раньше
+        await cursor.execute("SELECT value FROM stats_totals WHERE name = 'subscribers'")
+        (total_subscribers,) = await cursor.fetchone()
+        await conn.close()
+
+        return {'days': daily, 'by_type': by_type, 'total_subscribers': total_subscribers}
+    except Exception as e:
+        logger.error(f"Ошибка в get_daily_stats: {e}")
+        return None
+
+
+@timed(DB_QUERY_SECONDS)
+async def backfill_stats(chunk_size: int) -> dict | None:
+    """
+    Заново заполняет статистику по истории гаданий, подписчиков и платежей.
+    Бота можно не останавливать: в первой транзакции запоминаются последние id гаданий
+    и платежей и очищается статистика, всё более новое учитывается обычным путём.
+    Старые записи пересчитываются пачками по chunk_size id, каждая пачка — короткая
+    транзакция, поэтому запись новых данных не ждёт весь пересчёт.
+    Уникальные пользователи за день собираются во временной таблице и записываются в конце.
+    Возвращает {'days', 'divinations', 'payments'} или None при ошибке.
+    """
+    conn = None
+    try:
+        conn = await aiosqlite.connect(SQLITE_DB)
+        cursor = await conn.cursor()
+        today = datetime.now().strftime("%Y-%m-%d")
+
+        await cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS backfill_users (
+                day TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (day, kind, user_id)
+            ) WITHOUT ROWID
+        """)
+
+        await cursor.execute("BEGIN IMMEDIATE")
+        await cursor.execute("DELETE FROM backfill_users")
+        await cursor.execute("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM divinations")
+        last_divination_id, divinations = await cursor.fetchone()
+        await cursor.execute("SELECT COALESCE(MAX(rowid), 0), COUNT(*) FROM payments_ledger")
+        last_payment_rowid, payments = await cursor.fetchone()
+        for table in ("stats_daily", "stats_divinations_daily", "stats_daily_users"):
+            await cursor.execute(f"DELETE FROM {table}")
+        await cursor.execute("""
+            INSERT INTO stats_daily (day, new_subscribers)
+            SELECT date(first_seen, 'unixepoch', 'localtime'), COUNT(*) FROM subscribers GROUP BY 1
+        """)
+        await cursor.execute(
+            "INSERT OR REPLACE INTO stats_totals (name, value) SELECT 'subscribers', COUNT(*) FROM subscribers"
+        )
+        await conn.commit()
+
+        # Гадания
+        for start in range(0, last_divination_id, chunk_size):
+            bounds = (start, min(start + chunk_size, last_divination_id))
+            await cursor.execute("BEGIN IMMEDIATE")
+            await cursor.execute("""
+                INSERT OR IGNORE INTO backfill_users (day, kind, user_id)
+                SELECT DISTINCT date(created_at, 'unixepoch', 'localtime'), 'active', user_id FROM divinations
+                WHERE id > ? AND id <= ?
+            """, bounds)
+            await cursor.execute("""
+                INSERT INTO stats_daily (day, divinations)
+                SELECT date(created_at, 'unixepoch', 'localtime'), COUNT(*) FROM divinations
+                WHERE id > ? AND id <= ?
+                GROUP BY 1
+                ON CONFLICT(day) DO UPDATE SET divinations = divinations + excluded.divinations
+            """, bounds)
+            await cursor.execute("""
+                INSERT INTO stats_divinations_daily (day, divination_type, count)
+                SELECT date(d.created_at, 'unixepoch', 'localtime'), t.name, COUNT(*)
+                FROM divinations d JOIN divination_types t ON t.id = d.type_id
+                WHERE d.id > ? AND d.id <= ?
+                GROUP BY 1, 2
+                ON CONFLICT(day, divination_type) DO UPDATE SET count = count + excluded.count
+            """, bounds)
+            await conn.commit()
+
+        # Зачисленные платежи
+        for start in range(0, last_payment_rowid, chunk_size):
+            bounds = (start, min(start + chunk_size, last_payment_rowid))
+            await cursor.execute("BEGIN IMMEDIATE")
+            await cursor.execute("""
+                INSERT OR IGNORE INTO backfill_users (day, kind, user_id)
+                SELECT DISTINCT date(credited_at, 'unixepoch', 'localtime'), 'paying', user_id
+                FROM payments_ledger
+                WHERE rowid > ? AND rowid <= ?
+            """, bounds)
+            await cursor.execute("""
+                INSERT INTO stats_daily (day, payments, credits_purchased)
+                SELECT date(credited_at, 'unixepoch', 'localtime'), COUNT(*), SUM(amount)
+                FROM payments_ledger
+                WHERE rowid > ? AND rowid <= ?
+                GROUP BY 1
+                ON CONFLICT(day) DO UPDATE SET
+                    payments = payments + excluded.payments,
+                    credits_purchased = credits_purchased + excluded.credits_purchased
+            """, bounds)
+            await conn.commit()
+
+        # Уникальные пользователи. В прошлые дни новых событий нет — записываем готовое число.
+        # За сегодня часть пользователей уже отмечена обычным путём — добавляем только остальных.
+        await cursor.execute("BEGIN IMMEDIATE")
+        for kind, column in (('active', 'active_users'), ('paying', 'paying_users')):
+            await cursor.execute(f"""
+                INSERT INTO stats_daily (day, {column})
+                SELECT day, COUNT(*) FROM backfill_users
+                WHERE kind = ? AND day < ?
+                GROUP BY day
+                ON CONFLICT(day) DO UPDATE SET {column} = excluded.{column}
+            """, (kind, today))
+            await cursor.execute(f"""
+                INSERT INTO stats_daily (day, {column})
+                SELECT day, COUNT(*) FROM backfill_users AS b
+                WHERE kind = ? AND day >= ? AND NOT EXISTS (
+                    SELECT 1 FROM stats_daily_users AS u
+                    WHERE u.day = b.day AND u.kind = b.kind AND u.user_id = b.user_id
+                )
+                GROUP BY day
+                ON CONFLICT(day) DO UPDATE SET {column} = {column} + excluded.{column}
+            """, (kind, today))
+        await cursor.execute("""
+            INSERT OR IGNORE INTO stats_daily_users (day, kind, user_id)
+            SELECT day, kind, user_id FROM backfill_users WHERE day >= ?
+        """, (today,))
+        await _prune_daily_users(cursor, today)
+        await conn.commit()
+
+        await cursor.execute("SELECT COUNT(*) FROM stats_daily")
+        (days,) = await cursor.fetchone()
+        return {'days': days, 'divinations': divinations, 'payments': payments}
+    except Exception as e:
+        logger.error(f"Ошибка в backfill_stats: {e}")
+        return None
+    finally:
+        if conn is not None:
+            await conn.close()
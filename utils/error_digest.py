@@ -0,0 +1,189 @@
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import (
+    ADMIN_ID,
+    ERROR_DIGEST_INTERVAL,
+    ERROR_DEDUP_WINDOW,
+    ERROR_URGENT_PER_MINUTE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Telegram не принимает сообщения длиннее 4096 символов
+MAX_MESSAGE_LENGTH = 4000
+# Сколько видов ошибок показывать в одной сводке
+MAX_DIGEST_ENTRIES = 20
+# Сколько срочных сообщений может ждать отправки; остальные попадут в сводку
+URGENT_QUEUE_SIZE = 20
+
+_QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"")
+_NUMBERS = re.compile(r"\d+")
+
+
+def fingerprint(error_message: str) -> str:
+    """
+    Отпечаток ошибки: сообщение без чисел и строк в кавычках.
+    «Ошибка при отправке пользователю 123» и «... 456» — одна и та же ошибка.
+    """
+    normalized = _NUMBERS.sub('#', _QUOTED.sub('…', error_message))[:300]
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class _ErrorEntry:
+    __slots__ = ('sample', 'count', 'pending', 'first_seen', 'last_seen')
+
+    def __init__(self, sample: str, now: float):
+        self.sample = sample
+        self.count = 0
+        self.pending = 0
+        self.first_seen = now
+        self.last_seen = now
+
+
+class ErrorDigest:
+    """
+    Сводка ошибок для администратора.
+
+    report() только учитывает ошибку в памяти и сразу возвращает управление,
+    поэтому шквал ошибок не тормозит обработку апдейтов.
+    Новый вид ошибки (по отпечатку) отправляется сразу, но не чаще urgent_per_minute сообщений в минуту.
+    Повторы копятся и раз в interval секунд уходят одной сводкой с числом повторов
+    и временем первого и последнего появления. Вид ошибки, не повторявшийся window секунд, забывается.
+    """
+
+    def __init__(self, interval: float = ERROR_DIGEST_INTERVAL, window: float = ERROR_DEDUP_WINDOW,
+                 urgent_per_minute: int = ERROR_URGENT_PER_MINUTE):
+        self.interval = interval
+        self.window = window
+        self.urgent_per_minute = urgent_per_minute
+        self.bot = None
+        self._entries: Dict[str, _ErrorEntry] = {}
+        self._urgent: Optional[asyncio.Queue] = None
+        self._urgent_sent: list = []
+        self._task: Optional[asyncio.Task] = None
+        self.dropped_sends = 0
+
+    def start(self, bot) -> None:
+        """Запускает фоновую отправку (при старте бота)."""
+        if self._task is None or self._task.done():
+            self._urgent = asyncio.Queue(maxsize=URGENT_QUEUE_SIZE)
+            self._task = asyncio.create_task(self._run())
+        self.bot = bot
+
+    async def stop(self) -> None:
+        """Останавливает отправку и отправляет накопленную сводку."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.flush()
+
+    def report(self, error_message: str, bot=None) -> None:
+        """Учитывает ошибку. Не ждёт отправки и не бросает исключений."""
+        try:
+            if self.bot is None and bot is not None:
+                self.start(bot)
+
+            now = time.time()
+            key = fingerprint(error_message)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _ErrorEntry(error_message, now)
+                if self._take_urgent_slot(now) and self._enqueue_urgent(error_message):
+                    entry.count += 1
+                    return
+
+            entry.count += 1
+            entry.pending += 1
+            entry.last_seen = now
+            entry.sample = error_message
+        except Exception as e:
+            logger.warning(f"Не удалось учесть ошибку для сводки: {e}")
+
+    def _take_urgent_slot(self, now: float) -> bool:
+        self._urgent_sent = [sent_at for sent_at in self._urgent_sent if now - sent_at < 60]
+        if len(self._urgent_sent) >= self.urgent_per_minute:
+            return False
+        self._urgent_sent.append(now)
+        return True
+
+    def _enqueue_urgent(self, error_message: str) -> bool:
+        if self._task is None:
+            return False
+        try:
+            self._urgent.put_nowait(error_message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _run(self) -> None:
+        next_digest = time.monotonic() + self.interval
+        while True:
+            try:
+                error_message = await asyncio.wait_for(
+                    self._urgent.get(), timeout=max(0.0, next_digest - time.monotonic())
+                )
+                await self._send(f"Ошибка: {error_message}")
+            except asyncio.TimeoutError:
+                await self.flush()
+                next_digest = time.monotonic() + self.interval
+
+    def build_digest(self) -> Optional[str]:
+        """Собирает текст сводки по накопленным повторам и сбрасывает их; None — если сводка пуста."""
+        now = time.time()
+        pending = sorted(
+            (entry for entry in self._entries.values() if entry.pending),
+            key=lambda entry: entry.pending,
+            reverse=True,
+        )
+
+        # Забываем ошибки, которые давно не повторялись
+        self._entries = {
+            key: entry for key, entry in self._entries.items()
+            if entry.pending or now - entry.last_seen < self.window
+        }
+
+        if not pending:
+            return None
+
+        lines = [f"Сводка ошибок ({sum(entry.pending for entry in pending)} шт.):", ""]
+        for entry in pending[:MAX_DIGEST_ENTRIES]:
+            first_seen = datetime.fromtimestamp(entry.first_seen).strftime('%d.%m %H:%M:%S')
+            last_seen = datetime.fromtimestamp(entry.last_seen).strftime('%d.%m %H:%M:%S')
+            lines.append(f"×{entry.pending} {entry.sample[:300]}")
+            lines.append(f"    впервые {first_seen}, последний раз {last_seen}, всего {entry.count}")
+        if len(pending) > MAX_DIGEST_ENTRIES:
+            lines.append(f"…и ещё видов ошибок: {len(pending) - MAX_DIGEST_ENTRIES}")
+
+        for entry in pending:
+            entry.pending = 0
+        return "\n".join(lines)[:MAX_MESSAGE_LENGTH]
+
+    async def flush(self) -> None:
+        """Отправляет сводку, если есть что отправлять."""
+        text = self.build_digest()
+        if text:
+            await self._send(text)
+
+    async def _send(self, text: str) -> None:
+        if self.bot is None:
+            self.dropped_sends += 1
+            return
+        try:
+            await self.bot.send_message(chat_id=ADMIN_ID, text=text[:MAX_MESSAGE_LENGTH])
+        except Exception as e:
+            # Не вызываем report(): ошибка отправки не должна порождать новые отправки
+            self.dropped_sends += 1
+            logger.warning(f"Не удалось отправить ошибку администратору: {e}")
+
+
+error_digest = ErrorDigest()
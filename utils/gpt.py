@@ -1,22 +1,69 @@
 import os
+import time
 import aiohttp
+from yarl import URL
 import logging
 from pathlib import Path
-from typing import Dict, Union, List
+from typing import Dict, Union, List, Optional
 from utils.logging import setup_logging, send_error_to_admin
-from config import YANDEX_API_KEY, YANDEX_FOLDER_ID
+from utils.assets import assets
+from utils.metrics import GPT_LATENCY, GPT_ERRORS
+from utils.tracing import span
+from config import YANDEX_API_KEY, YANDEX_FOLDER_ID, YANDEX_GPT_URL
 
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
 setup_logging()
 
+GPT_URL = YANDEX_GPT_URL
+# Корень сервиса для прогрева соединения
+GPT_HOST_URL = str(URL(GPT_URL).origin()) + "/"
+GPT_MODEL = "yandexgpt-lite"
+
+# Прогревать соединение не чаще, чем раз в столько секунд
+WARM_UP_INTERVAL = 10
+
+# Общая сессия: соединения с API переиспользуются между запросами
+_session: Optional[aiohttp.ClientSession] = None
+_last_warm_up = 0.0
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """Возвращает общую HTTP-сессию, создавая её при необходимости."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession()
+    return _session
+
+
+async def warm_up_gpt() -> None:
+    """Заранее открывает соединение с Yandex GPT API, чтобы запрос не ждал TLS-рукопожатия."""
+    global _last_warm_up
+    now = time.monotonic()
+    if now - _last_warm_up < WARM_UP_INTERVAL:
+        return
+    _last_warm_up = now
+
+    try:
+        async with _get_session().head(GPT_HOST_URL):
+            pass
+    except Exception as e:
+        logger.debug(f"Не удалось прогреть соединение с GPT: {e}")
+
+
+async def close_gpt_session() -> None:
+    """Закрывает общую HTTP-сессию (при остановке бота)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
 def load_prompt(prompt_type: str = 'one_rune') -> str:
-    """Загружает промпт из файла по указанному типу."""
+    """Возвращает промпт указанного типа из загруженных ресурсов."""
     try:
-        file_name = f'text/prompt_{prompt_type}.txt'
-        with open(file_name, 'r', encoding='utf-8') as file:
-            return file.read()
+        return assets.current.prompts[prompt_type]
     except Exception as e:
         error_message = f"Ошибка в load_prompt: {e}"
         logger.error(error_message)
@@ -73,14 +120,13 @@ async def ask_gpt(user_question: str, rune_data: dict, prompt_type: str = 'one_r
             )
 
         # Подготовка данных для запроса к Yandex GPT API
-        url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Api-Key {YANDEX_API_KEY}",
             "x-folder-id": YANDEX_FOLDER_ID,
         }
         data = {
-            "modelUri": f"gpt://{YANDEX_FOLDER_ID}/yandexgpt-lite",
+            "modelUri": f"gpt://{YANDEX_FOLDER_ID}/{GPT_MODEL}",
             "messages": [
                 {
                     "role": "system", 
@@ -93,14 +139,18 @@ async def ask_gpt(user_question: str, rune_data: dict, prompt_type: str = 'one_r
         }
         
         # Отправка асинхронного запроса
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, headers=headers, json=data) as response:
+        started = time.perf_counter()
+        try:
+            with span('ask_gpt', prompt_type=prompt_type, model=GPT_MODEL):
+                async with _get_session().post(GPT_URL, headers=headers, json=data) as response:
                     response.raise_for_status()
                     json_data = await response.json()
                     return json_data["result"]["alternatives"][0]["message"]["text"]
-            except Exception as e:
-                return "Произошла непредвиденная ошибка при обработке запроса"
+        except Exception as e:
+            GPT_ERRORS.inc(prompt_type, GPT_MODEL)
+            return "Произошла непредвиденная ошибка при обработке запроса"
+        finally:
+            GPT_LATENCY.observe(time.perf_counter() - started, prompt_type, GPT_MODEL)
     except Exception as e:
         error_message = f"Ошибка в ask_gpt: {e}"
         logger.error(error_message)
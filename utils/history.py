@@ -0,0 +1,37 @@
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from utils.runes import encode_spread
+
+# Первый байт сжатого текста — способ хранения
+TEXT_PLAIN = 0
+TEXT_DEFLATE = 1
+
+
+def pack_text(text: str) -> bytes:
+    """
+    Сжимает текст для divination_history: deflate без заголовка и контрольной суммы zlib.
+    Короткий текст, который сжатие не уменьшает, хранится как есть.
+    """
+    raw = text.encode('utf-8')
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    packed = compressor.compress(raw) + compressor.flush()
+    if len(packed) < len(raw):
+        return bytes((TEXT_DEFLATE,)) + packed
+    return bytes((TEXT_PLAIN,)) + raw
+
+
+def unpack_text(data: bytes) -> str:
+    """Восстанавливает текст, сжатый pack_text."""
+    if data[0] == TEXT_DEFLATE:
+        return zlib.decompress(data[1:], -15).decode('utf-8')
+    return data[1:].decode('utf-8')
+
+
+def encode_reading(question: str, runes: Optional[List[Dict[str, Optional[str]]]], answer: str) -> Tuple:
+    """Готовит гадание к записи: (spread, question, answer) для save_divination(history=...)."""
+    return (
+        encode_spread(runes) if runes else None,
+        pack_text(question),
+        pack_text(answer),
+    )
@@ -1,14 +1,116 @@
-import logging
-from logging.handlers import RotatingFileHandler
 import os
-from telegram import Bot
-from config import ADMIN_ID
+import json
+import queue
+import atexit
+import random
+import logging
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from telegram import Bot, Update
+from telegram.ext import ContextTypes
+
+from utils.error_digest import error_digest
+from config import LOG_FORMAT, LOG_LEVEL, LOG_SAMPLE_RATE
+
+# Поля текущего апдейта (user_id, mode, update_id), которые попадают в каждую запись лога
+log_context: ContextVar[dict] = ContextVar('log_context', default={})
+
+CONTEXT_FIELDS = ('user_id', 'mode', 'update_id')
+
+# Стандартные атрибуты LogRecord; остальные пришли из extra или ContextFilter
+_STANDARD_ATTRS = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime', 'sampled'}
+
+_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи поля текущего апдейта из log_context."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = log_context.get()
+        for field in CONTEXT_FIELDS:
+            setattr(record, field, context.get(field))
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Оставляет только долю rate частых записей — помеченных extra={'sampled': True}.
+    Помечаются записи уровня INFO и ниже, которые пишутся на каждый апдейт.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'sampled', False) or record.levelno >= logging.WARNING:
+            return True
+        record.sample_rate = self.rate
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна запись — одна строка JSON.
+    Кроме времени, уровня, логгера и сообщения в запись попадают поля апдейта
+    и всё, что передано через extra (например, duration_ms).
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and value is not None:
+                data[key] = value
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Кладёт запись в очередь, не форматируя её целиком.
+    Сообщение и трассировка собираются здесь, поскольку аргументы записи
+    могут измениться, пока её обрабатывает поток записи.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
 
 
 def setup_logging():
+    """
+    Настраивает логирование один раз на процесс; повторные вызовы ничего не делают.
+    Все записи уходят в очередь, а в файл и консоль их пишет отдельный поток (QueueListener),
+    поэтому цикл событий не ждёт диск и терминал.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("apscheduler").setLevel(logging.WARNING)
 
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
     file_handler = RotatingFileHandler(
         'bot_errors.log',
         maxBytes=1024*1024,
@@ -16,19 +118,44 @@ def setup_logging():
         encoding='utf-8'
     )
     file_handler.setLevel(logging.ERROR)
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            file_handler,
-            logging.StreamHandler()
-        ]
-    )
+    file_handler.setFormatter(formatter)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [queue_handler]
+
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+async def bind_log_context(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Запоминает user_id, режим и update_id апдейта для всех записей лога при его обработке.
+    Вызывается первым для каждого апдейта; задачи, созданные при обработке, наследуют эти поля.
+    """
+    if not isinstance(update, Update):
+        return
+    user = update.effective_user
+    user_data = context.user_data if user is not None else None
+    log_context.set({
+        'user_id': user.id if user is not None else None,
+        'mode': user_data.get('mode') if user_data else None,
+        'update_id': update.update_id,
+    })
 
 
 async def send_error_to_admin(bot: Bot, error_message: str):
-    await bot.send_message(
-        chat_id=ADMIN_ID,
-        text=f"Ошибка: {error_message}"
-    )
+    """
+    Сообщает об ошибке администратору через сводку ошибок (utils.error_digest).
+    Возвращается сразу: новые ошибки отправляются в фоне, повторы — периодической сводкой.
+    """
+    error_digest.report(error_message, bot)
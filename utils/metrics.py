@@ -0,0 +1,261 @@
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from utils.logging import setup_logging
+from utils.tracing import span
+from config import METRICS_LISTEN, METRICS_PORT, METRICS_PATH
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+PREFIX = "runes_bot_"
+
+# Границы корзин гистограмм (секунды)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+# Как часто измерять задержку цикла событий
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """Монотонно растущий счётчик. Значения меток передаются позиционно: inc('one_rune')."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Значение, которое может и расти, и уменьшаться."""
+
+    kind = 'gauge'
+
+    def set(self, value: float, *label_values) -> None:
+        self._values[label_values] = value
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами; observe() — поиск корзины и два сложения."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (последняя — +Inf), сумма, количество]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        entry = self._values.get(label_values)
+        if entry is None:
+            entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self) -> list:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Хранит метрики и отдаёт их в текстовом формате Prometheus.
+    Кроме обычных метрик можно зарегистрировать функцию stats() компонента:
+    её числовые значения читаются только в момент запроса метрик.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._stats: Dict[str, Callable[[], Dict]] = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def register_stats(self, component: str, stats: Callable[[], Dict]) -> None:
+        """Регистрирует stats() компонента: {'dropped': 3, 'by_mode': {'fate': 1}} -> runes_bot_<component>_dropped ..."""
+        self._stats[component] = stats
+
+    def _render_stats(self) -> list:
+        lines = []
+        for component, stats in self._stats.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logger.error(f"Ошибка чтения статистики {component}: {e}")
+                continue
+            for key, value in values.items():
+                name = f"{PREFIX}{component}_{key}"
+                if isinstance(value, dict):
+                    lines.append(f"# TYPE {name} gauge")
+                    lines += [f'{name}{{key="{_escape(k)}"}} {v}' for k, v in value.items()]
+                elif isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {value}")
+        return lines
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines += metric.render()
+        lines += self._render_stats()
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# Обработка апдейтов
+HANDLER_UPDATES = metrics.counter("handler_updates_total", "Апдейты по обработчикам", ("handler",))
+HANDLER_LATENCY = metrics.histogram("handler_seconds", "Время работы обработчика", ("handler",))
+UPDATES_DROPPED = metrics.counter(
+    "updates_dropped_total", "Апдейты, отброшенные из-за переполненной очереди пользователя", ("kind",)
+)
+DIVINATION_LATENCY = metrics.histogram(
+    "divination_seconds", "Время гадания от вопроса до ответа", ("mode", "result")
+)
+
+# GPT
+GPT_LATENCY = metrics.histogram("gpt_request_seconds", "Время запроса к GPT", ("prompt_type", "model"))
+GPT_ERRORS = metrics.counter("gpt_errors_total", "Ошибки запросов к GPT", ("prompt_type", "model"))
+
+# База данных
+DB_QUERY_SECONDS = metrics.histogram(
+    "db_query_seconds", "Время функций хранилища данных", ("function",), buckets=DB_BUCKETS
+)
+
+# Платежи
+PAYMENT_CHECKS = metrics.counter("payment_checks_total", "Проверки статуса платежей", ("status",))
+PAYMENTS_DUE = metrics.gauge("payments_due", "Платежей в последней пачке проверки")
+PAYMENTS_CREDITED = metrics.counter("payments_credited_total", "Зачисленные платежи")
+
+# Рассылка
+BROADCAST_PROGRESS = metrics.gauge("broadcast_messages", "Ход текущей рассылки", ("state",))
+
+# Кэши
+CACHE_REQUESTS = metrics.counter("cache_requests_total", "Обращения к кэшам", ("cache", "result"))
+
+# Цикл событий
+LOOP_LAG = metrics.histogram("event_loop_lag_seconds", "Опоздание пробуждения цикла событий")
+
+
+def timed(histogram: Histogram):
+    """
+    Декоратор: время выполнения корутины попадает в histogram с меткой — именем функции.
+    Внутри трассы вызов также записывается как span с этим именем.
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with span(name):
+                    return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    """HTTP-эндпоинт метрик и измерение задержки цикла событий. Не запускается, если порт не задан."""
+
+    def __init__(self, listen: str = METRICS_LISTEN, port: int = METRICS_PORT, path: str = METRICS_PATH):
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self._runner: Optional[web.AppRunner] = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(self.path, self.handle_metrics)
+        return app
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self) -> None:
+        if not self.port:
+            return
+
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        self._lag_task = asyncio.create_task(self._measure_loop_lag())
+        logger.info(f"Метрики доступны на {self.listen}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _measure_loop_lag(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            LOOP_LAG.observe(max(0.0, time.monotonic() - started - LOOP_LAG_INTERVAL))
+
+
+metrics_server = MetricsServer()
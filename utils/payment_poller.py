@@ -0,0 +1,215 @@
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from utils.storage import (
+    credit_payment,
+    add_pending_payment,
+    get_due_payments,
+    get_next_payment_check_at,
+    update_pending_payments,
+)
+from utils.yookassa_service import check_payment_status
+from utils.coordination import coordination
+from utils.metrics import PAYMENT_CHECKS, PAYMENTS_DUE, PAYMENTS_CREDITED
+from utils.logging import setup_logging
+from config import PAYMENT_CHECK_TIMEOUT, PAYMENT_CHECK_BATCH, YOOKASSA_WEBHOOK_PORT
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# Паузы между проверками одного платежа: сначала часто, потом реже
+CHECK_DELAYS = (5, 5, 10, 10, 15, 15, 30, 30, 60)
+MAX_CHECK_DELAY = 120
+
+# Если включены уведомления ЮКассы, опрос только подстраховывает их
+RECONCILE_CHECK_DELAYS = (60, 120, 300)
+RECONCILE_MAX_CHECK_DELAY = 600
+
+# Как долго спать, если очередь пуста и никто не будит
+IDLE_SLEEP = 60
+
+# Сколько секунд stop() ждёт окончания текущего прохода, прежде чем отменить цикл
+STOP_TIMEOUT = 15
+
+# При нескольких экземплярах бота платежи проверяет только ведущий
+LEADER_NAME = "payment_poller"
+
+
+def next_check_delay(attempts: int, reconcile_only: bool = False) -> float:
+    """Пауза перед следующей проверкой платежа после attempts проверок."""
+    delays = RECONCILE_CHECK_DELAYS if reconcile_only else CHECK_DELAYS
+    if attempts < len(delays):
+        return delays[attempts]
+    return RECONCILE_MAX_CHECK_DELAY if reconcile_only else MAX_CHECK_DELAY
+
+
+async def credit_successful_payment(bot, payment: dict) -> bool:
+    """
+    Начисляет лимиты за успешный платёж и уведомляет пользователя.
+    Повторное зачисление того же платежа (уведомление + опрос) исключено payments_ledger.
+    Возвращает False, если зачислить не удалось и платёж нужно проверить ещё раз.
+    """
+    payment_id = payment['payment_id']
+    user_id = payment['user_id']
+    amount = int(payment['amount'])
+    try:
+        success, credited = await credit_payment(payment_id, user_id, amount, time.time())
+        if not success:
+            logger.error(f"Ошибка пополнения лимитов для пользователя {user_id}")
+            return False
+        if not credited:
+            logger.info(f"Платеж {payment_id} уже зачислен")
+            return True
+
+        PAYMENTS_CREDITED.inc()
+        logger.info(f"Лимиты успешно пополнены для пользователя {user_id} на сумму {amount}")
+        if bot and payment.get('chat_id'):
+            await bot.send_message(
+                chat_id=payment['chat_id'],
+                text=f"✅ Оплата получена. Начислено лимитов: {amount}"
+            )
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка обработки успешного платежа {payment_id}: {e}")
+        return True
+
+
+class PaymentPoller:
+    """
+    Единый сервис проверки статуса платежей.
+
+    Ожидающие платежи хранятся в таблице pending_payments, поэтому после перезапуска
+    проверка продолжается. Один цикл забирает пачку платежей, срок проверки которых
+    наступил, и проверяет их параллельно.
+    При включённых уведомлениях ЮКассы (reconcile_only) платежи проверяются редко —
+    только на случай потерянного уведомления.
+    Если экземпляров бота несколько, очередь разбирает только ведущий (utils.coordination);
+    платежи, добавленные на других экземплярах, он не услышит, поэтому спит не дольше первой паузы.
+    """
+
+    def __init__(self, batch_size: int = PAYMENT_CHECK_BATCH, timeout: int = PAYMENT_CHECK_TIMEOUT,
+                 reconcile_only: bool = bool(YOOKASSA_WEBHOOK_PORT)):
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.reconcile_only = reconcile_only
+        self.bot = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def start(self, bot) -> None:
+        """Запускает цикл проверки (при старте бота)."""
+        self.bot = bot
+        self._stopping = False
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Останавливает цикл проверки. Ожидающие платежи остаются в базе.
+        Цикл доходит до конца текущего прохода: отмена посреди запроса к базе оставила бы
+        незакрытое соединение aiosqlite, поток которого не даёт процессу завершиться.
+        Отменяем только если проход не закончился за STOP_TIMEOUT секунд.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout=STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("Проверка платежей не остановилась вовремя, цикл отменён")
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+
+    async def add(self, payment_id: str, payment_info: dict) -> None:
+        """Ставит платёж в очередь проверки."""
+        now = time.time()
+        await add_pending_payment(
+            payment_id,
+            payment_info['user_id'],
+            payment_info['public_id'],
+            payment_info['amount'],
+            payment_info.get('chat_id'),
+            created_at=now,
+            next_check_at=now + next_check_delay(0, self.reconcile_only),
+        )
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        """Основной цикл: проверить наступившие платежи и уснуть до следующего срока."""
+        await coordination.campaign(LEADER_NAME)
+        while not self._stopping:
+            try:
+                if not coordination.is_leader(LEADER_NAME):
+                    # Платежи проверяет другой экземпляр; роль ведущего продлевает coordination
+                    sleep_for = coordination.lease_ttl / 3
+                else:
+                    checked = await self.check_due()
+                    if checked >= self.batch_size:
+                        # Очередь не разобрана — сразу берём следующую пачку
+                        continue
+
+                    next_check_at = await get_next_payment_check_at()
+                    sleep_for = IDLE_SLEEP if next_check_at is None else max(0.5, next_check_at - time.time())
+                    if coordination.shared:
+                        sleep_for = min(sleep_for, next_check_delay(0, self.reconcile_only))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка в цикле проверки платежей: {e}")
+                sleep_for = 5
+
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=sleep_for)
+            except asyncio.TimeoutError:
+                pass
+
+    async def check_due(self) -> int:
+        """Проверяет одну пачку платежей, срок проверки которых наступил. Возвращает их число."""
+        now = time.time()
+        payments = await get_due_payments(now, self.batch_size)
+        PAYMENTS_DUE.set(len(payments))
+        if not payments:
+            return 0
+
+        statuses = await asyncio.gather(
+            *(check_payment_status(payment['payment_id']) for payment in payments)
+        )
+
+        rescheduled = []
+        finished_ids = []
+        for payment, status in zip(payments, statuses):
+            payment_id = payment['payment_id']
+            attempts = payment['attempts'] + 1
+            PAYMENT_CHECKS.inc(status or 'error')
+            logger.debug(f"Платеж {payment_id}: статус {status}, проверка #{attempts}")
+
+            if status == 'succeeded':
+                if await credit_successful_payment(self.bot, payment):
+                    # Строку из очереди уже удалил credit_payment
+                    continue
+                rescheduled.append((now + next_check_delay(attempts, self.reconcile_only), attempts, payment_id))
+            elif status == 'canceled':
+                logger.info(f"Платеж {payment_id} отменен")
+                finished_ids.append(payment_id)
+            elif now - payment['created_at'] >= self.timeout:
+                logger.info(f"Время оплаты истекло для платежа {payment_id}")
+                finished_ids.append(payment_id)
+            else:
+                rescheduled.append((now + next_check_delay(attempts, self.reconcile_only), attempts, payment_id))
+
+        await update_pending_payments(rescheduled, finished_ids)
+        return len(payments)
+
+
+payment_poller = PaymentPoller()
@@ -0,0 +1,227 @@
+import json
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from utils.storage import load_user_state, save_user_states
+from utils.runes import encode_spread, decode_spread
+from utils.logging import setup_logging
+from config import PERSISTENCE_INTERVAL
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# Коды режимов и типов гадания для компактного хранения
+MODE_CODES = {
+    None: 0,
+    'main_menu': 1,
+    'one_rune': 2,
+    'three_rune': 3,
+    'four_rune': 4,
+    'fate': 5,
+    'field': 6,
+    'payment': 7,
+}
+PROMPT_TYPE_CODES = {
+    None: 0,
+    'one_rune': 1,
+    'three_runes': 2,
+    'four_runes': 3,
+    'fate': 4,
+    'field': 5,
+}
+MODES_BY_CODE = {code: mode for mode, code in MODE_CODES.items()}
+PROMPT_TYPES_BY_CODE = {code: prompt_type for prompt_type, code in PROMPT_TYPE_CODES.items()}
+
+FLAG_SUBSCRIBED = 1
+
+# Ключи user_data, у которых есть отдельные столбцы
+_KNOWN_KEYS = {'mode', 'prompt_type', 'selected_runes', 'admin_state', 'is_subscribed'}
+
+
+def encode_user_data(user_id: int, data: Dict) -> Optional[Tuple]:
+    """
+    Превращает user_data в строку таблицы user_state.
+    Пустое состояние — None (строку нужно удалить).
+    """
+    if not data:
+        return None
+
+    mode = data.get('mode')
+    prompt_type = data.get('prompt_type')
+    runes = data.get('selected_runes')
+    flags = FLAG_SUBSCRIBED if data.get('is_subscribed') else 0
+
+    extra = {key: value for key, value in data.items() if key not in _KNOWN_KEYS}
+    # Неизвестные режимы не теряем, а кладём в extra
+    if mode not in MODE_CODES:
+        extra['mode'] = mode
+        mode = None
+    if prompt_type not in PROMPT_TYPE_CODES:
+        extra['prompt_type'] = prompt_type
+        prompt_type = None
+
+    return (
+        user_id,
+        MODE_CODES[mode],
+        PROMPT_TYPE_CODES[prompt_type],
+        encode_spread(runes) if runes else None,
+        data.get('admin_state'),
+        flags,
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+    )
+
+
+def decode_user_data(row: Tuple) -> Dict:
+    """Восстанавливает user_data из строки таблицы user_state."""
+    mode, prompt_type, spread, admin_state, flags, extra = row
+    data = {}
+
+    if MODES_BY_CODE.get(mode):
+        data['mode'] = MODES_BY_CODE[mode]
+    if PROMPT_TYPES_BY_CODE.get(prompt_type):
+        data['prompt_type'] = PROMPT_TYPES_BY_CODE[prompt_type]
+    if spread:
+        data['selected_runes'] = decode_spread(spread)
+    if admin_state is not None:
+        data['admin_state'] = admin_state
+    if flags & FLAG_SUBSCRIBED:
+        data['is_subscribed'] = True
+    if extra:
+        data.update(json.loads(extra))
+
+    return data
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Хранит user_data в SQLite по строке на пользователя.
+
+    - Состояние загружается лениво, при первом апдейте пользователя после запуска,
+      поэтому перезапуск не читает всю таблицу.
+    - Изменения копятся в памяти и записываются пачкой одной транзакцией.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        # Пользователи, чьё состояние уже находится в памяти приложения
+        self._resident = set()
+        # Ожидающие записи: user_id -> строка (или None для удаления)
+        self._dirty: Dict[int, Optional[Tuple]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        """Подгружает состояние пользователя из базы при первом обращении."""
+        if user_id in self._resident:
+            return
+        self._resident.add(user_id)
+
+        if user_data:
+            return
+
+        # Незаписанное состояние новее, чем в базе
+        if user_id in self._dirty:
+            row = self._dirty[user_id]
+            if row is not None:
+                user_data.update(decode_user_data(row[1:]))
+            return
+
+        row = await load_user_state(user_id)
+        if row:
+            try:
+                user_data.update(decode_user_data(row))
+            except Exception as e:
+                logger.error(f"Не удалось восстановить состояние пользователя {user_id}: {e}")
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        """Помечает состояние пользователя для записи в базу."""
+        try:
+            self._dirty[user_id] = encode_user_data(user_id, data)
+        except Exception as e:
+            logger.error(f"Не удалось закодировать состояние пользователя {user_id}: {e}")
+            return
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._dirty[user_id] = None
+        self._resident.discard(user_id)
+        self._schedule_flush()
+
+    def forget(self, user_id: int) -> None:
+        """Отмечает, что состояние пользователя выгружено из памяти и при следующем апдейте его нужно прочитать из базы."""
+        self._resident.discard(user_id)
+
+    def _schedule_flush(self) -> None:
+        """Откладывает запись до конца текущего цикла, чтобы собрать все изменения в одну транзакцию."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_dirty())
+
+    async def _flush_dirty(self) -> None:
+        """Записывает накопленные изменения одной транзакцией."""
+        # Даём приложению передать изменения остальных пользователей
+        await asyncio.sleep(0)
+
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            batch, self._dirty = self._dirty, {}
+            rows = [row for row in batch.values() if row is not None]
+            deleted_ids = [user_id for user_id, row in batch.items() if row is None]
+
+            if not await save_user_states(rows, deleted_ids):
+                # Не теряем изменения: вернём их, если новых ещё не пришло
+                for user_id, row in batch.items():
+                    self._dirty.setdefault(user_id, row)
+                return
+
+            logger.debug(f"Сохранено состояний: {len(rows)}, удалено: {len(deleted_ids)}")
+
+    async def flush(self) -> None:
+        """Записывает всё оставшееся при остановке бота."""
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+        await self._flush_dirty()
@@ -0,0 +1,875 @@
+"""
+Хранилище на PostgreSQL (STORAGE_BACKEND=postgres): те же функции, что в utils.database,
+поверх пула соединений asyncpg. Схема повторяет SQLite: время — целые секунды UTC,
+виды гаданий — коды из divination_types, история гаданий — сжатые байты (BYTEA).
+Перенос данных из SQLite: python -m utils.storage_copy.
+"""
+import time
+import secrets
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+import asyncpg
+
+from utils.database import DIVINATION_TYPES, local_day
+from utils.logging import setup_logging
+from utils.error_digest import error_digest
+from utils.metrics import timed, DB_QUERY_SECONDS
+from config import ADMIN_ID
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# Таблицы и индексы. Коды новых видов гаданий выдаются с 1000, чтобы не пересекаться с известными
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS subscribers (
+        user_id BIGINT PRIMARY KEY,
+        first_seen BIGINT NOT NULL,
+        limits INTEGER DEFAULT 50,
+        public_id TEXT UNIQUE
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_subscribers_public_id_lower ON subscribers (lower(public_id))",
+    """
+    CREATE TABLE IF NOT EXISTS divination_types (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY (START WITH 1000) PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS divinations (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        created_at BIGINT NOT NULL,
+        type_id INTEGER NOT NULL REFERENCES divination_types (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_state (
+        user_id BIGINT PRIMARY KEY,
+        mode INTEGER NOT NULL DEFAULT 0,
+        prompt_type INTEGER NOT NULL DEFAULT 0,
+        spread BYTEA,
+        admin_state INTEGER,
+        flags INTEGER NOT NULL DEFAULT 0,
+        extra TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pending_payments (
+        payment_id TEXT PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        public_id TEXT NOT NULL,
+        amount DOUBLE PRECISION NOT NULL,
+        chat_id BIGINT,
+        created_at DOUBLE PRECISION NOT NULL,
+        next_check_at DOUBLE PRECISION NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_pending_payments_next_check ON pending_payments (next_check_at)",
+    # seq — порядок зачисления (как rowid в SQLite), по нему статистика пересчитывается пачками
+    """
+    CREATE TABLE IF NOT EXISTS payments_ledger (
+        payment_id TEXT PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        amount INTEGER NOT NULL,
+        credited_at DOUBLE PRECISION NOT NULL,
+        seq BIGINT GENERATED ALWAYS AS IDENTITY UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS divination_history (
+        id BIGINT PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        spread BYTEA,
+        question BYTEA NOT NULL,
+        answer BYTEA NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_divination_history_user ON divination_history (user_id, id)",
+    """
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT PRIMARY KEY,
+        active_users INTEGER NOT NULL DEFAULT 0,
+        new_subscribers INTEGER NOT NULL DEFAULT 0,
+        divinations INTEGER NOT NULL DEFAULT 0,
+        payments INTEGER NOT NULL DEFAULT 0,
+        paying_users INTEGER NOT NULL DEFAULT 0,
+        credits_purchased INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_divinations_daily (
+        day TEXT NOT NULL,
+        divination_type TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, divination_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_daily_users (
+        day TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        user_id BIGINT NOT NULL,
+        PRIMARY KEY (day, kind, user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_totals (
+        name TEXT PRIMARY KEY,
+        value BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+)
+
+
+class PostgresStorage:
+    """
+    Хранилище на PostgreSQL. Пул создаётся в init_db и закрывается в close_db.
+    search_path — схема для таблиц (по умолчанию схема из настроек сервера).
+    """
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, search_path: str | None = None):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.search_path = search_path
+        self._pool = None
+        # Кэш divination_types: название -> код
+        self._divination_type_ids = {name: code for code, name in enumerate(DIVINATION_TYPES, start=1)}
+        # Для какого дня уже удалены устаревшие строки stats_daily_users
+        self._daily_users_pruned_for = None
+
+    @timed(DB_QUERY_SECONDS)
+    async def init_db(self):
+        """Создаёт пул соединений и таблицы (те же, что в utils.database.init_db)."""
+        try:
+            if self._pool is None:
+                server_settings = {'search_path': self.search_path} if self.search_path else None
+                self._pool = await asyncpg.create_pool(
+                    self.dsn, min_size=self.min_size, max_size=self.max_size, server_settings=server_settings
+                )
+
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    for statement in SCHEMA:
+                        await conn.execute(statement)
+                    await conn.executemany(
+                        "INSERT INTO divination_types (id, name) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                        [(code, name) for code, name in enumerate(DIVINATION_TYPES, start=1)]
+                    )
+                    # Базы, созданные до stats_totals: число подписчиков считается один раз
+                    if await conn.fetchval("SELECT 1 FROM stats_totals WHERE name = 'subscribers'") is None:
+                        await conn.execute(
+                            """
+                            INSERT INTO stats_totals (name, value) SELECT 'subscribers', COUNT(*) FROM subscribers
+                            ON CONFLICT (name) DO NOTHING
+                            """
+                        )
+        except Exception as e:
+            error_message = f"Ошибка при создании базы данных PostgreSQL: {e}"
+            logger.error(error_message)
+            error_digest.report(error_message)
+
+    async def close_db(self):
+        """Закрывает пул соединений."""
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _insert_subscriber(self, conn, user_id: int) -> None:
+        """Добавляет подписчика, если его ещё нет, и учитывает его в статистике."""
+        first_seen = int(time.time())
+        public_id = f"RUNES-{secrets.token_hex(3).upper()}"
+        inserted = await conn.fetchval(
+            """
+            INSERT INTO subscribers (user_id, first_seen, public_id) VALUES ($1, $2, $3)
+            ON CONFLICT (user_id) DO NOTHING
+            RETURNING user_id
+            """,
+            user_id, first_seen, public_id
+        )
+        if inserted is not None:
+            await self._bump_daily_stats(conn, local_day(first_seen), new_subscribers=1)
+            await self._bump_total(conn, 'subscribers', 1)
+
+    @timed(DB_QUERY_SECONDS)
+    async def save_subscriber(self, user_id: int):
+        """Сохраняет подписчика (или пропускает, если он уже есть)."""
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    await self._insert_subscriber(conn, user_id)
+        except Exception as e:
+            error_message = f"Ошибка в save_subscriber: {e}"
+            logger.error(error_message)
+            error_digest.report(error_message)
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_subscribers(self):
+        """ID всех подписчиков, за исключением админа."""
+        try:
+            rows = await self._pool.fetch("SELECT user_id FROM subscribers WHERE user_id != $1", int(ADMIN_ID))
+            return [row[0] for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка в get_subscribers: {e}")
+            return []
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_total_subscribers(self) -> int | None:
+        """Всего подписчиков — накопительный итог из stats_totals."""
+        try:
+            return await self._pool.fetchval("SELECT value FROM stats_totals WHERE name = 'subscribers'")
+        except Exception as e:
+            logger.error(f"Ошибка в get_total_subscribers: {e}")
+            return None
+
+    async def _divination_type_id(self, conn, divination_type: str) -> int:
+        """Код вида гадания; неизвестный вид добавляется в divination_types."""
+        type_id = self._divination_type_ids.get(divination_type)
+        if type_id is None:
+            await conn.execute(
+                "INSERT INTO divination_types (name) VALUES ($1) ON CONFLICT (name) DO NOTHING", divination_type
+            )
+            type_id = await conn.fetchval("SELECT id FROM divination_types WHERE name = $1", divination_type)
+            self._divination_type_ids[divination_type] = type_id
+        return type_id
+
+    @timed(DB_QUERY_SECONDS)
+    async def save_divination(self, user_id: int, divination_type: str, history: tuple | None = None):
+        """
+        Сохраняет гадание, его историю (spread, question, answer) и счётчики статистики одной транзакцией.
+        Пользователь, которого ещё нет в subscribers, добавляется в той же транзакции.
+        """
+        try:
+            async with self._pool.acquire() as conn:
+                # Новый вид гадания записывается до транзакции, чтобы код в кэше не пропал при откате
+                type_id = await self._divination_type_id(conn, divination_type)
+                created_at = int(time.time())
+
+                async with conn.transaction():
+                    await self._insert_subscriber(conn, user_id)
+                    divination_id = await conn.fetchval(
+                        "INSERT INTO divinations (user_id, created_at, type_id) VALUES ($1, $2, $3) RETURNING id",
+                        user_id, created_at, type_id
+                    )
+                    if history is not None:
+                        await conn.execute(
+                            """
+                            INSERT INTO divination_history (id, user_id, spread, question, answer)
+                            VALUES ($1, $2, $3, $4, $5)
+                            """,
+                            divination_id, user_id, *history
+                        )
+                    await self._record_divination_stats(conn, local_day(created_at), user_id, divination_type)
+        except Exception as e:
+            error_message = f"Ошибка при сохранении гадания: {e}"
+            logger.error(error_message)
+            error_digest.report(error_message)
+
+    @timed(DB_QUERY_SECONDS)
+    async def top_up_limits(self, public_id: str, amount: int) -> tuple[bool, int]:
+        """Пополняет лимиты по public_id. Возвращает (success, user_id), user_id = None, если не найден."""
+        try:
+            user_id = await self._pool.fetchval(
+                "UPDATE subscribers SET limits = limits + $1 WHERE lower(public_id) = lower($2) RETURNING user_id",
+                amount, public_id.strip()
+            )
+            if user_id is None:
+                return (False, None)
+            return (True, user_id)
+        except Exception as e:
+            logger.error(f"Ошибка в top_up_limits: {e}")
+            return (False, None)
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_user_limits(self, public_id: str) -> tuple[bool, int, int]:
+        """Возвращает (success, limits, user_id) для пользователя по public_id."""
+        try:
+            row = await self._pool.fetchrow(
+                "SELECT limits, user_id FROM subscribers WHERE lower(public_id) = lower($1)",
+                public_id.strip()
+            )
+            if row:
+                return (True, row[0], row[1])
+            return (False, 0, None)
+        except Exception as e:
+            logger.error(f"Ошибка в get_user_limits: {e}")
+            return (False, 0, None)
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_user_info_by_user_id(self, user_id: int) -> tuple[bool, str, int]:
+        """Возвращает (success, public_id, limits) для пользователя по Telegram ID."""
+        try:
+            row = await self._pool.fetchrow("SELECT public_id, limits FROM subscribers WHERE user_id = $1", user_id)
+            if row:
+                return (True, row[0], row[1])
+            return (False, "", 0)
+        except Exception as e:
+            logger.error(f"get_user_info_by_user_id: {e}")
+            return (False, "", 0)
+
+    @timed(DB_QUERY_SECONDS)
+    async def deduct_limits(self, user_id: int, amount: int) -> bool:
+        """Списывает amount лимитов. True, если лимитов хватило; проверка и списание — один запрос."""
+        try:
+            updated = await self._pool.fetchval(
+                "UPDATE subscribers SET limits = limits - $2 WHERE user_id = $1 AND limits >= $2 RETURNING user_id",
+                user_id, amount
+            )
+            return updated is not None
+        except Exception as e:
+            logger.error(f"Ошибка в deduct_limits: {e}")
+            return False
+
+    @timed(DB_QUERY_SECONDS)
+    async def add_limits(self, user_id: int, amount: int) -> bool:
+        """Начисляет amount лимитов пользователю по Telegram ID."""
+        try:
+            updated = await self._pool.fetchval(
+                "UPDATE subscribers SET limits = limits + $1 WHERE user_id = $2 RETURNING user_id",
+                amount, user_id
+            )
+            return updated is not None
+        except Exception as e:
+            logger.error(f"Ошибка в add_limits: {e}")
+            return False
+
+    @timed(DB_QUERY_SECONDS)
+    async def reset_daily_limits(self, limit: int) -> bool:
+        """Поднимает лимиты всех пользователей до limit, если у них меньше."""
+        try:
+            await self._pool.execute("UPDATE subscribers SET limits = $1 WHERE limits < $1", limit)
+            return True
+        except Exception as e:
+            error_message = f"Ошибка в reset_daily_limits: {e}"
+            logger.error(error_message)
+            error_digest.report(error_message)
+            return False
+
+    @timed(DB_QUERY_SECONDS)
+    async def bulk_top_up_limits(self, entries: list[tuple], chunk_size: int) -> tuple[bool, list[tuple], list[str]]:
+        """
+        Пополняет лимиты многих пользователей по public_id (см. utils.database.bulk_top_up_limits).
+        Каждая пачка — один UPDATE по массивам public_id и сумм в своей транзакции.
+        """
+        credited = []
+        not_found = []
+        try:
+            async with self._pool.acquire() as conn:
+                for start in range(0, len(entries), chunk_size):
+                    chunk = entries[start:start + chunk_size]
+
+                    async with conn.transaction():
+                        rows = await conn.fetch(
+                            """
+                            UPDATE subscribers AS s SET limits = s.limits + b.amount
+                            FROM unnest($1::text[], $2::integer[]) AS b (public_id, amount)
+                            WHERE s.public_id = b.public_id
+                            RETURNING s.user_id, s.public_id, b.amount
+                            """,
+                            [public_id for public_id, _ in chunk], [amount for _, amount in chunk]
+                        )
+
+                    found = {row[1] for row in rows}
+                    credited.extend(tuple(row) for row in rows)
+                    not_found.extend(public_id for public_id, _ in chunk if public_id not in found)
+
+            return (True, credited, not_found)
+        except Exception as e:
+            logger.error(f"Ошибка в bulk_top_up_limits: {e}")
+            return (False, credited, not_found)
+
+    @timed(DB_QUERY_SECONDS)
+    async def load_user_state(self, user_id: int) -> tuple | None:
+        """Сохранённое состояние (mode, prompt_type, spread, admin_state, flags, extra) или None."""
+        try:
+            row = await self._pool.fetchrow(
+                "SELECT mode, prompt_type, spread, admin_state, flags, extra FROM user_state WHERE user_id = $1",
+                user_id
+            )
+            return tuple(row) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка в load_user_state: {e}")
+            return None
+
+    @timed(DB_QUERY_SECONDS)
+    async def save_user_states(self, rows: list[tuple], deleted_ids: list[int]) -> bool:
+        """Записывает пачку состояний (user_id, mode, prompt_type, spread, admin_state, flags, extra) и удаляет deleted_ids."""
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    if rows:
+                        await conn.executemany(
+                            """
+                            INSERT INTO user_state (user_id, mode, prompt_type, spread, admin_state, flags, extra)
+                            VALUES ($1, $2, $3, $4, $5, $6, $7)
+                            ON CONFLICT (user_id) DO UPDATE SET
+                                mode = excluded.mode,
+                                prompt_type = excluded.prompt_type,
+                                spread = excluded.spread,
+                                admin_state = excluded.admin_state,
+                                flags = excluded.flags,
+                                extra = excluded.extra
+                            """,
+                            rows
+                        )
+                    if deleted_ids:
+                        await conn.execute("DELETE FROM user_state WHERE user_id = ANY($1::bigint[])", deleted_ids)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка в save_user_states: {e}")
+            return False
+
+    @timed(DB_QUERY_SECONDS)
+    async def add_pending_payment(self, payment_id: str, user_id: int, public_id: str, amount: float,
+                                  chat_id: int, created_at: float, next_check_at: float) -> bool:
+        """Ставит платёж в очередь проверки статуса."""
+        try:
+            await self._pool.execute(
+                """
+                INSERT INTO pending_payments
+                    (payment_id, user_id, public_id, amount, chat_id, created_at, next_check_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                ON CONFLICT (payment_id) DO NOTHING
+                """,
+                payment_id, user_id, public_id, amount, chat_id, created_at, next_check_at
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка в add_pending_payment: {e}")
+            return False
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_due_payments(self, now: float, limit: int) -> list[dict]:
+        """Платежи, которые пора проверить (не больше limit)."""
+        try:
+            rows = await self._pool.fetch(
+                """
+                SELECT payment_id, user_id, public_id, amount, chat_id, created_at, attempts
+                FROM pending_payments
+                WHERE next_check_at <= $1
+                ORDER BY next_check_at
+                LIMIT $2
+                """,
+                now, limit
+            )
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка в get_due_payments: {e}")
+            return []
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_next_payment_check_at(self) -> float | None:
+        """Время ближайшей запланированной проверки или None, если очередь пуста."""
+        try:
+            return await self._pool.fetchval("SELECT MIN(next_check_at) FROM pending_payments")
+        except Exception as e:
+            logger.error(f"Ошибка в get_next_payment_check_at: {e}")
+            return None
+
+    @timed(DB_QUERY_SECONDS)
+    async def update_pending_payments(self, rescheduled: list[tuple], finished_ids: list[str]) -> bool:
+        """Сохраняет результаты пачки проверок: rescheduled (next_check_at, attempts, payment_id), finished_ids."""
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    if rescheduled:
+                        await conn.executemany(
+                            "UPDATE pending_payments SET next_check_at = $1, attempts = $2 WHERE payment_id = $3",
+                            rescheduled
+                        )
+                    if finished_ids:
+                        await conn.execute(
+                            "DELETE FROM pending_payments WHERE payment_id = ANY($1::text[])", finished_ids
+                        )
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка в update_pending_payments: {e}")
+            return False
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_pending_payment(self, payment_id: str) -> dict | None:
+        """Ожидающий платёж по его ID или None."""
+        try:
+            row = await self._pool.fetchrow(
+                "SELECT payment_id, user_id, public_id, amount, chat_id FROM pending_payments WHERE payment_id = $1",
+                payment_id
+            )
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка в get_pending_payment: {e}")
+            return None
+
+    @timed(DB_QUERY_SECONDS)
+    async def credit_payment(self, payment_id: str, user_id: int, amount: int,
+                             credited_at: float) -> tuple[bool, bool]:
+        """
+        Зачисляет платёж ровно один раз (см. utils.database.credit_payment).
+        Возвращает (success, credited).
+        """
+        try:
+            async with self._pool.acquire() as conn:
+                transaction = conn.transaction()
+                await transaction.start()
+                try:
+                    inserted = await conn.fetchval(
+                        """
+                        INSERT INTO payments_ledger (payment_id, user_id, amount, credited_at)
+                        VALUES ($1, $2, $3, $4)
+                        ON CONFLICT (payment_id) DO NOTHING
+                        RETURNING payment_id
+                        """,
+                        payment_id, user_id, amount, credited_at
+                    )
+                    if inserted is None:
+                        await conn.execute("DELETE FROM pending_payments WHERE payment_id = $1", payment_id)
+                        await transaction.commit()
+                        return (True, False)
+
+                    updated = await conn.fetchval(
+                        "UPDATE subscribers SET limits = limits + $1 WHERE user_id = $2 RETURNING user_id",
+                        amount, user_id
+                    )
+                    if updated is None:
+                        await transaction.rollback()
+                        logger.error(f"credit_payment: пользователь {user_id} не найден (платёж {payment_id})")
+                        return (False, False)
+
+                    await self._record_payment_stats(conn, local_day(credited_at), user_id, amount)
+                    await conn.execute("DELETE FROM pending_payments WHERE payment_id = $1", payment_id)
+                    await transaction.commit()
+                    return (True, True)
+                except Exception:
+                    await transaction.rollback()
+                    raise
+        except Exception as e:
+            logger.error(f"Ошибка в credit_payment: {e}")
+            return (False, False)
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_history_page(self, user_id: int, limit: int, before_id: int | None = None,
+                               after_id: int | None = None) -> tuple[list[tuple], bool, bool] | None:
+        """
+        Страница истории гаданий пользователя, от новых к старым (см. utils.database.get_history_page).
+        Возвращает (rows, has_newer, has_older), где rows: (id, created_at, divination_type, question).
+        """
+        try:
+            select = """
+                SELECT h.id, d.created_at, t.name, h.question
+                FROM divination_history h
+                JOIN divinations d ON d.id = h.id
+                JOIN divination_types t ON t.id = d.type_id
+            """
+            async with self._pool.acquire() as conn:
+                rows = None
+                if after_id is not None:
+                    rows = await conn.fetch(
+                        select + "WHERE h.user_id = $1 AND h.id > $2 ORDER BY h.id LIMIT $3",
+                        user_id, after_id, limit
+                    )
+                    rows = rows[::-1]
+                    if len(rows) < limit:
+                        # Дошли до самых новых: показываем первую страницу целиком
+                        rows = None
+                        before_id = None
+
+                if rows is None:
+                    rows = await conn.fetch(
+                        select + "WHERE h.user_id = $1 AND h.id < $2 ORDER BY h.id DESC LIMIT $3",
+                        user_id, before_id if before_id is not None else 2 ** 63 - 1, limit
+                    )
+
+                has_newer = has_older = False
+                if rows:
+                    has_newer, has_older = await conn.fetchrow(
+                        "SELECT EXISTS (SELECT 1 FROM divination_history WHERE user_id = $1 AND id > $2), "
+                        "EXISTS (SELECT 1 FROM divination_history WHERE user_id = $1 AND id < $3)",
+                        user_id, rows[0][0], rows[-1][0]
+                    )
+
+            return ([tuple(row) for row in rows], has_newer, has_older)
+        except Exception as e:
+            logger.error(f"Ошибка в get_history_page: {e}")
+            return None
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_history_entry(self, user_id: int, divination_id: int) -> tuple | None:
+        """Одно гадание пользователя: (id, created_at, divination_type, spread, question, answer) или None."""
+        try:
+            row = await self._pool.fetchrow(
+                """
+                SELECT h.id, d.created_at, t.name, h.spread, h.question, h.answer
+                FROM divination_history h
+                JOIN divinations d ON d.id = h.id
+                JOIN divination_types t ON t.id = d.type_id
+                WHERE h.id = $1 AND h.user_id = $2
+                """,
+                divination_id, user_id
+            )
+            return tuple(row) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка в get_history_entry: {e}")
+            return None
+
+    @timed(DB_QUERY_SECONDS)
+    async def export_subscribers(self) -> list[tuple] | None:
+        """Все подписчики для выгрузки: (user_id, first_seen, limits, public_id)."""
+        try:
+            rows = await self._pool.fetch(
+                "SELECT user_id, first_seen, limits, public_id FROM subscribers ORDER BY user_id"
+            )
+            return [tuple(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка в export_subscribers: {e}")
+            return None
+
+    @timed(DB_QUERY_SECONDS)
+    async def export_divinations(self) -> list[tuple] | None:
+        """Все гадания для выгрузки: (id, user_id, created_at, divination_type)."""
+        try:
+            rows = await self._pool.fetch("""
+                SELECT d.id, d.user_id, d.created_at, t.name
+                FROM divinations d JOIN divination_types t ON t.id = d.type_id
+                ORDER BY d.id
+            """)
+            return [tuple(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка в export_divinations: {e}")
+            return None
+
+    # Дневная статистика: те же таблицы и правила, что в utils.database.
+    # День события считается в Python (local_day), как и в SQLite-хранилище.
+
+    async def _bump_daily_stats(self, conn, day: str, **increments) -> None:
+        """Прибавляет increments к счётчикам stats_daily за день."""
+        columns = ", ".join(increments)
+        placeholders = ", ".join(f"${number}" for number in range(2, len(increments) + 2))
+        updates = ", ".join(f"{column} = stats_daily.{column} + excluded.{column}" for column in increments)
+        await conn.execute(
+            f"INSERT INTO stats_daily (day, {columns}) VALUES ($1, {placeholders}) "
+            f"ON CONFLICT (day) DO UPDATE SET {updates}",
+            day, *increments.values()
+        )
+
+    async def _bump_total(self, conn, name: str, amount: int) -> None:
+        """Прибавляет amount к итогу name в stats_totals (строка создаётся в init_db)."""
+        await conn.execute("UPDATE stats_totals SET value = value + $1 WHERE name = $2", amount, name)
+
+    async def _mark_daily_user(self, conn, day: str, kind: str, user_id: int) -> bool:
+        """Отмечает пользователя за день. True, если в этот день он отмечен впервые."""
+        inserted = await conn.fetchval(
+            """
+            INSERT INTO stats_daily_users (day, kind, user_id) VALUES ($1, $2, $3)
+            ON CONFLICT DO NOTHING
+            RETURNING user_id
+            """,
+            day, kind, user_id
+        )
+        return inserted is not None
+
+    async def _prune_daily_users(self, conn, day: str) -> None:
+        """Удаляет отметки пользователей старше вчерашнего дня."""
+        yesterday = (datetime.strptime(day, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+        await conn.execute("DELETE FROM stats_daily_users WHERE day < $1", yesterday)
+
+    async def _record_divination_stats(self, conn, day: str, user_id: int, divination_type: str) -> None:
+        if self._daily_users_pruned_for != day:
+            await self._prune_daily_users(conn, day)
+            self._daily_users_pruned_for = day
+
+        first_today = await self._mark_daily_user(conn, day, 'active', user_id)
+        await self._bump_daily_stats(conn, day, divinations=1, active_users=int(first_today))
+        await conn.execute(
+            """
+            INSERT INTO stats_divinations_daily (day, divination_type, count) VALUES ($1, $2, 1)
+            ON CONFLICT (day, divination_type) DO UPDATE SET count = stats_divinations_daily.count + 1
+            """,
+            day, divination_type
+        )
+
+    async def _record_payment_stats(self, conn, day: str, user_id: int, amount: int) -> None:
+        first_today = await self._mark_daily_user(conn, day, 'paying', user_id)
+        await self._bump_daily_stats(conn, day, payments=1, credits_purchased=amount, paying_users=int(first_today))
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_daily_stats(self, days: int) -> dict | None:
+        """Статистика за последние days дней (см. utils.database.get_daily_stats)."""
+        try:
+            since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+            async with self._pool.acquire() as conn:
+                daily = [dict(row) for row in await conn.fetch(
+                    "SELECT * FROM stats_daily WHERE day >= $1 ORDER BY day", since
+                )]
+                rows = await conn.fetch(
+                    """
+                    SELECT divination_type, SUM(count) FROM stats_divinations_daily
+                    WHERE day >= $1
+                    GROUP BY divination_type
+                    ORDER BY SUM(count) DESC
+                    """,
+                    since
+                )
+                by_type = {row[0]: row[1] for row in rows}
+                total_subscribers = await conn.fetchval("SELECT value FROM stats_totals WHERE name = 'subscribers'")
+
+            return {'days': daily, 'by_type': by_type, 'total_subscribers': total_subscribers}
+        except Exception as e:
+            logger.error(f"Ошибка в get_daily_stats: {e}")
+            return None
+
+    async def _backfill_chunk(self, conn, rows: list, kind: str) -> Counter:
+        """
+        Отмечает пользователей пачки во временной таблице backfill_users.
+        rows: (время, user_id, ...). Возвращает число событий по дням.
+        """
+        per_day = Counter()
+        users = set()
+        for row in rows:
+            day = local_day(row[0])
+            per_day[day] += 1
+            users.add((day, kind, row[1]))
+        await conn.executemany(
+            "INSERT INTO backfill_users (day, kind, user_id) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING",
+            users
+        )
+        return per_day
+
+    @timed(DB_QUERY_SECONDS)
+    async def backfill_stats(self, chunk_size: int) -> dict | None:
+        """
+        Заново заполняет статистику по истории (см. utils.database.backfill_stats).
+        Граница пересчёта — последние id гаданий и seq платежей под блокировкой SHARE:
+        она дожидается незавершённых записей и не пускает новые, пока статистика очищается,
+        поэтому каждое событие учитывается либо пересчётом, либо обычным путём.
+        Дни считаются в Python по местному времени, как при обычной записи.
+        """
+        try:
+            async with self._pool.acquire() as conn:
+                today = datetime.now().strftime("%Y-%m-%d")
+                await conn.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS backfill_users (
+                        day TEXT NOT NULL,
+                        kind TEXT NOT NULL,
+                        user_id BIGINT NOT NULL,
+                        PRIMARY KEY (day, kind, user_id)
+                    )
+                """)
+                try:
+                    async with conn.transaction():
+                        await conn.execute("TRUNCATE backfill_users")
+                        await conn.execute("LOCK TABLE subscribers, divinations, payments_ledger IN SHARE MODE")
+                        last_divination_id, divinations = await conn.fetchrow(
+                            "SELECT COALESCE(MAX(id), 0), COUNT(*) FROM divinations"
+                        )
+                        last_payment_seq, payments = await conn.fetchrow(
+                            "SELECT COALESCE(MAX(seq), 0), COUNT(*) FROM payments_ledger"
+                        )
+                        for table in ("stats_daily", "stats_divinations_daily", "stats_daily_users"):
+                            await conn.execute(f"DELETE FROM {table}")
+                        new_subscribers = Counter(
+                            local_day(row[0]) for row in await conn.fetch("SELECT first_seen FROM subscribers")
+                        )
+                        await conn.executemany(
+                            "INSERT INTO stats_daily (day, new_subscribers) VALUES ($1, $2)",
+                            new_subscribers.items()
+                        )
+                        await conn.execute(
+                            """
+                            INSERT INTO stats_totals (name, value) VALUES ('subscribers', $1)
+                            ON CONFLICT (name) DO UPDATE SET value = excluded.value
+                            """,
+                            sum(new_subscribers.values())
+                        )
+
+                    # Гадания
+                    for start in range(0, last_divination_id, chunk_size):
+                        async with conn.transaction():
+                            rows = await conn.fetch(
+                                """
+                                SELECT d.created_at, d.user_id, t.name
+                                FROM divinations d JOIN divination_types t ON t.id = d.type_id
+                                WHERE d.id > $1 AND d.id <= $2
+                                """,
+                                start, min(start + chunk_size, last_divination_id)
+                            )
+                            per_day = await self._backfill_chunk(conn, rows, 'active')
+                            per_type = Counter((local_day(row[0]), row[2]) for row in rows)
+                            await conn.executemany(
+                                """
+                                INSERT INTO stats_daily (day, divinations) VALUES ($1, $2)
+                                ON CONFLICT (day) DO UPDATE SET divinations = stats_daily.divinations + excluded.divinations
+                                """,
+                                per_day.items()
+                            )
+                            await conn.executemany(
+                                """
+                                INSERT INTO stats_divinations_daily (day, divination_type, count) VALUES ($1, $2, $3)
+                                ON CONFLICT (day, divination_type) DO UPDATE
+                                SET count = stats_divinations_daily.count + excluded.count
+                                """,
+                                [(day, divination_type, count) for (day, divination_type), count in per_type.items()]
+                            )
+
+                    # Зачисленные платежи
+                    for start in range(0, last_payment_seq, chunk_size):
+                        async with conn.transaction():
+                            rows = await conn.fetch(
+                                "SELECT credited_at, user_id, amount FROM payments_ledger WHERE seq > $1 AND seq <= $2",
+                                start, min(start + chunk_size, last_payment_seq)
+                            )
+                            per_day = await self._backfill_chunk(conn, rows, 'paying')
+                            credits = Counter()
+                            for row in rows:
+                                credits[local_day(row[0])] += row[2]
+                            await conn.executemany(
+                                """
+                                INSERT INTO stats_daily (day, payments, credits_purchased) VALUES ($1, $2, $3)
+                                ON CONFLICT (day) DO UPDATE SET
+                                    payments = stats_daily.payments + excluded.payments,
+                                    credits_purchased = stats_daily.credits_purchased + excluded.credits_purchased
+                                """,
+                                [(day, count, credits[day]) for day, count in per_day.items()]
+                            )
+
+                    # Уникальные пользователи: прошлые дни — готовое число, сегодня — только ещё не отмеченные
+                    async with conn.transaction():
+                        for kind, column in (('active', 'active_users'), ('paying', 'paying_users')):
+                            await conn.execute(f"""
+                                INSERT INTO stats_daily (day, {column})
+                                SELECT day, COUNT(*) FROM backfill_users
+                                WHERE kind = $1 AND day < $2
+                                GROUP BY day
+                                ON CONFLICT (day) DO UPDATE SET {column} = excluded.{column}
+                            """, kind, today)
+                            await conn.execute(f"""
+                                INSERT INTO stats_daily (day, {column})
+                                SELECT day, COUNT(*) FROM backfill_users AS b
+                                WHERE kind = $1 AND day >= $2 AND NOT EXISTS (
+                                    SELECT 1 FROM stats_daily_users AS u
+                                    WHERE u.day = b.day AND u.kind = b.kind AND u.user_id = b.user_id
+                                )
+                                GROUP BY day
+                                ON CONFLICT (day) DO UPDATE SET {column} = stats_daily.{column} + excluded.{column}
+                            """, kind, today)
+                        await conn.execute("""
+                            INSERT INTO stats_daily_users (day, kind, user_id)
+                            SELECT day, kind, user_id FROM backfill_users WHERE day >= $1
+                            ON CONFLICT DO NOTHING
+                        """, today)
+                        await self._prune_daily_users(conn, today)
+
+                    days = await conn.fetchval("SELECT COUNT(*) FROM stats_daily")
+                finally:
+                    # Соединение вернётся в пул — временная таблица ему больше не нужна
+                    await conn.execute("DROP TABLE IF EXISTS backfill_users")
+
+            return {'days': days, 'divinations': divinations, 'payments': payments}
+        except Exception as e:
+            logger.error(f"Ошибка в backfill_stats: {e}")
+            return None
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from utils.storage import get_user_info_by_user_id
+from utils.gpt import warm_up_gpt
+from utils.runes import load_rune_data, resolve_rune, get_cached_file_id
+from utils.logging import setup_logging
+from utils.metrics import CACHE_REQUESTS
+from utils.tracing import traced
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# Фоновые подготовки по user_id
+_preparations: Dict[int, asyncio.Task] = {}
+
+# Сколько секунд хранится готовая подготовка, если вопрос так и не задан
+PREPARATION_TTL = 10 * 60
+
+
+async def _prepare(user_id: int, runes: Optional[List[Dict]]) -> Dict:
+    """
+    Выполняет всё, что не зависит от текста вопроса:
+    - получает баланс пользователя
+    - прогревает соединение с GPT
+    - находит имена, картинки и file_id выпавших рун
+    """
+    user_info, rune_data, _ = await asyncio.gather(
+        get_user_info_by_user_id(user_id),
+        load_rune_data() if runes else asyncio.sleep(0, result={}),
+        warm_up_gpt(),
+    )
+
+    resolved = []
+    for rune in runes or []:
+        name, image_path = resolve_rune(rune, rune_data)
+        file_id = get_cached_file_id(image_path) if image_path else None
+        resolved.append((rune['rune_key'], name, image_path, file_id))
+
+    return {
+        'runes': runes,
+        'user_info': user_info,
+        'resolved': resolved,
+    }
+
+
+def start_preparation(user_id: int, runes: Optional[List[Dict]] = None) -> None:
+    """Запускает подготовку гадания, пока пользователь печатает вопрос."""
+    cancel_preparation(user_id)
+    task = asyncio.create_task(_prepare(user_id, runes))
+    task.add_done_callback(lambda done: _on_done(user_id, done))
+    _preparations[user_id] = task
+
+
+def _on_done(user_id: int, task: asyncio.Task) -> None:
+    """Забирает исключение задачи и удаляет её результат, если он не понадобился за PREPARATION_TTL."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Подготовка гадания для {user_id} не удалась: {task.exception()}")
+    asyncio.get_running_loop().call_later(PREPARATION_TTL, _forget, user_id, task)
+
+
+def _forget(user_id: int, task: asyncio.Task) -> None:
+    if _preparations.get(user_id) is task:
+        del _preparations[user_id]
+
+
+def cancel_preparation(user_id: int) -> None:
+    """Отменяет подготовку, если пользователь вышел из режима."""
+    task = _preparations.pop(user_id, None)
+    if task and not task.done():
+        task.cancel()
+
+
+@traced()
+async def take_preparation(user_id: int, runes: Optional[List[Dict]] = None) -> Optional[Dict]:
+    """
+    Забирает результат подготовки.
+    Возвращает None, если подготовки нет, она не удалась или сделана для других рун.
+    """
+    task = _preparations.pop(user_id, None)
+    if task is None:
+        CACHE_REQUESTS.inc('preparation', 'miss')
+        return None
+
+    try:
+        prepared = await task
+    except asyncio.CancelledError:
+        if not task.cancelled():
+            raise
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка подготовки гадания для {user_id}: {e}")
+        return None
+
+    if prepared['runes'] != runes:
+        CACHE_REQUESTS.inc('preparation', 'stale')
+        return None
+    CACHE_REQUESTS.inc('preparation', 'hit')
+    return prepared
@@ -4,8 +4,13 @@ import random
 import asyncio
 from typing import List, Dict, Optional, Tuple, Union
 
+from utils.metrics import CACHE_REQUESTS
+
 RUNES_FILE = os.path.join("runes.json")
 
+# Telegram file_id уже загруженных картинок: повторная отправка не требует выгрузки файла
+_photo_file_ids: Dict[str, str] = {}
+
 
 async def _load_full_json() -> Dict:
     """Служебная: грузит исходный JSON целиком в отдельном потоке."""
@@ -109,6 +114,89 @@ async def get_random_one_rune() -> Tuple[str, str]:
     image_path = os.path.join("images", image) if image else ""
     return name, image_path
 
+def resolve_rune(rune: Dict[str, Optional[str]], rune_data: Dict) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Возвращает (имя, путь_к_картинке) для выпавшей руны.
+    Если руны нет в данных или они неполные — (None, None).
+    """
+    node = rune_data.get(rune["rune_key"])
+    if node is None:
+        return None, None
+
+    variant = rune["variant"]
+    if variant is not None:
+        node = node.get(variant, {})
+
+    name = node.get("name")
+    image = node.get("image")
+    if not name or not image:
+        return None, None
+
+    return name, os.path.join("images", image)
+
+
+# Коды рун в сохранённых раскладах (divination_history, user_state). Коды хранятся в базе
+# навсегда, поэтому таблица не зависит от runes.json: новые руны только дописываются в конец,
+# существующие коды не меняются и не удаляются, даже если руну переименовали или убрали.
+# Кодов не больше 85: код * 3 + положение должен уместиться в байт.
+RUNE_CODES: Dict[str, int] = {
+    'ansuz': 0, 'berkana': 1, 'dagaz': 2, 'ehwaz': 3, 'eihwaz': 4, 'elhaz': 5,
+    'fehu': 6, 'gebo': 7, 'hagalaz': 8, 'inguz': 9, 'isa': 10, 'jera': 11,
+    'kenaz': 12, 'laguz': 13, 'mannaz': 14, 'nauthiz': 15, 'othala': 16, 'perthro': 17,
+    'raidho': 18, 'sowilo': 19, 'thurisaz': 20, 'tiewaz': 21, 'uruz': 22, 'wunjo': 23,
+}
+_RUNE_KEYS: Dict[int, str] = {code: rune_key for rune_key, code in RUNE_CODES.items()}
+
+
+def encode_spread(runes: List[Dict[str, Optional[str]]]) -> bytes:
+    """
+    Кодирует расклад в байты: одна руна — один байт.
+    Байт = код руны из RUNE_CODES * 3 + положение (0 — без положения, 1 — прямое, 2 — перевёрнутое).
+    """
+    code = bytearray()
+    for rune in runes:
+        rune_key = rune["rune_key"]
+        if rune_key not in RUNE_CODES:
+            raise ValueError(f"Руны {rune_key} нет в RUNE_CODES — допишите ей новый код")
+        variant = rune["variant"]
+        if variant is None:
+            position = 0
+        elif variant.endswith("_revers"):
+            position = 2
+        else:
+            position = 1
+        code.append(RUNE_CODES[rune_key] * 3 + position)
+    return bytes(code)
+
+
+def decode_spread(code: bytes) -> List[Dict[str, Optional[str]]]:
+    """Восстанавливает расклад из байтового кода (обратная операция к encode_spread)."""
+    runes = []
+    for value in code:
+        rune_key = _RUNE_KEYS[value // 3]
+        position = value % 3
+        if position == 0:
+            variant = None
+        elif position == 1:
+            variant = f"{rune_key}_direct"
+        else:
+            variant = f"{rune_key}_revers"
+        runes.append({"rune_key": rune_key, "variant": variant})
+    return runes
+
+
+def get_cached_file_id(image_path: str) -> Optional[str]:
+    """Возвращает file_id картинки, если она уже отправлялась в Telegram."""
+    file_id = _photo_file_ids.get(image_path)
+    CACHE_REQUESTS.inc('photo_file_id', 'miss' if file_id is None else 'hit')
+    return file_id
+
+
+def remember_file_id(image_path: str, file_id: str) -> None:
+    """Запоминает file_id отправленной картинки."""
+    _photo_file_ids[image_path] = file_id
+
+
 # Обёртки для обратной совместимости
 async def get_random_three_runes() -> List[Dict[str, Optional[str]]]:
     return await get_random_runes(3)
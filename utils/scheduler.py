@@ -1,24 +1,9 @@
-import sqlite3
-import logging
-from datetime import datetime
-from pytz import timezone
-from config import SQLITE_DB
+from utils.storage import reset_daily_limits as reset_limits
 
-logger = logging.getLogger(__name__)
+# До скольких лимитов поднимается баланс каждую ночь
+DAILY_LIMITS = 50
 
-def reset_daily_limits():
-    """Обновляет лимиты всех пользователей до 50, если они меньше 50."""
-    try:
-        conn = sqlite3.connect(SQLITE_DB)
-        cursor = conn.cursor()
 
-        cursor.execute("""
-            UPDATE subscribers
-            SET limits = 50
-            WHERE limits < 50
-        """)
-
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"Ошибка в reset_daily_limits: {e}")
\ No newline at end of file
+async def reset_daily_limits():
+    """Обновляет лимиты всех пользователей до 50, если они меньше 50 (ошибки пишет хранилище)."""
+    await reset_limits(DAILY_LIMITS)
@@ -0,0 +1,151 @@
+import sys
+import time
+import logging
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from utils.logging import setup_logging
+from utils.tasks import divination_tasks
+from config import SESSION_TTL, MAX_SESSIONS
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+# По скольким сессиям оценивается объём в stats(): полный обход на каждый сбор метрик слишком дорог
+SIZE_SAMPLE = 100
+
+
+def _approx_size(obj, seen=None) -> int:
+    """Приблизительный размер объекта в байтах вместе с вложенными dict/list."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_approx_size(k, seen) + _approx_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_approx_size(item, seen) for item in obj)
+    return size
+
+
+class SessionStore:
+    """
+    Ограничивает число user_data, которые приложение держит в памяти.
+
+    - Состояние пользователя выгружается после ttl секунд бездействия.
+    - Если пользователей больше max_sessions, выгружаются давно неактивные (LRU).
+    Выгруженное состояние остаётся в SQLitePersistence и подгружается при следующем апдейте.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.application = None
+        # user_id -> время последнего апдейта, от давних к свежим
+        self._last_seen: OrderedDict[int, float] = OrderedDict()
+        self.evicted = 0
+
+    def attach(self, application) -> None:
+        """Привязывает хранилище к приложению."""
+        self.application = application
+
+    async def touch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Отмечает активность пользователя (вызывается для каждого апдейта)."""
+        user = update.effective_user
+        if user is None:
+            return
+
+        self._last_seen[user.id] = time.monotonic()
+        self._last_seen.move_to_end(user.id)
+
+        if len(self._last_seen) > self.max_sessions:
+            self._evict_over_limit()
+
+    def _min_idle(self) -> float:
+        """
+        Не выгружаем тех, чьи изменения приложение ещё могло не передать в persistence:
+        иначе при следующей записи их состояние будет затёрто пустым.
+        """
+        persistence = self.application.persistence if self.application else None
+        return persistence.update_interval * 2 if persistence else 0
+
+    @staticmethod
+    def _busy(user_id: int) -> bool:
+        """Идёт гадание: его обработчики ещё меняют user_data, выгружать нельзя."""
+        task = divination_tasks.get(user_id)
+        return task is not None and not task.done()
+
+    def _evict_oldest(self, idle: float, keep: int) -> int:
+        """
+        Выгружает пользователей, неактивных дольше idle секунд, от давних к свежим,
+        пока в памяти больше keep. Занятые гаданием переносятся в конец очереди.
+        """
+        now = time.monotonic()
+        count = 0
+        # Каждый пользователь просматривается не больше одного раза
+        for _ in range(len(self._last_seen)):
+            if len(self._last_seen) <= keep:
+                break
+            user_id, last_seen = next(iter(self._last_seen.items()))
+            if now - last_seen < idle:
+                break
+            if self._busy(user_id):
+                self._last_seen.move_to_end(user_id)
+                continue
+            self._evict(user_id)
+            count += 1
+        return count
+
+    def _evict_over_limit(self) -> None:
+        """Выгружает давно неактивных пользователей сверх лимита."""
+        self._evict_oldest(self._min_idle(), self.max_sessions)
+
+    async def evict_idle(self) -> None:
+        """
+        Выгружает пользователей, неактивных дольше ttl (запускается по расписанию).
+        Корутина, чтобы планировщик выполнял её в цикле событий, а не в потоке рядом с touch().
+        """
+        count = self._evict_oldest(max(self.ttl, self._min_idle()), 0)
+        if count:
+            logger.info(f"Выгружено неактивных сессий: {count}, в памяти: {len(self._last_seen)}")
+
+    def _evict(self, user_id: int) -> None:
+        """Удаляет user_data из памяти, не трогая сохранённое состояние."""
+        self._last_seen.pop(user_id, None)
+        if self.application is None:
+            return
+
+        # Application.drop_user_data удалил бы и запись в persistence, а нам нужно освободить только память.
+        # Application._user_data — внутренний defaultdict python-telegram-bot 20.6 (requirements.txt);
+        # при обновлении библиотеки проверить, что user_data по-прежнему хранится в нём
+        self.application._user_data.pop(user_id, None)
+        persistence = self.application.persistence
+        if persistence is not None and hasattr(persistence, 'forget'):
+            persistence.forget(user_id)
+        self.evicted += 1
+
+    def stats(self) -> Dict:
+        """
+        Число сессий в памяти и их приблизительный объём: средний размер первых
+        SIZE_SAMPLE сессий, умноженный на их число.
+        """
+        user_data = self.application.user_data if self.application else {}
+        resident = len(user_data)
+        sample = list(islice(user_data.values(), SIZE_SAMPLE))
+        approx_bytes = sum(_approx_size(data) for data in sample) * resident // len(sample) if sample else 0
+        return {
+            'resident_sessions': resident,
+            'approx_bytes': approx_bytes,
+            'evicted_total': self.evicted,
+        }
+
+
+session_store = SessionStore()
@@ -0,0 +1,106 @@
+import hashlib
+import logging
+from collections import Counter
+from typing import Dict, Set, Tuple
+
+from utils.logging import setup_logging
+from utils.coordination import Coordinator, coordination
+from config import DUPLICATE_WINDOW
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+Key = Tuple[int, str, str]
+
+# Сколько держится отметка запроса, если экземпляр упал, не дождавшись ответа
+IN_FLIGHT_TTL = 300
+
+
+class SingleFlight:
+    """
+    Не даёт выполнить один и тот же запрос дважды одновременно.
+    Запрос считается дублем, пока исходный выполняется и ещё window секунд после.
+    Отметки запросов хранятся в координации (utils.coordination), поэтому при нескольких
+    экземплярах бота дубль узнаётся, даже если повтор пришёл на другой экземпляр.
+    """
+
+    def __init__(self, window: float = DUPLICATE_WINDOW, coordinator: Coordinator = coordination):
+        self.window = window
+        self.coordinator = coordinator
+        # Запросы, выполняющиеся в этом процессе
+        self._in_flight: Set[Key] = set()
+        self.suppressed = Counter()
+
+    @staticmethod
+    def make_key(user_id: int, mode: str, question: str) -> Key:
+        """Ключ запроса: пользователь, режим и хеш нормализованного вопроса."""
+        normalized = " ".join(question.lower().split())
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+        return (user_id, mode, digest)
+
+    @staticmethod
+    def _name(key: Key) -> str:
+        return "flight:{}:{}:{}".format(*key)
+
+    @staticmethod
+    def _done_name(key: Key) -> str:
+        return "flight-done:{}:{}:{}".format(*key)
+
+    async def acquire(self, key: Key) -> bool:
+        """Регистрирует запрос. Возвращает False, если это дубль."""
+        try:
+            acquired = await self.coordinator.claim(self._name(key), IN_FLIGHT_TTL)
+        except Exception as e:
+            # Без координации лучше выполнить возможный дубль, чем отказать в гадании
+            logger.error(f"Ошибка проверки повторного запроса: {e}")
+            acquired = True
+
+        if not acquired:
+            self.suppressed[key[1]] += 1
+            logger.info(
+                f"Подавлен повторный запрос пользователя {key[0]} в режиме {key[1]}",
+                extra={'sampled': True}
+            )
+            return False
+
+        self._in_flight.add(key)
+        return True
+
+    async def in_progress(self, key: Key) -> bool:
+        """Выполняется ли запрос сейчас (а не завершился недавно и ждёт конца окна дублей)."""
+        if key in self._in_flight:
+            return True
+        try:
+            return (await self.coordinator.is_claimed(self._name(key))
+                    and not await self.coordinator.is_claimed(self._done_name(key)))
+        except Exception as e:
+            logger.error(f"Ошибка проверки повторного запроса: {e}")
+            return False
+
+    async def release(self, key: Key, delivered: bool = True) -> None:
+        """
+        Отмечает запрос завершённым. Если ответ доставлен, окно дублей отсчитывается с этого момента;
+        иначе (отмена, нехватка лимитов, ошибка) тот же вопрос можно задать сразу.
+        """
+        self._in_flight.discard(key)
+        try:
+            if not delivered:
+                await self.coordinator.expire(self._name(key), 0)
+                return
+            if self.window > 0:
+                await self.coordinator.claim(self._done_name(key), self.window)
+            await self.coordinator.expire(self._name(key), self.window)
+        except Exception as e:
+            logger.error(f"Ошибка снятия отметки запроса, она истечёт через {IN_FLIGHT_TTL} с: {e}")
+
+    def stats(self) -> Dict:
+        """Текущее состояние и число подавленных дублей по режимам."""
+        return {
+            'in_flight': len(self._in_flight),
+            'suppressed_total': sum(self.suppressed.values()),
+            'suppressed_by_mode': dict(self.suppressed),
+        }
+
+
+divination_flights = SingleFlight()
@@ -0,0 +1,104 @@
+"""
+Дневная статистика бота.
+
+    python -m utils.stats backfill          # заново заполнить статистику по истории
+    python -m utils.stats show --days 30    # вывести статистику в консоль
+
+Счётчики ведутся хранилищем (utils.storage) вместе с записью гаданий, подписчиков и платежей;
+здесь — заполнение по истории и текст для администратора.
+"""
+import sys
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+from typing import List
+
+from utils.storage import init_db, get_daily_stats, backfill_stats
+from config import STATS_DAYS, STATS_BACKFILL_CHUNK
+
+# Названия видов гаданий для отчёта
+DIVINATION_NAMES = {
+    'one_rune': "Одна руна",
+    'three_runes': "Три руны",
+    'four_runes': "Четыре руны",
+    'fate': "Судьба",
+    'field': "Вспаханное поле",
+}
+
+
+def format_stats(stats: dict, days: int) -> str:
+    """Текст статистики для администратора: итоги периода, виды гаданий и строки по дням."""
+    by_day = {row['day']: row for row in stats['days']}
+    today = datetime.now().date()
+    period = [(today - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days - 1, -1, -1)]
+    rows = [by_day.get(day, {}) for day in period]
+
+    def total(column: str) -> int:
+        return sum(row.get(column, 0) for row in rows)
+
+    lines = [
+        f"Статистика за {days} дн.",
+        "",
+        f"Подписчиков всего: {stats['total_subscribers']}",
+        f"Новых подписчиков: {total('new_subscribers')}",
+        f"Гаданий: {total('divinations')}",
+        f"Активных в день (в среднем): {total('active_users') / days:.1f}",
+        f"Оплат: {total('payments')}, куплено лимитов: {total('credits_purchased')}",
+    ]
+
+    if stats['by_type']:
+        lines += ["", "Гадания по видам:"]
+        lines += [
+            f"{DIVINATION_NAMES.get(divination_type, divination_type)}: {count}"
+            for divination_type, count in stats['by_type'].items()
+        ]
+
+    lines += ["", "По дням (активные / новые / гадания / оплаты / лимиты):"]
+    for day, row in zip(period, rows):
+        lines.append(
+            f"{day[8:10]}.{day[5:7]}: {row.get('active_users', 0)} / {row.get('new_subscribers', 0)} / "
+            f"{row.get('divinations', 0)} / {row.get('payments', 0)} / {row.get('credits_purchased', 0)}"
+        )
+    return "\n".join(lines)
+
+
+async def _backfill(chunk_size: int) -> int:
+    await init_db()
+    result = await backfill_stats(chunk_size)
+    if result is None:
+        print("Не удалось заполнить статистику, подробности в логе")
+        return 1
+    print(
+        f"Статистика заполнена: дней {result['days']}, гаданий {result['divinations']}, "
+        f"платежей {result['payments']}"
+    )
+    return 0
+
+
+async def _show(days: int) -> int:
+    await init_db()
+    stats = await get_daily_stats(days)
+    if stats is None:
+        print("Не удалось прочитать статистику, подробности в логе")
+        return 1
+    print(format_stats(stats, days))
+    return 0
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Дневная статистика бота")
+    commands = parser.add_subparsers(dest='command', required=True)
+    backfill = commands.add_parser('backfill', help="заново заполнить статистику по истории")
+    backfill.add_argument('--chunk', type=int, default=STATS_BACKFILL_CHUNK,
+                          help="сколько записей пересчитывать одной транзакцией")
+    show = commands.add_parser('show', help="вывести статистику")
+    show.add_argument('--days', type=int, default=STATS_DAYS, help="за сколько последних дней")
+    args = parser.parse_args(argv)
+
+    if args.command == 'backfill':
+        return asyncio.run(_backfill(args.chunk))
+    return asyncio.run(_show(args.days))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
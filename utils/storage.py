@@ -0,0 +1,105 @@
+"""
+Хранилище данных бота: подписчики, лимиты, гадания, платежи, состояние диалогов и статистика.
+
+Реализация выбирается настройкой STORAGE_BACKEND:
+- sqlite — utils.database, файл SQLITE_DB;
+- postgres — utils.postgres, пул соединений asyncpg к POSTGRES_DSN.
+
+Остальной код импортирует функции отсюда, например:
+    from utils.storage import save_divination, deduct_limits
+Обе реализации проверяются одним набором тестов: benchmarks/storage_conformance.py.
+"""
+from typing import Protocol
+
+from config import STORAGE_BACKEND, POSTGRES_DSN, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX
+
+
+class Storage(Protocol):
+    """
+    Интерфейс хранилища. Функции не бросают исключений: ошибка пишется в лог,
+    а вызывающий получает значение «не удалось» (False, None, пустой список) — как в utils.database.
+    """
+
+    # Схема и соединения
+    async def init_db(self) -> None: ...
+    async def close_db(self) -> None: ...
+
+    # Подписчики и лимиты
+    async def save_subscriber(self, user_id: int) -> None: ...
+    async def get_subscribers(self) -> list[int]: ...
+    async def get_total_subscribers(self) -> int | None: ...
+    async def get_user_info_by_user_id(self, user_id: int) -> tuple[bool, str, int]: ...
+    async def get_user_limits(self, public_id: str) -> tuple[bool, int, int]: ...
+    async def top_up_limits(self, public_id: str, amount: int) -> tuple[bool, int]: ...
+    async def bulk_top_up_limits(self, entries: list[tuple], chunk_size: int) -> tuple[bool, list[tuple], list[str]]: ...
+    async def deduct_limits(self, user_id: int, amount: int) -> bool: ...
+    async def add_limits(self, user_id: int, amount: int) -> bool: ...
+    async def reset_daily_limits(self, limit: int) -> bool: ...
+
+    # Гадания
+    async def save_divination(self, user_id: int, divination_type: str, history: tuple | None = None) -> None: ...
+    async def get_history_page(self, user_id: int, limit: int, before_id: int | None = None,
+                               after_id: int | None = None) -> tuple[list[tuple], bool, bool] | None: ...
+    async def get_history_entry(self, user_id: int, divination_id: int) -> tuple | None: ...
+
+    # Состояние диалогов
+    async def load_user_state(self, user_id: int) -> tuple | None: ...
+    async def save_user_states(self, rows: list[tuple], deleted_ids: list[int]) -> bool: ...
+
+    # Платежи
+    async def add_pending_payment(self, payment_id: str, user_id: int, public_id: str, amount: float,
+                                  chat_id: int, created_at: float, next_check_at: float) -> bool: ...
+    async def get_due_payments(self, now: float, limit: int) -> list[dict]: ...
+    async def get_next_payment_check_at(self) -> float | None: ...
+    async def update_pending_payments(self, rescheduled: list[tuple], finished_ids: list[str]) -> bool: ...
+    async def get_pending_payment(self, payment_id: str) -> dict | None: ...
+    async def credit_payment(self, payment_id: str, user_id: int, amount: int,
+                             credited_at: float) -> tuple[bool, bool]: ...
+
+    # Статистика и выгрузка
+    async def get_daily_stats(self, days: int) -> dict | None: ...
+    async def backfill_stats(self, chunk_size: int) -> dict | None: ...
+    async def export_subscribers(self) -> list[tuple] | None: ...
+    async def export_divinations(self) -> list[tuple] | None: ...
+
+
+def load_backend(name: str) -> Storage:
+    """Реализация хранилища по имени из STORAGE_BACKEND."""
+    if name == "sqlite":
+        from utils import database
+        return database
+    if name == "postgres":
+        from utils.postgres import PostgresStorage
+        return PostgresStorage(POSTGRES_DSN, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX)
+    raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND={name!r}, ожидается sqlite или postgres")
+
+
+backend = load_backend(STORAGE_BACKEND)
+
+init_db = backend.init_db
+close_db = backend.close_db
+save_subscriber = backend.save_subscriber
+get_subscribers = backend.get_subscribers
+get_total_subscribers = backend.get_total_subscribers
+get_user_info_by_user_id = backend.get_user_info_by_user_id
+get_user_limits = backend.get_user_limits
+top_up_limits = backend.top_up_limits
+bulk_top_up_limits = backend.bulk_top_up_limits
+deduct_limits = backend.deduct_limits
+add_limits = backend.add_limits
+reset_daily_limits = backend.reset_daily_limits
+save_divination = backend.save_divination
+get_history_page = backend.get_history_page
+get_history_entry = backend.get_history_entry
+load_user_state = backend.load_user_state
+save_user_states = backend.save_user_states
+add_pending_payment = backend.add_pending_payment
+get_due_payments = backend.get_due_payments
+get_next_payment_check_at = backend.get_next_payment_check_at
+update_pending_payments = backend.update_pending_payments
+get_pending_payment = backend.get_pending_payment
+credit_payment = backend.credit_payment
+get_daily_stats = backend.get_daily_stats
+backfill_stats = backend.backfill_stats
+export_subscribers = backend.export_subscribers
+export_divinations = backend.export_divinations
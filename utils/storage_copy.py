@@ -0,0 +1,108 @@
+"""
+Перенос данных из SQLite в PostgreSQL.
+
+    SQLITE_DB=data/runes_bot.db POSTGRES_DSN=postgresql://user@host/runes_bot python -m utils.storage_copy
+    python -m utils.storage_copy --truncate       # очистить непустую базу PostgreSQL перед переносом
+
+Бот на время переноса должен быть остановлен. Сначала база SQLite приводится к текущей схеме
+(utils.database.init_db), затем таблицы копируются пачками через COPY одной транзакцией:
+при ошибке PostgreSQL остаётся в прежнем состоянии. В конце сверяется число строк.
+После переноса бот запускается с STORAGE_BACKEND=postgres.
+"""
+import sys
+import asyncio
+import sqlite3
+import argparse
+from typing import List
+
+import asyncpg
+
+from utils import database
+from utils.postgres import PostgresStorage
+from config import SQLITE_DB, POSTGRES_DSN
+
+# Таблицы в порядке переноса: (таблица, столбцы, порядок чтения из SQLite)
+TABLES = (
+    ('divination_types', ('id', 'name'), 'id'),
+    ('subscribers', ('user_id', 'first_seen', 'limits', 'public_id'), 'user_id'),
+    ('divinations', ('id', 'user_id', 'created_at', 'type_id'), 'id'),
+    ('divination_history', ('id', 'user_id', 'spread', 'question', 'answer'), 'id'),
+    ('user_state', ('user_id', 'mode', 'prompt_type', 'spread', 'admin_state', 'flags', 'extra'), 'user_id'),
+    ('pending_payments', ('payment_id', 'user_id', 'public_id', 'amount', 'chat_id', 'created_at',
+                          'next_check_at', 'attempts'), 'payment_id'),
+    # seq в PostgreSQL выдаётся по порядку вставки — читаем в порядке зачисления
+    ('payments_ledger', ('payment_id', 'user_id', 'amount', 'credited_at'), 'rowid'),
+    ('stats_daily', ('day', 'active_users', 'new_subscribers', 'divinations', 'payments', 'paying_users',
+                     'credits_purchased'), 'day'),
+    ('stats_divinations_daily', ('day', 'divination_type', 'count'), 'day, divination_type'),
+    ('stats_daily_users', ('day', 'kind', 'user_id'), 'day, kind, user_id'),
+)
+
+
+async def copy_tables(source: sqlite3.Connection, target: asyncpg.Connection, chunk_size: int) -> dict:
+    """Копирует все таблицы пачками по chunk_size строк. Возвращает число строк по таблицам."""
+    copied = {}
+    for table, columns, order in TABLES:
+        cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {order}")
+        copied[table] = 0
+        while rows := cursor.fetchmany(chunk_size):
+            await target.copy_records_to_table(table, records=rows, columns=columns)
+            copied[table] += len(rows)
+        print(f"{table}: {copied[table]}")
+
+    # Счётчики id продолжаются после перенесённых значений
+    await target.execute("""
+        SELECT setval(pg_get_serial_sequence('divinations', 'id'), COALESCE(MAX(id), 0) + 1, false)
+        FROM divinations
+    """)
+    await target.execute("""
+        SELECT setval(pg_get_serial_sequence('divination_types', 'id'), GREATEST(COALESCE(MAX(id), 0) + 1, 1000), false)
+        FROM divination_types
+    """)
+    return copied
+
+
+async def _copy(chunk_size: int, truncate: bool) -> int:
+    await database.init_db()
+    storage = PostgresStorage(POSTGRES_DSN, 1, 1)
+    await storage.init_db()
+    await storage.close_db()
+
+    source = sqlite3.connect(SQLITE_DB)
+    target = await asyncpg.connect(POSTGRES_DSN)
+    try:
+        tables = [table for table, _, _ in TABLES]
+        if not truncate:
+            for table in tables:
+                if table != 'divination_types' and await target.fetchval(f"SELECT EXISTS (SELECT 1 FROM {table})"):
+                    print(f"В PostgreSQL уже есть данные ({table}). Запустите с --truncate, чтобы заменить их")
+                    return 1
+
+        async with target.transaction():
+            await target.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY")
+            copied = await copy_tables(source, target, chunk_size)
+
+        mismatched = [
+            table for table in tables
+            if await target.fetchval(f"SELECT COUNT(*) FROM {table}") != copied[table]
+        ]
+        if mismatched:
+            print(f"Число строк не совпало: {', '.join(mismatched)}")
+            return 1
+        print("Перенос завершён")
+        return 0
+    finally:
+        await target.close()
+        source.close()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Перенос данных бота из SQLite в PostgreSQL")
+    parser.add_argument('--chunk', type=int, default=10_000, help="сколько строк передавать одной командой COPY")
+    parser.add_argument('--truncate', action='store_true', help="очистить таблицы PostgreSQL перед переносом")
+    args = parser.parse_args(argv)
+    return asyncio.run(_copy(args.chunk, args.truncate))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
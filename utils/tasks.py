@@ -0,0 +1,36 @@
+import asyncio
+from typing import Dict, Optional
+
+
+class UserTasks:
+    """Хранит не более одной фоновой задачи на пользователя."""
+
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def track(self, user_id: int, task: asyncio.Task) -> None:
+        """Запоминает задачу пользователя; после завершения она удаляется сама."""
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda done: self._forget(user_id, done))
+
+    def _forget(self, user_id: int, task: asyncio.Task) -> None:
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+    def get(self, user_id: int) -> Optional[asyncio.Task]:
+        return self._tasks.get(user_id)
+
+    def cancel(self, user_id: int) -> bool:
+        """Отменяет незавершённую задачу пользователя. Возвращает True, если было что отменять."""
+        task = self._tasks.pop(user_id, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+
+# Выполняющиеся гадания по user_id
+divination_tasks = UserTasks()
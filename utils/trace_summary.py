@@ -0,0 +1,140 @@
+"""
+Сводка по файлу трасс (TRACE_FILE).
+
+    python -m utils.trace_summary traces.jsonl traces.jsonl.1 --top 5
+
+Показывает перцентили длительности трасс и спанов, самые частые критические пути
+и дерево спанов самых медленных трасс.
+"""
+import sys
+import json
+import argparse
+from collections import defaultdict
+from typing import Dict, List
+
+
+def percentile(sorted_values: List[float], share: float) -> float:
+    """Перцентиль по отсортированному списку (ближайший ранг)."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(share * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def load_traces(paths: List[str]) -> List[Dict]:
+    traces = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    traces.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return traces
+
+
+def _children(trace: Dict) -> Dict:
+    children = defaultdict(list)
+    for span in trace['spans']:
+        children[span['parent']].append(span)
+    return children
+
+
+def critical_path(trace: Dict) -> List[str]:
+    """Цепочка спанов, которые закончились последними: именно они определили длительность трассы."""
+    children = _children(trace)
+    path = []
+    level = children[None]
+    while level:
+        last = max(level, key=lambda span: span['start_ms'] + span['duration_ms'])
+        path.append(last['name'])
+        level = children[last['id']]
+    return path
+
+
+def format_tree(trace: Dict) -> List[str]:
+    children = _children(trace)
+    lines = []
+
+    def walk(parent_id, depth):
+        for span in sorted(children[parent_id], key=lambda span: span['start_ms']):
+            error = f" ошибка: {span['error']}" if span.get('error') else ""
+            attrs = f" {span['attrs']}" if span.get('attrs') else ""
+            lines.append(
+                f"{'  ' * depth}{span['name']}: {span['duration_ms']:.1f} мс "
+                f"(старт +{span['start_ms']:.1f}){attrs}{error}"
+            )
+            walk(span['id'], depth + 1)
+
+    walk(None, 1)
+    return lines
+
+
+def summarize(traces: List[Dict], top: int) -> str:
+    if not traces:
+        return "Трасс нет"
+
+    lines = []
+    durations = sorted(trace['duration_ms'] for trace in traces)
+    lines.append(
+        f"Трасс: {len(traces)} (в выборке: {sum(1 for trace in traces if trace.get('sampled'))}, "
+        f"остальные записаны как медленные)"
+    )
+    lines.append(
+        f"Длительность, мс: p50 {percentile(durations, 0.5):.1f}, p90 {percentile(durations, 0.9):.1f}, "
+        f"p99 {percentile(durations, 0.99):.1f}, max {durations[-1]:.1f}"
+    )
+
+    # Перцентили по спанам
+    by_name = defaultdict(list)
+    for trace in traces:
+        for span in trace['spans']:
+            by_name[span['name']].append(span['duration_ms'])
+
+    lines.append("")
+    lines.append(f"{'span':<32} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'всего':>11}")
+    for name, values in sorted(by_name.items(), key=lambda item: sum(item[1]), reverse=True):
+        values.sort()
+        lines.append(
+            f"{name[:32]:<32} {len(values):>7} {percentile(values, 0.5):>9.1f} {percentile(values, 0.9):>9.1f} "
+            f"{percentile(values, 0.99):>9.1f} {values[-1]:>9.1f} {sum(values):>11.1f}"
+        )
+
+    # Критические пути
+    paths = defaultdict(list)
+    for trace in traces:
+        paths[' → '.join(critical_path(trace))].append(trace['duration_ms'])
+
+    lines.append("")
+    lines.append("Критические пути:")
+    for path, values in sorted(paths.items(), key=lambda item: sum(item[1]), reverse=True)[:top]:
+        lines.append(f"  {len(values):>5} × {sum(values) / len(values):>9.1f} мс  {path}")
+
+    # Самые медленные трассы
+    lines.append("")
+    lines.append(f"Самые медленные трассы ({top}):")
+    for trace in sorted(traces, key=lambda trace: trace['duration_ms'], reverse=True)[:top]:
+        lines.append(
+            f"- {trace['trace_id']}: {trace['duration_ms']:.1f} мс, user_id {trace.get('user_id')}, "
+            f"update_id {trace.get('update_id')}, ожидание очереди {trace.get('lock_wait_ms', 0)} мс"
+        )
+        lines += format_tree(trace)
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Сводка по файлу трасс бота")
+    parser.add_argument('paths', nargs='*', default=['traces.jsonl'], help="файлы трасс (JSONL)")
+    parser.add_argument('--top', type=int, default=5, help="сколько путей и медленных трасс показать")
+    parser.add_argument('--min-ms', type=float, default=0, help="учитывать только трассы не быстрее стольких мс")
+    args = parser.parse_args(argv)
+
+    traces = [trace for trace in load_traces(args.paths) if trace['duration_ms'] >= args.min_ms]
+    print(summarize(traces, args.top))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
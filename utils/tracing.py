@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+from contextvars import ContextVar
+from functools import wraps
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from typing import List, Optional
+
+from config import TRACE_SAMPLE_RATE, TRACE_SLOW_MS, TRACE_FILE, TRACE_FILE_MAX_BYTES
+
+# Трассировка включена, если что-то из трасс будет записано
+ENABLED = TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_MS > 0
+
+# Текущий span; задачи, созданные внутри span, наследуют его как родителя
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+_trace_logger: Optional[logging.Logger] = None
+
+
+def _get_trace_logger() -> logging.Logger:
+    """Логгер, который пишет трассы в TRACE_FILE из отдельного потока."""
+    global _trace_logger
+    if _trace_logger is None:
+        file_handler = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=5, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+
+        trace_queue = queue.SimpleQueue()
+        listener = QueueListener(trace_queue, file_handler)
+        listener.start()
+        atexit.register(listener.stop)
+
+        trace_logger = logging.getLogger('runes_bot.traces')
+        trace_logger.propagate = False
+        trace_logger.setLevel(logging.INFO)
+        trace_logger.handlers = [QueueHandler(trace_queue)]
+        _trace_logger = trace_logger
+    return _trace_logger
+
+
+class Trace:
+    """
+    Спаны одного апдейта.
+    Трасса завершается, когда закрыт последний её span (включая спаны фоновых задач).
+    Записывается, если попала в выборку или оказалась медленнее TRACE_SLOW_MS.
+    """
+
+    __slots__ = ('trace_id', 'sampled', 'started', 'started_at', 'spans', 'open_spans', 'finished', 'attrs')
+
+    def __init__(self, attrs: dict):
+        self.trace_id = os.urandom(8).hex()
+        self.sampled = random.random() < TRACE_SAMPLE_RATE
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        self.open_spans = 0
+        self.finished = False
+        self.attrs = attrs
+
+    def _span_finished(self) -> None:
+        self.open_spans -= 1
+        if self.open_spans:
+            return
+        self.finished = True
+
+        duration_ms = max(
+            (span.started - self.started) * 1000 + span.duration_ms for span in self.spans
+        )
+        if self.sampled or (TRACE_SLOW_MS and duration_ms >= TRACE_SLOW_MS):
+            self._write(duration_ms)
+
+    def _write(self, duration_ms: float) -> None:
+        record = {
+            'trace_id': self.trace_id,
+            'ts': round(self.started_at, 3),
+            'duration_ms': round(duration_ms, 1),
+            'sampled': self.sampled,
+            **self.attrs,
+            'spans': [span.to_dict(self.started) for span in self.spans],
+        }
+        try:
+            _get_trace_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Не удалось записать трассу: {e}")
+
+
+class Span:
+    """Участок работы внутри трассы. Используется как контекстный менеджер (with span(...))."""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'attrs', 'started', 'duration_ms', 'error', '_token')
+
+    def __init__(self, trace: Trace, parent: Optional['Span'], name: str, attrs: dict):
+        self.trace = trace
+        self.span_id = len(trace.spans)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.attrs = attrs
+        self.started = 0.0
+        self.duration_ms = 0.0
+        self.error = None
+        self._token = None
+
+    def __enter__(self) -> 'Span':
+        self.trace.spans.append(self)
+        self.trace.open_spans += 1
+        self.started = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        _current_span.reset(self._token)
+        self.trace._span_finished()
+
+    def to_dict(self, trace_started: float) -> dict:
+        data = {
+            'id': self.span_id,
+            'parent': self.parent_id,
+            'name': self.name,
+            'start_ms': round((self.started - trace_started) * 1000, 1),
+            'duration_ms': round(self.duration_ms, 1),
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class _NoopSpan:
+    """Заглушка вне трассы: ничего не замеряет."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def start_trace(name: str, **attrs):
+    """Корневой span нового апдейта."""
+    if not ENABLED:
+        return _NOOP
+    return Span(Trace(attrs), None, name, {})
+
+
+def span(name: str, **attrs):
+    """Вложенный span текущей трассы; вне трассы ничего не делает."""
+    parent = _current_span.get()
+    if parent is None or parent.trace.finished:
+        return _NOOP
+    return Span(parent.trace, parent, name, attrs)
+
+
+def hold_for_task(task) -> None:
+    """
+    Не завершает текущую трассу, пока не закончится task.
+    Нужно для фоновых задач, чьи спаны должны попасть в трассу апдейта.
+    """
+    current = _current_span.get()
+    if current is None or current.trace.finished:
+        return
+    trace = current.trace
+    trace.open_spans += 1
+    task.add_done_callback(lambda _: trace._span_finished())
+
+
+def traced(name: str = None):
+    """Декоратор: корутина выполняется внутри span с её именем."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
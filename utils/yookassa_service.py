@@ -1,13 +1,100 @@
-from yookassa import Configuration, Payment
-from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY
+from config import (
+    YOOKASSA_SHOP_ID,
+    YOOKASSA_SECRET_KEY,
+    YOOKASSA_API_URL,
+    YOOKASSA_TIMEOUT,
+    YOOKASSA_RETRIES,
+    YOOKASSA_POOL_SIZE,
+)
+from typing import Optional
+import uuid
 import asyncio
 import logging
+import aiohttp
+
+from utils.tracing import span
 
 
 logger = logging.getLogger(__name__)
 
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class YooKassaError(Exception):
+    """Ошибка запроса к API Юкассы"""
+
+
+class YooKassaClient:
+    """
+    Асинхронный клиент API Юкассы на общей HTTP-сессии.
+    Запросы с ошибкой сети или ответом 429/5xx повторяются с нарастающей паузой;
+    создание платежа повторяется с тем же ключом идемпотентности, поэтому второй платёж не появится.
+    """
+
+    def __init__(self, shop_id: str, secret_key: str, api_url: str = YOOKASSA_API_URL,
+                 timeout: float = YOOKASSA_TIMEOUT, retries: int = YOOKASSA_RETRIES,
+                 pool_size: int = YOOKASSA_POOL_SIZE):
+        self.api_url = api_url.rstrip('/')
+        self.auth = aiohttp.BasicAuth(str(shop_id or ''), secret_key or '')
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                auth=self.auth,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, method: str, path: str, json: dict = None, idempotence_key: str = None) -> dict:
+        """Выполняет запрос с повторами и возвращает JSON-ответ."""
+        headers = {}
+        if idempotence_key:
+            headers['Idempotence-Key'] = idempotence_key
+
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                with span('yookassa', method=method, path=path, attempt=attempt):
+                    async with self._get_session().request(
+                        method, f"{self.api_url}{path}", json=json, headers=headers
+                    ) as response:
+                        if response.status in RETRY_STATUSES:
+                            last_error = YooKassaError(f"{method} {path}: HTTP {response.status}")
+                            continue
+                        data = await response.json(content_type=None)
+                        if response.status >= 400:
+                            raise YooKassaError(f"{method} {path}: HTTP {response.status} {data}")
+                        return data
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+
+        raise YooKassaError(f"{method} {path}: попытки исчерпаны ({last_error})")
+
+    async def create_payment(self, payment_data: dict) -> dict:
+        return await self.request('POST', '/payments', json=payment_data, idempotence_key=str(uuid.uuid4()))
 
-Configuration.configure(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, sandbox=True)
+    async def find_payment(self, payment_id: str) -> dict:
+        return await self.request('GET', f'/payments/{payment_id}')
+
+
+client = YooKassaClient(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY)
+
+
+# Магазин ЮКассы общий с другим ботом: свои платежи отмечаются в metadata
+BOT_NAME = "runes_bot"
 
 
 async def create_payment(user_id: int, amount: float, public_id: str) -> tuple[str | None, str | None]:
@@ -27,12 +114,12 @@ async def create_payment(user_id: int, amount: float, public_id: str) -> tuple[s
             "metadata": {
                 "user_id": user_id,
                 "public_id": public_id,
-                "bot_name": "runes_bot"
+                "bot_name": BOT_NAME
             }
         }
 
-        payment = await asyncio.to_thread(Payment.create, payment_data)
-        return payment.confirmation.confirmation_url, payment.id
+        payment = await client.create_payment(payment_data)
+        return payment["confirmation"]["confirmation_url"], payment["id"]
     
     except Exception as e:
         logger.error(f"Ошибка создания платежа для user_id {user_id}: {e}")
@@ -42,8 +129,28 @@ async def create_payment(user_id: int, amount: float, public_id: str) -> tuple[s
 async def check_payment_status(payment_id):
     """Проверка статуса платежа в Юкассе"""
     try:
-        payment = await asyncio.to_thread(Payment.find_one, payment_id)
-        return payment.status
+        payment = await client.find_payment(payment_id)
+        return payment["status"]
     except Exception as e:
         logger.error(f"Ошибка проверки статуса платежа {payment_id}: {e}")
         return None
+
+
+async def get_payment_info(payment_id: str) -> dict | None:
+    """Получение статуса, суммы и metadata платежа из Юкассы"""
+    try:
+        payment = await client.find_payment(payment_id)
+        return {
+            'id': payment['id'],
+            'status': payment['status'],
+            'amount': float(payment['amount']['value']),
+            'metadata': dict(payment.get('metadata') or {}),
+        }
+    except Exception as e:
+        logger.error(f"Ошибка получения платежа {payment_id}: {e}")
+        return None
+
+
+async def close_yookassa_session() -> None:
+    """Закрывает HTTP-сессию Юкассы (при остановке бота)."""
+    await client.close()
@@ -0,0 +1,108 @@
+import logging
+from typing import Optional
+
+from aiohttp import web
+
+from utils.storage import get_pending_payment, update_pending_payments
+from utils.payment_poller import credit_successful_payment
+from utils.yookassa_service import get_payment_info, BOT_NAME
+from utils.logging import setup_logging
+from config import YOOKASSA_WEBHOOK_LISTEN, YOOKASSA_WEBHOOK_PORT, YOOKASSA_WEBHOOK_PATH
+
+# Инициализация логгера
+logger = logging.getLogger(__name__)
+setup_logging()
+
+HANDLED_EVENTS = ('payment.succeeded', 'payment.canceled')
+
+
+class YooKassaWebhook:
+    """
+    Приём HTTP-уведомлений ЮКассы о платежах.
+
+    Уведомлению не доверяем: статус и сумма платежа перечитываются из API ЮКассы.
+    Зачисление идёт через payments_ledger, поэтому повторное уведомление
+    или опрос, сработавший одновременно с уведомлением, не начислят лимиты дважды.
+    """
+
+    def __init__(self, listen: str = YOOKASSA_WEBHOOK_LISTEN, port: int = YOOKASSA_WEBHOOK_PORT,
+                 path: str = YOOKASSA_WEBHOOK_PATH):
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.bot = None
+        self._runner: Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_notification)
+        return app
+
+    async def start(self, bot) -> None:
+        """Запускает HTTP-сервер уведомлений, если задан порт."""
+        self.bot = bot
+        if not self.port:
+            return
+
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Уведомления ЮКассы принимаются на {self.listen}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_notification(self, request: web.Request) -> web.Response:
+        """Обрабатывает одно уведомление. Не 200 — ЮКасса повторит уведомление позже."""
+        try:
+            body = await request.json()
+            event = body.get('event')
+            payment_id = (body.get('object') or {}).get('id')
+        except Exception:
+            return web.Response(status=400)
+
+        if event not in HANDLED_EVENTS or not payment_id:
+            return web.Response(status=200)
+
+        # Проверяем уведомление, запрашивая платёж у ЮКассы
+        payment = await get_payment_info(payment_id)
+        if payment is None:
+            return web.Response(status=503)
+
+        if payment['status'] == 'succeeded':
+            if not await self._credit(payment):
+                return web.Response(status=503)
+        elif payment['status'] == 'canceled':
+            logger.info(f"Платеж {payment_id} отменен")
+            await update_pending_payments([], [payment_id])
+
+        return web.Response(status=200)
+
+    async def _credit(self, payment: dict) -> bool:
+        """Зачисляет успешный платёж. Данные берём из очереди проверки, иначе — из metadata платежа."""
+        pending = await get_pending_payment(payment['id'])
+        if pending is None:
+            metadata = payment['metadata'] or {}
+            if metadata.get('bot_name') != BOT_NAME:
+                # Магазин общий с другим ботом: чужие платежи не зачисляем
+                logger.info(f"Платеж {payment['id']} создан не этим ботом ({metadata.get('bot_name')}), пропускаем")
+                return True
+            try:
+                user_id = int(metadata['user_id'])
+            except (KeyError, TypeError, ValueError):
+                logger.error(f"В платеже {payment['id']} нет user_id")
+                return True
+            pending = {
+                'payment_id': payment['id'],
+                'user_id': user_id,
+                'amount': payment['amount'],
+                'chat_id': user_id,
+            }
+
+        # Зачисляем подтверждённую ЮКассой сумму
+        return await credit_successful_payment(self.bot, {**pending, 'amount': payment['amount']})
+
+
+yookassa_webhook = YooKassaWebhook()